@@ -0,0 +1,294 @@
+"""
+Benchmarks for the parse, build, route and request handler hot paths.
+
+    python benchmark.py --repetitions 50 --save-baseline baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.25
+
+Every benchmark is warmed up, then timed call by call with time.perf_counter; the report has the mean and the p50, p90
+and p99 latencies, and the peak memory the Python allocator saw during one extra, untimed call (tracemalloc slows
+the call down, so it is never timed). Files are written to a temporary directory, never to the data/ files the server
+reads. Results are saved as JSON baselines, and a later run compared against one exits with status 1 if the p50 of
+any benchmark regressed by more than the tolerance.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional
+
+import graph as graph_utils
+import registry
+import request_handler
+import response_cache
+from graph import Graph, NodeType
+
+BASELINE_FORMAT_VERSION = 1
+
+WARMUP = 3
+REPETITIONS = 30
+TOLERANCE = 0.2  # relative p50 slowdown reported as a regression
+CACHED_REQUESTS = 8  # distinct requests request_handler_cached replays
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    warmup: int
+    repetitions: int
+    mean: float  # seconds
+    min: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+    peak_memory: int  # bytes allocated at the peak of one call
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline_p50: float
+    p50: float
+
+    @property
+    def slowdown(self) -> float:
+        return self.p50 / self.baseline_p50 - 1
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """
+    q-th percentile (0 <= q <= 100) of sorted samples, interpolated linearly between the closest ranks
+    """
+    assert sorted_samples, "No samples"
+    rank = (len(sorted_samples) - 1) * q / 100
+    lo, hi = math.floor(rank), math.ceil(rank)
+    return sorted_samples[lo] + (sorted_samples[hi] - sorted_samples[lo]) * (rank - lo)
+
+
+def run_benchmark(name: str, fn: Callable[[], object], warmup: int = WARMUP, repetitions: int = REPETITIONS,
+                  setup: Optional[Callable[[], object]] = None) -> BenchmarkResult:
+    """
+    Times repetitions calls of fn after warmup untimed ones. setup, if given, runs before every call and is not timed.
+    """
+    assert repetitions > 0
+
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+
+    samples = []
+    for _ in range(repetitions):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    samples.sort()
+    return BenchmarkResult(name=name, warmup=warmup, repetitions=repetitions, mean=sum(samples) / len(samples),
+                           min=samples[0], p50=percentile(samples, 50), p90=percentile(samples, 90),
+                           p99=percentile(samples, 99), max=samples[-1], peak_memory=peak_memory)
+
+
+def run_suite(warmup: int = WARMUP, repetitions: int = REPETITIONS,
+              only: Optional[List[str]] = None) -> List[BenchmarkResult]:
+    """
+    Runs every benchmark, or the ones named in only, on the campus data
+    """
+    benchmarks = _campus_benchmarks()
+    if only is not None:
+        unknown = set(only) - set(benchmarks)
+        if unknown:
+            raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        benchmarks = {name: benchmark for name, benchmark in benchmarks.items() if name in only}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        return [run_benchmark(name, fn, warmup, repetitions, setup) for name, (fn, setup) in
+                ((name, benchmark(temp_dir)) for name, benchmark in benchmarks.items())]
+
+
+def _campus_benchmarks() -> Dict[str, Callable[[str], tuple]]:
+    """
+    name -> function of the temporary directory returning (fn, setup). The graph inputs are built once up front, so
+    each benchmark only times its own stage.
+    """
+    polygons = graph_utils.parse_polygons(graph_utils.POLYGONS_CSV_FILE_PATH)
+    nodes_stairs = graph_utils.parse_nodes(graph_utils.NODES_STAIRS_CSV_FILE_PATH, polygons, None, NodeType.STAIR)
+    nodes_elevators = graph_utils.parse_nodes(graph_utils.NODES_ELEVATORS_CSV_FILE_PATH, polygons, None,
+                                              NodeType.ELEVATOR)
+    nodes_0 = graph_utils.parse_nodes(graph_utils.NODES_0_CSV_FILE_PATH, polygons, 0)
+    nodes_1 = graph_utils.parse_nodes(graph_utils.NODES_1_CSV_FILE_PATH, polygons, 1)
+    edges_0 = graph_utils.parse_edges(graph_utils.EDGES_0_CSV_FILE_PATH, nodes_0)
+    edges_1 = graph_utils.parse_edges(graph_utils.EDGES_1_CSV_FILE_PATH, nodes_1)
+    nodes = nodes_stairs + nodes_elevators + nodes_0 + nodes_1
+    graph = graph_utils.create_graph(nodes, edges_0 + edges_1, num_floors=2)
+
+    building_nodes = [graph.get_node(node_id) for node_id in sorted(graph.get_nodes_by_type(NodeType.BUILDING))]
+    sources = itertools.cycle(node.id for node in building_nodes)
+    points = itertools.cycle(building_nodes)
+
+    def sssp():
+        graph.sssp(next(sources))
+
+    def closest_node():
+        node = next(points)
+        graph.get_closest_node(node.location, floor=node.floor)
+
+    def current_building():
+        graph_utils.get_current_building(polygons, next(points).location)
+
+    def load_json(temp_dir: str):
+        graph_json, apsp_json = os.path.join(temp_dir, "graph.json"), os.path.join(temp_dir, "apsp.json")
+        graph.save_to_json(graph_json)
+        graph.save_apsp_to_json(apsp_json)
+
+        def load():
+            loaded = Graph()
+            loaded.load_from_json(graph_json)
+            loaded.load_apsp_from_json(apsp_json)
+        return load, None
+
+    def save_json(temp_dir: str):
+        graph_json, apsp_json = os.path.join(temp_dir, "saved_graph.json"), os.path.join(temp_dir, "saved_apsp.json")
+        apsp = graph.apsp()
+
+        def save():
+            graph.save_to_json(graph_json)
+            graph.save_apsp_to_json(apsp_json, apsp=apsp)
+        return save, None
+
+    def handler(cached: bool):
+        def benchmark(temp_dir: str):
+            # the handler serves the registry's graph, which is loaded from the JSON cache rather than the CSVs
+            _, served_graph = registry.get_graph_components()
+            served_nodes = [served_graph.get_node(node_id) for node_id in
+                            sorted(served_graph.get_nodes_by_type(NodeType.BUILDING))]
+            served_destinations = sorted(served_graph.get_building_names(), key=str)
+
+            def values(i: int) -> dict:
+                node = served_nodes[i % len(served_nodes)]
+                return {"user_id": f"benchmark-{i}", "lat": str(node.location.lat), "lon": str(node.location.lon),
+                        "current_floor": str(node.floor),
+                        "destination": str(served_destinations[i % len(served_destinations)]),
+                        "destination_floor": "1"}
+
+            if cached:
+                # a few devices polling from where they stand, primed once so that every call replays a cached key
+                replayed = [values(i) for i in range(CACHED_REQUESTS)]
+                for request_values in replayed:
+                    request_handler.request_handler({"method": "GET", "values": request_values})
+                replay = itertools.cycle(replayed)
+                return lambda: request_handler.request_handler({"method": "GET", "values": next(replay)}), None
+
+            counter = itertools.count()
+
+            def request():
+                # a new user_id per call, so every request routes instead of advancing a session
+                request_handler.request_handler({"method": "GET", "values": values(next(counter))})
+
+            def setup():
+                response_cache.get_response_cache().clear()
+            return request, setup
+        return benchmark
+
+    def stage(fn: Callable[[], object]):
+        return lambda temp_dir: (fn, None)
+
+    return {
+        "parse_polygons": stage(lambda: graph_utils.parse_polygons(graph_utils.POLYGONS_CSV_FILE_PATH)),
+        "parse_nodes": stage(lambda: graph_utils.parse_nodes(graph_utils.NODES_1_CSV_FILE_PATH, polygons, 1)),
+        "parse_edges": stage(lambda: graph_utils.parse_edges(graph_utils.EDGES_1_CSV_FILE_PATH, nodes_1)),
+        "create_graph": stage(lambda: graph_utils.create_graph(nodes, edges_0 + edges_1, num_floors=2)),
+        "sssp": stage(sssp),
+        "apsp": stage(graph.apsp),
+        "save_json": save_json,
+        "load_json": load_json,
+        "get_closest_node": stage(closest_node),
+        "get_current_building": stage(current_building),
+        "request_handler": handler(cached=False),
+        "request_handler_cached": handler(cached=True),
+    }
+
+
+def save_baseline(results: List[BenchmarkResult], json_file_path: str):
+    with open(json_file_path, "w") as f:
+        json.dump({
+            "version": BASELINE_FORMAT_VERSION,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": [asdict(result) for result in results],
+        }, f, indent=2)
+
+
+def load_baseline(json_file_path: str) -> Dict[str, BenchmarkResult]:
+    with open(json_file_path, "r") as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported baseline version {baseline.get('version')}")
+    return {result["name"]: BenchmarkResult(**result) for result in baseline["results"]}
+
+
+def find_regressions(results: List[BenchmarkResult], baseline: Dict[str, BenchmarkResult],
+                     tolerance: float = TOLERANCE) -> List[Regression]:
+    """
+    Benchmarks whose p50 is more than tolerance slower than in baseline. Benchmarks missing from it are skipped.
+    """
+    return [Regression(name=result.name, baseline_p50=baseline[result.name].p50, p50=result.p50)
+            for result in results
+            if result.name in baseline and result.p50 > baseline[result.name].p50 * (1 + tolerance)]
+
+
+def format_results(results: List[BenchmarkResult]) -> str:
+    lines = [f"{'benchmark':<24}{'mean':>11}{'p50':>11}{'p90':>11}{'p99':>11}{'peak mem':>12}"]
+    for result in results:
+        lines.append(f"{result.name:<24}" +
+                     "".join(f"{value * 1e3:>9.3f}ms" for value in (result.mean, result.p50, result.p90, result.p99)) +
+                     f"{result.peak_memory / 1024:>10.1f}KB")
+    return "\n".join(lines)
+
+
+def main(args: argparse.Namespace) -> int:
+    results = run_suite(args.warmup, args.repetitions, args.only)
+    print(format_results(results))
+
+    if args.save_baseline is not None:
+        save_baseline(results, args.save_baseline)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline is not None:
+        regressions = find_regressions(results, load_baseline(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression.name}: p50 {regression.baseline_p50 * 1e3:.3f}ms -> "
+                  f"{regression.p50 * 1e3:.3f}ms (+{regression.slowdown:.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the navigation hot paths.")
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--repetitions", type=int, default=REPETITIONS)
+    parser.add_argument("--only", nargs="+", default=None, help="benchmark names to run")
+    parser.add_argument("--save-baseline", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    sys.exit(main(parser.parse_args()))
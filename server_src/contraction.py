@@ -0,0 +1,263 @@
+"""
+Contraction hierarchy over a Graph, for campus-scale graphs where a full APSP table does not fit in memory.
+
+Nodes are contracted one at a time, least important first (edge difference plus number of contracted neighbors,
+updated lazily). Contracting v removes it from the remaining graph and adds a shortcut u - w, with v as its middle node,
+for every pair of remaining neighbors whose shortest path goes through v, unless a witness search finds a path of at
+most the same length around v. Every node keeps its edges to the nodes contracted after it ("upward" edges).
+
+A shortest path always climbs and then descends the hierarchy, so a query only searches upward from both ends: from
+the source, and from every target node of a (building, floor) group. The upward search space of a group is computed
+once and kept, so a find_shortest_path query is a single small upward search from the source.
+
+The shortcuts and node order are saved next to graph.json and tied to the graph by its fingerprint.
+"""
+import heapq
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+import graph as graph_utils
+from graph import Graph, NodeType, Route
+
+# # use this path if working locally
+# CH_JSON_FILE_PATH = "data/ch.json"
+
+# this path is used server side
+CH_JSON_FILE_PATH = "/var/jail/home/team8/server_src/data/ch.json"
+
+CH_FORMAT_VERSION = 1
+
+# witness searches give up after settling this many nodes and keep the shortcut, which is always correct
+WITNESS_SETTLED_LIMIT = 64
+
+SearchSpace = Tuple[Dict[str, float], Dict[str, Optional[str]]]  # (distance, parent) of an upward search
+
+
+class ContractionHierarchy:
+
+    def __init__(self, graph: Graph, order: List[str], shortcuts: Dict[Tuple[str, str], Tuple[float, str]]):
+        """
+        order lists the node ids from first to last contracted. shortcuts maps (u, w), in both directions, to the
+        shortcut's (weight, middle node).
+        """
+        self.graph = graph
+        self.order = order
+        self.rank = {node_id: i for i, node_id in enumerate(order)}
+        self.shortcuts = shortcuts
+        self.fingerprint = graph.fingerprint()
+
+        # node_id -> {higher node: weight}
+        self.up: Dict[str, Dict[str, float]] = {node_id: dict() for node_id in order}
+        for v1_id, neighbors in graph.adj.items():
+            for v2_id, weight in neighbors.items():
+                if self.rank[v2_id] > self.rank[v1_id]:
+                    self.up[v1_id][v2_id] = weight
+        for (v1_id, v2_id), (weight, _) in shortcuts.items():
+            if self.rank[v2_id] > self.rank[v1_id]:
+                self.up[v1_id][v2_id] = weight
+
+        self._group_search_spaces: Dict[Tuple[str, int], SearchSpace] = dict()
+
+    @classmethod
+    def build(cls, graph: Graph, witness_settled_limit: int = WITNESS_SETTLED_LIMIT) -> "ContractionHierarchy":
+        remaining = {node_id: dict(neighbors) for node_id, neighbors in graph.adj.items()}
+        shortcuts: Dict[Tuple[str, str], Tuple[float, str]] = dict()
+        contracted_neighbors = {node_id: 0 for node_id in remaining}
+
+        def find_shortcuts(v: str) -> List[Tuple[str, str, float]]:
+            neighbors = sorted(remaining[v])
+            found = []
+            for i, u in enumerate(neighbors):
+                max_weight = max((remaining[v][u] + remaining[v][w] for w in neighbors[i + 1:]), default=0)
+                witness_dist = _witness_search(remaining, u, v, max_weight, witness_settled_limit)
+                for w in neighbors[i + 1:]:
+                    weight = remaining[v][u] + remaining[v][w]
+                    if witness_dist.get(w, float('inf')) > weight:
+                        found.append((u, w, weight))
+            return found
+
+        def priority(v: str) -> int:
+            return len(find_shortcuts(v)) - len(remaining[v]) + contracted_neighbors[v]
+
+        pq = [(priority(v), v) for v in sorted(remaining)]
+        heapq.heapify(pq)
+        order = []
+        while pq:
+            (_, v) = heapq.heappop(pq)
+            current_priority = priority(v)
+            if pq and current_priority > pq[0][0]:
+                heapq.heappush(pq, (current_priority, v))  # lazy update, v became more important
+                continue
+
+            for u, w, weight in find_shortcuts(v):
+                if weight < remaining[u].get(w, float('inf')):
+                    remaining[u][w] = remaining[w][u] = weight
+                    shortcuts[(u, w)] = shortcuts[(w, u)] = (weight, v)
+
+            for n in remaining[v]:
+                del remaining[n][v]
+                contracted_neighbors[n] += 1
+            del remaining[v]
+            order.append(v)
+
+        return cls(graph, order, shortcuts)
+
+    @property
+    def num_shortcuts(self) -> int:
+        return len(self.shortcuts) // 2
+
+    def _upward_search(self, sources: Set[str]) -> SearchSpace:
+        dist = {source: 0 for source in sources}
+        parent = {source: None for source in sources}
+        pq = [(0, source) for source in sorted(sources)]
+        while pq:
+            (d, current_vertex) = heapq.heappop(pq)
+            if d > dist[current_vertex]:
+                continue  # stale entry
+            for n, edge_weight in self.up[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist.get(n, float('inf')):
+                    heapq.heappush(pq, (new_cost, n))
+                    dist[n] = new_cost
+                    parent[n] = current_vertex
+        return dist, parent
+
+    def _group_search_space(self, building_name: str, floor: int) -> SearchSpace:
+        key = (building_name, floor)
+        if key not in self._group_search_spaces:
+            targets = self.graph.get_nodes_by_building_and_floor_and_type(building_name, floor, NodeType.BUILDING)
+            self._group_search_spaces[key] = self._upward_search(targets)
+        return self._group_search_spaces[key]
+
+    def _unpack(self, v1_id: str, v2_id: str, path: List[str]):
+        """
+        Appends the original nodes of edge (v1, v2), without v1, to path
+        """
+        stack = [(v1_id, v2_id)]
+        while stack:
+            u, w = stack.pop()
+            shortcut = self.shortcuts.get((u, w))
+            if shortcut is None:
+                path.append(w)
+            else:
+                stack.append((shortcut[1], w))
+                stack.append((u, shortcut[1]))
+
+    def _route(self, src: str, forward: SearchSpace, backward: SearchSpace) -> Route:
+        forward_dist, forward_parent = forward
+        backward_dist, backward_parent = backward
+
+        meeting_node = None
+        best = float('inf')
+        for node_id, d in forward_dist.items():
+            total = d + backward_dist.get(node_id, float('inf'))
+            if total < best or (total == best and meeting_node is not None and node_id < meeting_node):
+                best = total
+                meeting_node = node_id
+        if meeting_node is None:
+            return Route(source=src, destination=None, path=None, distance=float('inf'))
+
+        hierarchy_path = [meeting_node]
+        while forward_parent[hierarchy_path[-1]] is not None:
+            hierarchy_path.append(forward_parent[hierarchy_path[-1]])
+        hierarchy_path.reverse()
+        while backward_parent[hierarchy_path[-1]] is not None:
+            hierarchy_path.append(backward_parent[hierarchy_path[-1]])
+
+        path = [src]
+        for v1_id, v2_id in zip(hierarchy_path, hierarchy_path[1:]):
+            self._unpack(v1_id, v2_id, path)
+
+        # distances are re-accumulated from src so they match Graph's searches exactly
+        distance = 0
+        for v1_id, v2_id in zip(path, path[1:]):
+            distance += self.graph.adj[v1_id][v2_id]
+        return Route(source=src, destination=path[-1], path=path, distance=distance)
+
+    def find_shortest_path(self, src: str, building_name: str, floor: int = 1) -> Route:
+        assert self.graph.contains_node(src)
+        return self._route(src, self._upward_search({src}), self._group_search_space(building_name, floor))
+
+    def find_route_to_node(self, src: str, dest: str) -> Route:
+        assert self.graph.contains_node(src)
+        assert self.graph.contains_node(dest)
+        return self._route(src, self._upward_search({src}), self._upward_search({dest}))
+
+    def save_to_json(self, json_file_path: str):
+        """
+        Dumps the node order and shortcuts, the original edges are read from the graph on load.
+
+        {
+            'version': CH_FORMAT_VERSION,
+            'fingerprint': str,
+            'order': [node_id, ...],
+            'shortcuts': [[u_id, w_id, weight, middle_id], ...]
+        }
+        """
+        values = {
+            "version": CH_FORMAT_VERSION,
+            "fingerprint": self.fingerprint,
+            "order": self.order,
+            "shortcuts": sorted([v1_id, v2_id, weight, middle]
+                                for (v1_id, v2_id), (weight, middle) in self.shortcuts.items() if v1_id < v2_id),
+        }
+        with open(json_file_path, 'w') as json_file:
+            json.dump(values, json_file)
+
+    @classmethod
+    def load_from_json(cls, graph: Graph, json_file_path: str) -> Optional["ContractionHierarchy"]:
+        """
+        Returns the hierarchy saved in json_file_path, or None if it was built from another graph
+        """
+        with open(json_file_path) as json_file:
+            values = json.load(json_file)
+
+        if values.get("version") != CH_FORMAT_VERSION or values.get("fingerprint") != graph.fingerprint():
+            return None
+
+        shortcuts = dict()
+        for v1_id, v2_id, weight, middle in values["shortcuts"]:
+            shortcuts[(v1_id, v2_id)] = shortcuts[(v2_id, v1_id)] = (weight, middle)
+        return cls(graph, values["order"], shortcuts)
+
+
+def _witness_search(remaining: Dict[str, Dict[str, float]], src: str, excluded: str, max_distance: float,
+                    settled_limit: int) -> Dict[str, float]:
+    """
+    Dijkstra from src in the remaining graph that avoids excluded, up to max_distance or settled_limit settled nodes
+    """
+    dist = {src: 0}
+    pq = [(0, src)]
+    settled = 0
+    while pq and settled < settled_limit:
+        (d, current_vertex) = heapq.heappop(pq)
+        if d > dist[current_vertex]:
+            continue  # stale entry
+        if d > max_distance:
+            break
+        settled += 1
+        for n, edge_weight in remaining[current_vertex].items():
+            new_cost = d + edge_weight
+            if n != excluded and new_cost < dist.get(n, float('inf')):
+                heapq.heappush(pq, (new_cost, n))
+                dist[n] = new_cost
+    return dist
+
+
+def attach_contraction_hierarchy(graph: Graph, json_file_path: str = CH_JSON_FILE_PATH) -> bool:
+    """
+    Loads the hierarchy saved for graph, so find_shortest_path answers uncached queries with it. Returns whether it was
+    built from graph.
+    """
+    contraction_hierarchy = ContractionHierarchy.load_from_json(graph, json_file_path)
+    graph.contraction_hierarchy = contraction_hierarchy
+    return contraction_hierarchy is not None
+
+
+if __name__ == "__main__":
+    graph = Graph()
+    graph.load_from_json(graph_utils.GRAPH_JSON_FILE_PATH)
+    contraction_hierarchy = ContractionHierarchy.build(graph)
+    contraction_hierarchy.save_to_json(CH_JSON_FILE_PATH)
+    print(f"Contracted {len(contraction_hierarchy.order)} nodes with {contraction_hierarchy.num_shortcuts} shortcuts "
+          f"to {CH_JSON_FILE_PATH}")
@@ -0,0 +1,219 @@
+"""
+Compact, array-backed routing engine.
+
+Node ids are interned to dense integer indices (in sorted id order) and the adjacency is stored in compressed sparse
+row form: the neighbors of node i are targets[offsets[i]:offsets[i + 1]] with the matching weights. Building, floor
+and type membership are sorted index arrays, and every node also has the code of its building, floor and type, so the
+membership queries the Graph answers with set intersections become one pass over the shortest matching array.
+Integer arrays are 'i', the same layout on every platform.
+"""
+import heapq
+from array import array
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+import graph as graph_utils
+from graph import Graph, Location, NodeType, Route
+
+NO_PARENT = -1
+
+
+class _Membership:
+    """
+    Sorted node index array per key (building, floor or type) and the code of every node's key
+    """
+
+    def __init__(self):
+        self.codes: Dict[Hashable, int] = dict()  # key -> code
+        self.indices: List[array] = []  # code -> sorted node indices
+        self.node_codes = array('i')  # node index -> code
+
+    def add(self, key: Hashable, index: int):
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.indices)
+            self.indices.append(array('i'))
+        self.indices[code].append(index)
+        self.node_codes.append(code)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.codes
+
+    def get(self, key: Hashable) -> array:
+        code = self.codes.get(key)
+        return array('i') if code is None else self.indices[code]
+
+
+class CSRGraph:
+
+    def __init__(self):
+        self.node_ids: List[str] = []
+        self.index: Dict[str, int] = dict()  # node_id -> node index
+
+        self.lat = array('d')
+        self.lon = array('d')
+
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self.weights = array('d')
+
+        self.buildings = _Membership()
+        self.floors = _Membership()
+        self.types = _Membership()
+
+    @classmethod
+    def from_graph(cls, graph: Graph) -> "CSRGraph":
+        csr = cls()
+        csr.node_ids = sorted(graph.get_node_ids())
+        csr.index = {node_id: i for i, node_id in enumerate(csr.node_ids)}
+
+        for i, node_id in enumerate(csr.node_ids):
+            node = graph.get_node(node_id)
+            csr.lat.append(node.location.lat)
+            csr.lon.append(node.location.lon)
+
+            # indices are added in increasing order, so every membership array is sorted
+            csr.buildings.add(node.building, i)
+            csr.floors.add(node.floor, i)
+            csr.types.add(NodeType(node.node_type), i)
+
+            for neighbor_id, weight in graph.adj[node_id].items():
+                csr.targets.append(csr.index[neighbor_id])
+                csr.weights.append(weight)
+            csr.offsets.append(len(csr.targets))
+
+        return csr
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    def contains_node(self, node_id: str) -> bool:
+        return node_id in self.index
+
+    def contains_building(self, building_name: str) -> bool:
+        return building_name in self.buildings
+
+    def get_location(self, index: int) -> Location:
+        return Location(lat=self.lat[index], lon=self.lon[index])
+
+    def get_neighbors(self, index: int) -> Iterator[Tuple[int, float]]:
+        """
+        Yields (neighbor index, weight) pairs without allocating a list
+        """
+        for e in range(self.offsets[index], self.offsets[index + 1]):
+            yield self.targets[e], self.weights[e]
+
+    def get_nodes(self, building_name: Optional[str] = None, floor: Optional[int] = None,
+                  node_type: Optional[NodeType] = None) -> array:
+        """
+        Returns the sorted indices of the nodes matching every given filter. The shortest matching array is filtered
+        by the codes of the other filters, so the cost is linear in its length rather than in the graph size.
+        """
+        filters = [(membership, key) for membership, key in
+                   ((self.buildings, building_name), (self.floors, floor), (self.types, node_type)) if key is not None]
+        if not filters:
+            return array('i', range(self.num_nodes))
+        if any(key not in membership for membership, key in filters):
+            return array('i')
+
+        filters.sort(key=lambda f: len(f[0].get(f[1])))
+        indices = filters[0][0].get(filters[0][1])
+        for membership, key in filters[1:]:
+            node_codes, code = membership.node_codes, membership.codes[key]
+            indices = array('i', [i for i in indices if node_codes[i] == code])
+        return indices
+
+    def get_closest_node(self, point: Location, floor: int = 1, node_type: NodeType = NodeType.BUILDING) -> str:
+        min_dist = float('inf')
+        closest_node = None
+        for i in self.get_nodes(floor=floor, node_type=node_type):
+            distance = graph_utils.calculate_distance(point, self.get_location(i))
+            if distance < min_dist:
+                min_dist = distance
+                closest_node = i
+
+        return self.node_ids[closest_node]
+
+    def sssp(self, src: str) -> Tuple[array, array]:
+        """
+        Solves sssp from src node. Returns distance and parent arrays indexed by node index, parent is NO_PARENT for
+        the source and unreachable nodes.
+        """
+        assert self.contains_node(src)
+
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = array('d', [float('inf')]) * self.num_nodes
+        parent = array('i', [NO_PARENT]) * self.num_nodes
+
+        src_index = self.index[src]
+        dist[src_index] = 0
+        pq = [(0, src_index)]
+        while pq:
+            d, u = heapq.heappop(pq)
+            if d > dist[u]:
+                continue  # stale entry
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                new_cost = d + weights[e]
+                if new_cost < dist[v]:
+                    dist[v] = new_cost
+                    parent[v] = u
+                    heapq.heappush(pq, (new_cost, v))
+
+        return dist, parent
+
+    def parse_sssp_parent(self, parent: array, dest: int) -> List[str]:
+        path = []
+        current = dest
+        while current != NO_PARENT:
+            path.append(self.node_ids[current])
+            current = parent[current]
+        return path[::-1]
+
+    def find_shortest_path(self, src: str, building_name: str, floor: int = 1) -> Route:
+        assert self.contains_node(src)
+        assert self.contains_building(building_name)
+
+        return self.find_route_to_nodes(src, self.get_nodes(building_name, floor, NodeType.BUILDING))
+
+    def find_route_to_nodes(self, src: str, targets: array) -> Route:
+        """
+        Goal-directed Dijkstra from src that stops at the first settled node in targets (node indices)
+        """
+        assert self.contains_node(src)
+
+        is_target = bytearray(self.num_nodes)
+        for i in targets:
+            is_target[i] = 1
+        offsets, targets_array, weights = self.offsets, self.targets, self.weights
+        dist = array('d', [float('inf')]) * self.num_nodes
+        parent = array('i', [NO_PARENT]) * self.num_nodes
+
+        src_index = self.index[src]
+        dist[src_index] = 0
+        pq = [(0, src_index)]
+        while pq:
+            d, u = heapq.heappop(pq)
+            if d > dist[u]:
+                continue  # stale entry
+            if is_target[u]:
+                path = []
+                current = u
+                while current != NO_PARENT:
+                    path.append(self.node_ids[current])
+                    current = parent[current]
+                return Route(source=src, destination=self.node_ids[u], path=path[::-1], distance=d)
+
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets_array[e]
+                new_cost = d + weights[e]
+                if new_cost < dist[v]:
+                    dist[v] = new_cost
+                    parent[v] = u
+                    heapq.heappush(pq, (new_cost, v))
+
+        return Route(source=src, destination=None, path=None, distance=float('inf'))
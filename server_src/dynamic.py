@@ -0,0 +1,261 @@
+"""
+Live edge closures and reweights without rebuilding the APSP cache.
+
+DynamicRouter keeps the shortest path tree of every destination group (building, floor), as built by
+Graph.search_from_nodes. When an edge gets heavier or closes, only the subtree hanging below it in each tree is
+invalidated and re-solved from its unaffected neighbors. When an edge gets lighter or reopens, the improvement is
+propagated outwards from its endpoints. Only the (node, building, floor) entries whose route changed are rewritten in
+the graph's apsp_cache and next_hop_table.
+"""
+import heapq
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from graph import Graph, NextHopTable, NodeType, Route
+
+Group = Tuple[str, int]
+WeightChange = Tuple[str, str, float]  # (v1_id, v2_id, new weight)
+
+
+@dataclass
+class UpdateReport:
+    groups_affected: int = 0
+    routes_touched: int = 0  # (node, building, floor) routes that changed
+    cache_entries_updated: int = 0  # entries rewritten in apsp_cache and next_hop_table
+    elapsed: float = 0.0  # seconds
+
+
+class DynamicRouter:
+
+    def __init__(self, graph: Graph):
+        """
+        Takes ownership of graph: edge updates are applied to graph.adj and its caches are updated in place. Read-only
+        caches (e.g. loaded from a snapshot) are copied into writable ones first.
+        """
+        self.graph = graph
+        self.groups = graph.get_destination_groups()
+
+        self._dist: Dict[Group, Dict[str, float]] = dict()
+        self._next_hop: Dict[Group, Dict[str, Optional[str]]] = dict()
+        for building, floor in self.groups:
+            targets = graph.get_nodes_by_building_and_floor_and_type(building, floor, NodeType.BUILDING)
+            self._dist[(building, floor)], self._next_hop[(building, floor)] = graph.search_from_nodes(targets)
+
+        self._closed_edges: Dict[Tuple[str, str], float] = dict()  # (v1_id, v2_id) -> weight before closing
+        self._disabled_nodes: Dict[str, List[Tuple[str, str]]] = dict()  # node_id -> edges closed when disabled
+
+        if not isinstance(graph.apsp_cache, dict):
+            graph.apsp_cache = dict(graph.apsp_cache.items())
+        next_hop_table = graph.next_hop_table
+        if next_hop_table is not None and not isinstance(next_hop_table.next_node, array):
+            graph.next_hop_table = NextHopTable(next_hop_table.node_ids, next_hop_table.groups,
+                                                next_node=array('i', next_hop_table.next_node),
+                                                destination=array('i', next_hop_table.destination),
+                                                distance=array('d', next_hop_table.distance))
+
+    @staticmethod
+    def _edge_key(v1_id: str, v2_id: str) -> Tuple[str, str]:
+        return (v1_id, v2_id) if v1_id <= v2_id else (v2_id, v1_id)
+
+    def close_edge(self, v1_id: str, v2_id: str) -> UpdateReport:
+        if not self.graph.contains_edge(v1_id, v2_id):
+            raise ValueError(f"Cannot close edge ({v1_id, v2_id}). Edge is not in graph")
+
+        self._closed_edges[self._edge_key(v1_id, v2_id)] = self.graph.get_weight(v1_id, v2_id)
+        return self._apply([(v1_id, v2_id, float('inf'))])
+
+    def reopen_edge(self, v1_id: str, v2_id: str, weight: Optional[float] = None) -> UpdateReport:
+        """
+        Reopens a closed edge with its weight before closing, unless weight is given
+        """
+        key = self._edge_key(v1_id, v2_id)
+        if key not in self._closed_edges:
+            raise ValueError(f"Cannot reopen edge ({v1_id, v2_id}). Edge is not closed")
+
+        closed_weight = self._closed_edges.pop(key)
+        return self._apply([(v1_id, v2_id, closed_weight if weight is None else weight)])
+
+    def reweight_edge(self, v1_id: str, v2_id: str, weight: float) -> UpdateReport:
+        if not self.graph.contains_edge(v1_id, v2_id):
+            raise ValueError(f"Cannot reweight edge ({v1_id, v2_id}). Edge is not in graph")
+        if weight < 0:
+            raise ValueError(f"Invalid weight {weight}. Weights must be non-negative")
+
+        return self._apply([(v1_id, v2_id, weight)])
+
+    def disable_node(self, node_id: str) -> UpdateReport:
+        """
+        Closes every edge of node_id, so no route goes through it
+        """
+        if not self.graph.contains_node(node_id):
+            raise ValueError(f"Cannot disable node {node_id}. Node is not in graph")
+        if node_id in self._disabled_nodes:
+            raise ValueError(f"Node {node_id} is already disabled")
+
+        edges = [(node_id, n) for n in self.graph.adj[node_id]]
+        for v1_id, v2_id in edges:
+            self._closed_edges[self._edge_key(v1_id, v2_id)] = self.graph.get_weight(v1_id, v2_id)
+        self._disabled_nodes[node_id] = edges
+        return self._apply([(v1_id, v2_id, float('inf')) for v1_id, v2_id in edges])
+
+    def enable_node(self, node_id: str) -> UpdateReport:
+        if node_id not in self._disabled_nodes:
+            raise ValueError(f"Node {node_id} is not disabled")
+
+        changes = []
+        for v1_id, v2_id in self._disabled_nodes.pop(node_id):
+            weight = self._closed_edges.pop(self._edge_key(v1_id, v2_id), None)
+            if weight is not None:
+                changes.append((v1_id, v2_id, weight))
+        return self._apply(changes)
+
+    def _apply(self, changes: List[WeightChange]) -> UpdateReport:
+        start = time.perf_counter()
+
+        increases, decreases = [], []
+        for v1_id, v2_id, weight in changes:
+            old_weight = self.graph.adj[v1_id].get(v2_id, float('inf'))
+            if weight == float('inf'):
+                self.graph.adj[v1_id].pop(v2_id, None)
+                self.graph.adj[v2_id].pop(v1_id, None)
+            else:
+                self.graph.adj[v1_id][v2_id] = weight
+                self.graph.adj[v2_id][v1_id] = weight
+
+            if weight > old_weight:
+                increases.append((v1_id, v2_id, weight))
+            elif weight < old_weight:
+                decreases.append((v1_id, v2_id, weight))
+
+        self.graph.invalidate_fingerprint()
+        self.graph.contraction_hierarchy = None  # shortcuts may no longer be shortest paths
+
+        report = UpdateReport()
+        for group in self.groups:
+            touched = set()
+            if increases:
+                touched |= self._repair_increases(group, increases)
+            if decreases:
+                touched |= self._repair_decreases(group, decreases)
+            if not touched:
+                continue
+
+            report.groups_affected += 1
+            report.routes_touched += len(touched)
+            report.cache_entries_updated += self._update_caches(group, touched)
+
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def _subtree(self, group: Group, root: str) -> Set[str]:
+        """
+        Nodes whose shortest path to the group goes through root. Tree edges are graph edges, so the subtree is found
+        by walking the adjacency from root.
+        """
+        next_hop = self._next_hop[group]
+        subtree = {root}
+        stack = [root]
+        while stack:
+            current_vertex = stack.pop()
+            for n in self.graph.adj[current_vertex]:
+                if n not in subtree and n in next_hop and next_hop[n] == current_vertex:
+                    subtree.add(n)
+                    stack.append(n)
+        return subtree
+
+    def _repair_increases(self, group: Group, edges: List[WeightChange]) -> Set[str]:
+        dist, next_hop = self._dist[group], self._next_hop[group]
+
+        affected = set()
+        for v1_id, v2_id, _ in edges:
+            if v1_id in next_hop and next_hop[v1_id] == v2_id:
+                affected |= self._subtree(group, v1_id)
+            elif v2_id in next_hop and next_hop[v2_id] == v1_id:
+                affected |= self._subtree(group, v2_id)
+        if not affected:
+            return set()
+
+        previous = {v: (dist.pop(v, None), next_hop.pop(v, None)) for v in affected}
+
+        # seed every affected node from its best unaffected neighbor, then re-solve inside the affected set
+        pq = []
+        for v in affected:
+            for n, edge_weight in self.graph.adj[v].items():
+                if n not in affected and n in dist and dist[n] + edge_weight < dist.get(v, float('inf')):
+                    dist[v] = dist[n] + edge_weight
+                    next_hop[v] = n
+            if v in dist:
+                pq.append((dist[v], v))
+        heapq.heapify(pq)
+
+        while pq:
+            (d, current_vertex) = heapq.heappop(pq)
+            if d > dist[current_vertex]:
+                continue  # stale entry
+            for n, edge_weight in self.graph.adj[current_vertex].items():
+                new_cost = d + edge_weight
+                if n in affected and new_cost < dist.get(n, float('inf')):
+                    heapq.heappush(pq, (new_cost, n))
+                    dist[n] = new_cost
+                    next_hop[n] = current_vertex
+
+        return {v for v in affected if (dist.get(v), next_hop.get(v)) != previous[v]}
+
+    def _repair_decreases(self, group: Group, edges: List[WeightChange]) -> Set[str]:
+        dist, next_hop = self._dist[group], self._next_hop[group]
+
+        touched = set()
+        pq = []
+        for v1_id, v2_id, edge_weight in edges:
+            for u, v in ((v1_id, v2_id), (v2_id, v1_id)):
+                if u in dist and dist[u] + edge_weight < dist.get(v, float('inf')):
+                    dist[v] = dist[u] + edge_weight
+                    next_hop[v] = u
+                    touched.add(v)
+                    heapq.heappush(pq, (dist[v], v))
+
+        while pq:
+            (d, current_vertex) = heapq.heappop(pq)
+            if d > dist[current_vertex]:
+                continue  # stale entry
+            for n, edge_weight in self.graph.adj[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist.get(n, float('inf')):
+                    heapq.heappush(pq, (new_cost, n))
+                    dist[n] = new_cost
+                    next_hop[n] = current_vertex
+                    touched.add(n)
+
+        return touched
+
+    def _route(self, group: Group, node_id: str) -> Route:
+        next_hop = self._next_hop[group]
+        if node_id not in next_hop:
+            return Route(source=node_id, destination=None, path=None, distance=float('inf'))
+        return self.graph._route_from_next_hop(node_id, next_hop)
+
+    def _update_caches(self, group: Group, touched: Set[str]) -> int:
+        building, floor = group
+        apsp_cache = self.graph.apsp_cache
+        next_hop_table = self.graph.next_hop_table
+
+        updated = 0
+        for node_id in touched:
+            route = self._route(group, node_id)
+
+            key = (node_id, building, floor)
+            if key in apsp_cache:
+                apsp_cache[key] = route
+                updated += 1
+
+            if next_hop_table is not None and key in next_hop_table:
+                next_node = route.path[1] if route.path is not None and len(route.path) > 1 else None
+                next_hop_table.set_entry(node_id, building, floor, next_node, route.destination, route.distance)
+                updated += 1
+
+        return updated
+
+    def get_route(self, src: str, building_name: str, floor: int) -> Route:
+        return self._route((building_name, floor), src)
@@ -1,15 +1,25 @@
+from array import array
 from dataclasses import dataclass, field, asdict
 import time
 from enum import Enum, unique
-from typing import Dict, Set, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, Set, List, Optional, Tuple
 
-import csv
+import hashlib
+import heapq
+import itertools
 import json
 import pprint
 import math
+import os
+import tempfile
 
-from geopy.distance import distance, geodesic
-from queue import PriorityQueue
+import numpy as np
+from geographiclib.geodesic import Geodesic
+from geopy.distance import ELLIPSOIDS, distance
+
+import instrumentation
+import wkt
+from spatial import LocalProjection, SpatialIndex, WGS84_A, WGS84_E2, ellipsoid_radii
 
 
 # # use these imports if working locally
@@ -25,6 +35,8 @@ from queue import PriorityQueue
 #
 # GRAPH_JSON_FILE_PATH = "data/graph.json"
 # APSP_JSON_FILE_PATH = "data/apsp.json"
+# NEXT_HOP_JSON_FILE_PATH = "data/next_hop.json"
+# GRAPH_SNAPSHOT_FILE_PATH = "data/graph.snapshot"
 
 # these imports are used server side
 POLYGONS_CSV_FILE_PATH = "/var/jail/home/team8/server_src/data/polygons.csv"
@@ -39,6 +51,18 @@ EDGES_1_CSV_FILE_PATH = "/var/jail/home/team8/server_src/data/edges_1.csv"
 
 GRAPH_JSON_FILE_PATH = "/var/jail/home/team8/server_src/data/graph.json"
 APSP_JSON_FILE_PATH = "/var/jail/home/team8/server_src/data/apsp.json"
+NEXT_HOP_JSON_FILE_PATH = "/var/jail/home/team8/server_src/data/next_hop.json"
+GRAPH_SNAPSHOT_FILE_PATH = "/var/jail/home/team8/server_src/data/graph.snapshot"
+
+# weight of the "altitude" edges between consecutive floors of a stair / elevator
+FLOOR_CHANGE_WEIGHT = 20
+
+# the A* heuristic scales the planar straight-line distance down by this factor, so it stays a lower bound on edge
+# weights computed with any distance backend
+ASTAR_HEURISTIC_SCALE = 0.99
+
+# version of the graph.json / apsp.json layout, files without one are from before fingerprints were embedded
+JSON_FORMAT_VERSION = 2
 
 
 @unique
@@ -66,6 +90,12 @@ class Route:
     distance: float
 
 
+@dataclass
+class SearchStats:
+    nodes_expanded: int = 0  # nodes popped from the heap and settled
+    nodes_pushed: int = 0  # heap pushes, including the source
+
+
 @dataclass
 class Node:
     id: str
@@ -87,6 +117,85 @@ class Edge:
         self.direction = calculate_direction(self.v1.location, self.v2.location)
 
 
+class NextHopTable:
+    """
+    Served representation of the APSP cache. For every (node, building, floor) it stores the next node on the shortest
+    path, the final destination node and the total distance in typed arrays (indices into node_ids, -1 for none).
+    Full paths are only rebuilt, by following next hops, when a caller asks for a Route.
+    """
+    NONE = -1
+
+    def __init__(self, node_ids: List[str], groups: List[Tuple[str, int]], next_node=None, destination=None,
+                 distance=None):
+        self.node_ids = node_ids
+        self.node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.groups = groups  # (building, floor) pairs
+        self.group_index = {group: i for i, group in enumerate(groups)}
+
+        size = len(node_ids) * len(groups)
+        self.next_node = array('i', [self.NONE]) * size if next_node is None else next_node
+        self.destination = array('i', [self.NONE]) * size if destination is None else destination
+        self.distance = array('d', [float('inf')]) * size if distance is None else distance
+
+    def _position(self, node_id: str, building_name: str, floor: int) -> Optional[int]:
+        node = self.node_index.get(node_id)
+        group = self.group_index.get((building_name, floor))
+        if node is None or group is None:
+            return None
+        return node * len(self.groups) + group
+
+    def __contains__(self, key: Tuple[str, str, int]) -> bool:
+        return self._position(*key) is not None
+
+    def set_entry(self, node_id: str, building_name: str, floor: int, next_node: Optional[str],
+                  destination: Optional[str], distance: float):
+        position = self._position(node_id, building_name, floor)
+        self.next_node[position] = self.NONE if next_node is None else self.node_index[next_node]
+        self.destination[position] = self.NONE if destination is None else self.node_index[destination]
+        self.distance[position] = distance
+
+    def get_next_hop(self, node_id: str, building_name: str, floor: int) -> Tuple[Optional[str], Optional[str], float]:
+        """
+        Returns (next node, destination, distance). Next node is None if node_id is the destination itself.
+        """
+        position = self._position(node_id, building_name, floor)
+        next_node = self.next_node[position]
+        destination = self.destination[position]
+        return (None if next_node == self.NONE else self.node_ids[next_node],
+                None if destination == self.NONE else self.node_ids[destination],
+                self.distance[position])
+
+    def get_route(self, node_id: str, building_name: str, floor: int) -> Route:
+        position = self._position(node_id, building_name, floor)
+        if self.destination[position] == self.NONE:
+            return Route(source=node_id, destination=None, path=None, distance=self.distance[position])
+
+        group = self.group_index[(building_name, floor)]
+        num_groups = len(self.groups)
+        path = [node_id]
+        current = self.next_node[position]
+        while current != self.NONE:
+            path.append(self.node_ids[current])
+            current = self.next_node[current * num_groups + group]
+
+        return Route(source=node_id, destination=path[-1], path=path, distance=self.distance[position])
+
+    def to_dict(self) -> dict:
+        return {
+            "node_ids": self.node_ids,
+            "groups": [list(group) for group in self.groups],
+            "next_node": self.next_node.tolist(),
+            "destination": self.destination.tolist(),
+            "distance": self.distance.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "NextHopTable":
+        return cls(node_ids=values["node_ids"], groups=[tuple(group) for group in values["groups"]],
+                   next_node=array('i', values["next_node"]), destination=array('i', values["destination"]),
+                   distance=array('d', values["distance"]))
+
+
 class Graph:
 
     def __init__(self):
@@ -96,22 +205,40 @@ class Graph:
         self.types: Dict[NodeType, Set[str]] = dict()  # NodeType -> node_id
         self.adj: Dict[str, Dict[str, float]] = dict()  # adj matrix with weights {node_id: {node_id: weight}}
         self.apsp_cache: Dict[Tuple[str, str, float], Route] = dict()
+        self.next_hop_table: Optional[NextHopTable] = None
+        self.contraction_hierarchy = None  # contraction.ContractionHierarchy, answers queries missing from the caches
+        self._spatial_indexes: Dict[Tuple[int, NodeType], SpatialIndex] = dict()  # built lazily
+        self._fingerprint: Optional[str] = None  # computed lazily, reset whenever nodes or edges change
+        self._heuristic_scale: Optional[float] = None  # computed lazily, reset with the fingerprint
 
     def load_from_json(self, json_file_path: str):
         """
         Loads graph representation to json file.
 
         {
-            node_id: {
-                'node': Node,
-                'adj': {n1_id: dist, n2_id: dist, ..., ni_id: dist}
-            },
+            'version': JSON_FORMAT_VERSION,
+            'fingerprint': str,
+            'graph': {
+                node_id: {
+                    'node': Node,
+                    'adj': {n1_id: dist, n2_id: dist, ..., ni_id: dist}
+                },
+            }
         }
+
+        The embedded fingerprint is trusted, so it is not recomputed on load. Files without a version hold the graph
+        dict at the top level.
         """
         self.__init__()
 
         with open(json_file_path) as json_file:
-            graph = json.load(json_file)
+            values = json.load(json_file)
+
+        fingerprint = None
+        graph = values
+        if "version" in values:
+            fingerprint = values.get("fingerprint")
+            graph = values.get("graph")
 
         adj = {}
         for node_id, values in graph.items():
@@ -123,17 +250,11 @@ class Graph:
             adj[node_id] = values.get('adj')
 
         self.adj = adj
+        self._fingerprint = fingerprint
 
     def save_to_json(self, json_file_path: str):
         """
-        Dumps graph representation to json file.
-
-        {
-            node_id: {
-                'node': Node,
-                'adj': {n1_id: dist, n2_id: dist, ..., ni_id: dist}
-            },
-        }
+        Dumps graph representation to json file, see load_from_json for the layout.
         """
         graph = {}  # node_id -> {node: Node, adj: Adj}
 
@@ -144,24 +265,93 @@ class Graph:
                 "adj": adj
             }
 
+        values = {
+            "version": JSON_FORMAT_VERSION,
+            "fingerprint": self.fingerprint(),
+            "graph": graph,
+        }
         with open(json_file_path, 'w') as json_file:
-            json.dump(graph, json_file, indent=4, sort_keys=True)
+            json.dump(values, json_file, indent=4, sort_keys=True)
 
-    def load_apsp_from_json(self, json_file_path: str):
-        self.apsp_cache.clear()
+    def load_apsp_from_json(self, json_file_path: str) -> bool:
+        """
+        Loads the APSP cache if it was built from this graph, so the graph must be loaded first. Returns whether the
+        cache was loaded. On a fingerprint mismatch, or for files without a fingerprint, the cache is left empty and
+        routes are computed on demand.
+        """
+        self.clear_cache()
 
         with open(json_file_path) as json_file:
-            serialized_apsp = json.load(json_file)
+            values = json.load(json_file)
+
+        if "version" not in values or values.get("fingerprint") != self.fingerprint():
+            return False
 
-        apsp = {tuple(json.loads(key)): Route(**raw_route) for key, raw_route in serialized_apsp.items()}
+        apsp = {tuple(json.loads(key)): Route(**raw_route) for key, raw_route in values.get("routes").items()}
         self.apsp_cache = apsp
+        return True
 
-    def save_apsp_to_json(self, json_file_path: str):
-        apsp = self.apsp()
+    def save_apsp_to_json(self, json_file_path: str, apsp: Optional[Dict[Tuple[str, str, int], Route]] = None):
+        apsp = self.apsp() if apsp is None else apsp
         serialized_apsp = {json.dumps(key): asdict(route) for key, route in apsp.items()}
 
+        values = {
+            "version": JSON_FORMAT_VERSION,
+            "fingerprint": self.fingerprint(),
+            "routes": serialized_apsp,
+        }
+        with open(json_file_path, 'w') as json_file:
+            json.dump(values, json_file, indent=4, sort_keys=True)
+
+    def load_next_hop_table_from_json(self, json_file_path: str) -> bool:
+        """
+        Loads the next hop table if it was built from this graph, same as load_apsp_from_json
+        """
+        self.clear_cache()
+
+        with open(json_file_path) as json_file:
+            values = json.load(json_file)
+
+        if values.get("fingerprint") != self.fingerprint():
+            return False
+
+        self.next_hop_table = NextHopTable.from_dict(values)
+        return True
+
+    def save_next_hop_table_to_json(self, json_file_path: str, next_hop_table: Optional[NextHopTable] = None):
+        next_hop_table = self.build_next_hop_table() if next_hop_table is None else next_hop_table
+
+        values = next_hop_table.to_dict()
+        values["fingerprint"] = self.fingerprint()
         with open(json_file_path, 'w') as json_file:
-            json.dump(serialized_apsp, json_file, indent=4, sort_keys=True)
+            json.dump(values, json_file)
+
+    def fingerprint(self) -> str:
+        """
+        Returns a sha256 hex digest of the nodes, edges and weights. Two graphs with the same fingerprint produce the
+        same routes. Computed once and reset whenever the graph changes.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = self.compute_fingerprint()
+        return self._fingerprint
+
+    def compute_fingerprint(self) -> str:
+        sha256 = hashlib.sha256()
+        for node_id in sorted(self._vertices):
+            node = self._vertices[node_id]
+            adj = sorted((neighbor_id, float(weight)) for neighbor_id, weight in self.adj.get(node_id, {}).items())
+            values = [node_id, float(node.location.lat), float(node.location.lon), node.building, node.floor,
+                      NodeType(node.node_type).value, adj]
+            sha256.update(json.dumps(values).encode("utf-8"))
+            sha256.update(b"\n")
+        return sha256.hexdigest()
+
+    def invalidate_fingerprint(self):
+        """
+        Must be called after changing adj directly
+        """
+        self._fingerprint = None
+        self._heuristic_scale = None
 
     def contains_floor(self, floor: int) -> bool:
         return floor in self.floors
@@ -204,14 +394,19 @@ class Graph:
         self.floors[node.floor].add(node.id)
         self.types[node.node_type].add(node.id)
 
+        self._spatial_indexes.pop((node.floor, node.node_type), None)
+        self.invalidate_fingerprint()
+
     def add_edge(self, v1_id: str, v2_id: str, weight: Optional[float] = None):
         """
         Adds undirected edge (v1, v2) to graph representation
         """
-        edge = self.get_edge(v1_id, v2_id)
+        if weight is None:
+            weight = calculate_distance(self._vertices[v1_id].location, self._vertices[v2_id].location)
 
-        self.adj[v1_id][v2_id] = edge.weight if weight is None else weight
-        self.adj[v2_id][v1_id] = edge.weight if weight is None else weight
+        self.adj[v1_id][v2_id] = weight
+        self.adj[v2_id][v1_id] = weight
+        self.invalidate_fingerprint()
 
     def get_node(self, node_id: str) -> Node:
         """
@@ -269,27 +464,29 @@ class Graph:
     def get_weight(self, v1_id: str, v2_id: str):
         return self.adj[v1_id][v2_id]
 
+    def get_spatial_index(self, floor: int, node_type: NodeType = NodeType.BUILDING) -> SpatialIndex:
+        """
+        Returns the spatial index over the nodes on floor with node_type, building it on first use
+        """
+        key = (floor, node_type)
+        if key not in self._spatial_indexes:
+            node_ids = sorted(self.get_nodes_by_floor_and_type(floor, node_type))
+            locations = [self.get_node(v_id).location for v_id in node_ids]
+            self._spatial_indexes[key] = SpatialIndex(
+                node_ids, [location.lat for location in locations], [location.lon for location in locations],
+                exact_distance=lambda point_1, point_2: calculate_distance(Location(*point_1), Location(*point_2)))
+        return self._spatial_indexes[key]
+
     def get_closest_node(self, point: Location, floor: int = 1, node_type: NodeType = NodeType.BUILDING) -> str:
         """
         Given location, find closest building node in the graph on the same floor. This will be used to as the start
         node when calculating the shortest path from a location
         """
-        # hardcoded to floor 0 for now
-
-        src = Node(id="s", location=point, building="None", floor=floor)
+        with instrumentation.stage("get_closest_node"):
+            (closest_node, _), = self.get_spatial_index(floor, node_type).nearest(point.lat, point.lon, k=1)
+        return closest_node
 
-        min_dist = float('inf')
-        closest_node = None
-        for v_id in self.get_nodes_by_floor_and_type(floor, node_type):
-            v = self.get_node(v_id)
-            distance = calculate_distance(src.location, v.location)
-            if distance < min_dist:
-                min_dist = distance
-                closest_node = v
-
-        return closest_node.id
-
-    def sssp(self, src: str):
+    def sssp(self, src: str, stats: Optional[SearchStats] = None):
         """
         Solves sssp from src node on our path.
 
@@ -299,31 +496,227 @@ class Graph:
         """
         assert self.contains_node(src)
 
-        nodes = self.get_node_ids()
-        dist = {node_id: float('inf') for node_id in nodes}
+        dist = {node_id: float('inf') for node_id in self._vertices}
         dist[src] = 0
 
-        seen = set()
-        pq = PriorityQueue()
-        pq.put((0, src))
+        pq = [(0, src)]
         parent = dict()
+        expanded, pushed = 0, 1
 
         parent[src] = None
-        while not pq.empty():
-            (d, current_vertex) = pq.get()
-            seen.add(current_vertex)
-            for n in self.get_neighbors(current_vertex):
-                edge_weight = self.get_weight(current_vertex, n)
-                if n not in seen:
-                    old_cost = dist[n]
-                    new_cost = dist[current_vertex] + edge_weight
-                    if new_cost < old_cost:
-                        pq.put((new_cost, n))
-                        dist[n] = new_cost
-                        parent[n] = current_vertex
-
+        while pq:
+            (d, current_vertex) = heapq.heappop(pq)
+            if d > dist[current_vertex]:
+                continue  # stale entry, current_vertex was already settled with a smaller distance
+            expanded += 1
+            for n, edge_weight in self.adj[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist[n]:
+                    heapq.heappush(pq, (new_cost, n))
+                    pushed += 1
+                    dist[n] = new_cost
+                    parent[n] = current_vertex
+
+        if stats is not None:
+            stats.nodes_expanded += expanded
+            stats.nodes_pushed += pushed
+        instrumentation.count("nodes_settled", expanded)
+        instrumentation.count("heap_pushes", pushed)
         return dist, parent
 
+    def find_route_to_nodes(self, src: str, targets: Set[str], stats: Optional[SearchStats] = None) -> Route:
+        """
+        Goal-directed Dijkstra from src to the closest node in targets. The search stops as soon as the first target is
+        settled, so it only explores nodes closer to src than the destination.
+
+        Returns a route with destination and path set to None if no target is reachable.
+        """
+        return self._search_to_nodes(src, targets, None, stats)
+
+    def find_route_astar(self, src: str, targets: Set[str], stats: Optional[SearchStats] = None) -> Route:
+        """
+        A* from src to the closest node in targets, guided by target_heuristic. Returns the same route distance as
+        find_route_to_nodes while expanding only nodes on the way towards the targets.
+        """
+        return self._search_to_nodes(src, targets, self.target_heuristic(targets), stats)
+
+    def target_heuristic(self, targets: Set[str]) -> Callable[[str], float]:
+        """
+        Lower bound on the distance from a node to the closest of targets: the straight-line distance to a target plus
+        FLOOR_CHANGE_WEIGHT for every floor in between, since only altitude edges change floors.
+
+        The bound (and so the optimality of A*) needs every edge to weigh at least the straight-line distance between
+        its endpoints, which holds for weights computed by Edge. It is scaled down by heuristic_scale for edges
+        reweighted below that, e.g. by DynamicRouter.reweight_edge.
+        """
+        target_nodes = [self.get_node(node_id) for node_id in targets]
+        if not target_nodes:
+            return lambda node_id: 0.0
+        scale = self.heuristic_scale()
+
+        projection = LocalProjection(sum(node.location.lat for node in target_nodes) / len(target_nodes),
+                                     sum(node.location.lon for node in target_nodes) / len(target_nodes))
+        target_points = [(*projection.project(node.location.lat, node.location.lon), node.floor)
+                         for node in target_nodes]
+
+        def heuristic(node_id: str) -> float:
+            node = self._vertices[node_id]
+            x, y = projection.project(node.location.lat, node.location.lon)
+            return scale * min(ASTAR_HEURISTIC_SCALE * math.hypot(x - target_x, y - target_y) +
+                               (FLOOR_CHANGE_WEIGHT * abs(node.floor - target_floor)
+                                if node.floor is not None and target_floor is not None else 0)
+                               for target_x, target_y, target_floor in target_points)
+
+        return heuristic
+
+    def heuristic_scale(self) -> float:
+        """
+        Smallest ratio, capped at 1, of an edge's weight to the lower bound target_heuristic assumes for it (the
+        scaled straight-line distance plus FLOOR_CHANGE_WEIGHT per floor). 1 unless an edge was made cheaper than
+        its length. Computed once and reset with the fingerprint.
+        """
+        if self._heuristic_scale is None:
+            v1_ids, v2_ids, weights = [], [], []
+            for v1_id, neighbors in self.adj.items():
+                for v2_id, weight in neighbors.items():
+                    v1_ids.append(v1_id)
+                    v2_ids.append(v2_id)
+                    weights.append(weight)
+
+            nodes_1 = [self._vertices[v1_id] for v1_id in v1_ids]
+            nodes_2 = [self._vertices[v2_id] for v2_id in v2_ids]
+            bounds = ASTAR_HEURISTIC_SCALE * calculate_distances(
+                [node.location.lat for node in nodes_1], [node.location.lon for node in nodes_1],
+                [node.location.lat for node in nodes_2], [node.location.lon for node in nodes_2],
+                DistanceBackend.LOCAL_PROJECTION)
+            bounds += np.array([FLOOR_CHANGE_WEIGHT * abs(node_1.floor - node_2.floor)
+                                if node_1.floor is not None and node_2.floor is not None else 0
+                                for node_1, node_2 in zip(nodes_1, nodes_2)], dtype=float)
+
+            weights = np.array(weights, dtype=float)
+            positive = bounds > 0
+            self._heuristic_scale = float(min(1.0, (weights[positive] / bounds[positive]).min(initial=1.0)))
+        return self._heuristic_scale
+
+    def _search_to_nodes(self, src: str, targets: Set[str], heuristic: Optional[Callable[[str], float]],
+                         stats: Optional[SearchStats]) -> Route:
+        """
+        Dijkstra (heuristic is None) or A* from src, stopping at the first settled node in targets. The heuristic must
+        be consistent, so a settled node is never improved later.
+        """
+        assert self.contains_node(src)
+
+        dist = {src: 0}
+        parent = {src: None}
+        estimate = dict()  # node_id -> heuristic, each node's heuristic is evaluated once
+        pq = [(0, 0, src)]  # (distance + heuristic, distance, node_id)
+        expanded, pushed = 0, 1
+        route = Route(source=src, destination=None, path=None, distance=float('inf'))
+        while pq:
+            (_, d, current_vertex) = heapq.heappop(pq)
+            if d > dist[current_vertex]:
+                continue  # stale entry
+            expanded += 1
+            if current_vertex in targets:
+                path = self.parse_sssp_parent(parent, current_vertex)
+                route = Route(source=src, destination=current_vertex, path=path, distance=d)
+                break
+
+            for n, edge_weight in self.adj[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist.get(n, float('inf')):
+                    if heuristic is None:
+                        priority = new_cost
+                    else:
+                        if n not in estimate:
+                            estimate[n] = heuristic(n)
+                        priority = new_cost + estimate[n]
+                    heapq.heappush(pq, (priority, new_cost, n))
+                    pushed += 1
+                    dist[n] = new_cost
+                    parent[n] = current_vertex
+
+        if stats is not None:
+            stats.nodes_expanded += expanded
+            stats.nodes_pushed += pushed
+        instrumentation.count("nodes_settled", expanded)
+        instrumentation.count("heap_pushes", pushed)
+        return route
+
+    def find_route_to_node(self, src: str, dest: str, stats: Optional[SearchStats] = None) -> Route:
+        """
+        Shortest route between two nodes, see find_route_bidirectional
+        """
+        assert self.contains_node(dest)
+        return self.find_route_bidirectional(src, {dest}, stats)
+
+    def find_route_bidirectional(self, src: str, targets: Set[str], stats: Optional[SearchStats] = None) -> Route:
+        """
+        Bidirectional Dijkstra between src and the closest node in targets: a forward search from src and a backward
+        search from every target (edges are undirected) advance alternately, always the side with the smaller
+        frontier. mu is the length of the best path found through a node reached from both sides, and the search stops
+        once the two frontier distances add up to at least mu, since no shorter path can still be found.
+
+        Returns a route with destination and path set to None if no target is reachable.
+        """
+        assert self.contains_node(src)
+        assert all(self.contains_node(target) for target in targets)
+
+        unreachable = Route(source=src, destination=None, path=None, distance=float('inf'))
+        if not targets:
+            return unreachable
+
+        dist = ({src: 0}, {target: 0 for target in targets})  # forward, backward
+        parent = ({src: None}, {target: None for target in targets})
+        pq = ([(0, src)], [(0, target) for target in sorted(targets)])
+        settled = (set(), set())
+        expanded, pushed = 0, 1 + len(targets)
+
+        mu = float('inf')
+        meeting_node = None
+        if src in targets:
+            mu, meeting_node = 0, src
+
+        while pq[0] and pq[1] and pq[0][0][0] + pq[1][0][0] < mu:
+            side = 0 if pq[0][0][0] <= pq[1][0][0] else 1
+            (d, current_vertex) = heapq.heappop(pq[side])
+            if current_vertex in settled[side]:
+                continue  # stale entry
+            settled[side].add(current_vertex)
+            expanded += 1
+
+            for n, edge_weight in self.adj[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist[side].get(n, float('inf')):
+                    heapq.heappush(pq[side], (new_cost, n))
+                    pushed += 1
+                    dist[side][n] = new_cost
+                    parent[side][n] = current_vertex
+
+                if n in dist[1 - side] and new_cost + dist[1 - side][n] < mu:
+                    mu = new_cost + dist[1 - side][n]
+                    meeting_node = n
+
+        if stats is not None:
+            stats.nodes_expanded += expanded
+            stats.nodes_pushed += pushed
+        instrumentation.count("nodes_settled", expanded)
+        instrumentation.count("heap_pushes", pushed)
+        if meeting_node is None:
+            return unreachable
+
+        path = self.parse_sssp_parent(parent[0], meeting_node)
+        current_vertex = parent[1][meeting_node]
+        while current_vertex is not None:
+            path.append(current_vertex)
+            current_vertex = parent[1][current_vertex]
+
+        # distances are re-accumulated from src so they match the one-sided searches exactly
+        distance = 0
+        for v1_id, v2_id in zip(path, path[1:]):
+            distance += self.adj[v1_id][v2_id]
+        return Route(source=src, destination=path[-1], path=path, distance=distance)
+
     @staticmethod
     def parse_sssp_parent(parent: Dict[str, str], dest: str):
         """
@@ -338,63 +731,192 @@ class Graph:
         path.append(current_node)
         return path[::-1]
 
-    def find_shortest_path(self, src: str, building_name: str, floor: int = 1, use_cache: bool = True) -> Route:
+    def find_shortest_path(self, src: str, building_name: str, floor: int = 1, use_cache: bool = True,
+                           use_astar: bool = False, stats: Optional[SearchStats] = None) -> Route:
+        """
+        Looks the route up in the caches, unless use_cache is False, and otherwise searches for it with Dijkstra or,
+        with use_astar, A*. stats collects the search's node expansion counts.
+        """
         assert self.contains_node(src)
         assert self.contains_building(building_name)
 
         key = (src, building_name, floor)
         if use_cache and key in self.apsp_cache:
+            instrumentation.count("apsp_cache_hits")
             return self.apsp_cache[key]
-
-        dist, parent = self.sssp(src)
+        if use_cache and self.next_hop_table is not None and key in self.next_hop_table:
+            instrumentation.count("next_hop_table_hits")
+            return self.next_hop_table.get_route(*key)
+        if use_cache and self.contraction_hierarchy is not None:
+            instrumentation.count("contraction_hierarchy_queries")
+            with instrumentation.stage("contraction_hierarchy"):
+                return self.contraction_hierarchy.find_shortest_path(src, building_name, floor)
 
         building_nodes_in_building_and_on_floor = self.get_nodes_by_building_and_floor_and_type(building_name, floor,
                                                                                                 NodeType.BUILDING)
-        destination = None
-        min_dist = float('inf')
-        for v in building_nodes_in_building_and_on_floor:
-            if dist[v] < min_dist:
-                min_dist = dist[v]
-                destination = v
-        try:
-            path = self.parse_sssp_parent(parent, destination)
-        except KeyError:
-            path = None
-            min_dist = float('inf')
-
-        return Route(source=src, destination=destination, path=path, distance=min_dist)
+        if use_cache:
+            # only lookups that none of the caches answered are misses
+            instrumentation.count("apsp_cache_misses")
+        instrumentation.count("searches")
+        with instrumentation.stage("search"):
+            if use_astar:
+                return self.find_route_astar(src, building_nodes_in_building_and_on_floor, stats)
+            return self.find_route_to_nodes(src, building_nodes_in_building_and_on_floor, stats)
+
+    def search_from_nodes(self, sources: Set[str]) -> Tuple[Dict[str, float], Dict[str, Optional[str]]]:
+        """
+        Multi-source Dijkstra seeded with every node in sources at distance 0. Since edges are undirected, this is also
+        the reverse search towards the closest source: dist[v] is the distance from v to its closest source and
+        next_hop[v] is the next node on that shortest path (None for the sources themselves).
+
+        Unreachable nodes are missing from both dictionaries.
+        """
+        dist = {v: 0 for v in sources}
+        next_hop = {v: None for v in sources}
+        pq = [(0, v) for v in sources]
+        heapq.heapify(pq)
+        while pq:
+            (d, current_vertex) = heapq.heappop(pq)
+            if d > dist[current_vertex]:
+                continue  # stale entry
+            for n, edge_weight in self.adj[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist.get(n, float('inf')):
+                    heapq.heappush(pq, (new_cost, n))
+                    dist[n] = new_cost
+                    next_hop[n] = current_vertex
+
+        return dist, next_hop
+
+    def apsp_to_building(self, building_name: str, floor: int) -> Dict[Tuple[str, str, int], Route]:
+        """
+        Routes from every building node to (building_name, floor), computed with a single reverse multi-source search
+        from the building's nodes on that floor.
+        """
+        targets = self.get_nodes_by_building_and_floor_and_type(building_name, floor, NodeType.BUILDING)
+        _, next_hop = self.search_from_nodes(targets)
+
+        apsp = {}
+        for v in self.get_nodes_by_type(NodeType.BUILDING):
+            key = (v, building_name, floor)
+            if v not in next_hop:
+                apsp[key] = Route(source=v, destination=None, path=None, distance=float('inf'))
+                continue
+
+            apsp[key] = self._route_from_next_hop(v, next_hop)
+
+        return apsp
+
+    def _route_from_next_hop(self, src: str, next_hop: Dict[str, Optional[str]]) -> Route:
+        """
+        Follows a next_hop tree from search_from_nodes. The distance is accumulated from the source, in the same order
+        find_shortest_path does, so both return identical routes.
+        """
+        path = [src]
+        distance = 0
+        while next_hop[path[-1]] is not None:
+            n = next_hop[path[-1]]
+            distance = distance + self.get_weight(path[-1], n)
+            path.append(n)
+
+        return Route(source=src, destination=path[-1], path=path, distance=distance)
 
     def apsp(self):
         apsp = {}
 
-        for v in self.get_nodes_by_type(NodeType.BUILDING):
-            for building in self.get_building_names():
-                for floor in self.get_floor_numbers():
-                    route = self.find_shortest_path(v, building, floor)
-                    apsp[(v, building, floor)] = route
+        for building in self.get_building_names():
+            for floor in self.get_floor_numbers():
+                apsp.update(self.apsp_to_building(building, floor))
 
         return apsp
 
-    def clear_cache(self):
-        self.apsp_cache = dict()
+    def get_destination_groups(self) -> List[Tuple[str, int]]:
+        """
+        Returns every (building, floor) pair a route can be requested for, in a stable order
+        """
+        return [(building, floor) for building in sorted(self.get_building_names(), key=lambda b: (b is None, b))
+                for floor in sorted(self.get_floor_numbers(), key=lambda f: (f is None, f))]
 
-    def __eq__(self, other):
+    def next_hop_entries(self, building_name: str, floor: int) -> List[Tuple[str, Optional[str], Optional[str], float]]:
+        """
+        Returns (node, next node, destination, distance) for every node that can reach (building_name, floor)
+        """
+        targets = self.get_nodes_by_building_and_floor_and_type(building_name, floor, NodeType.BUILDING)
+        _, next_hop = self.search_from_nodes(targets)
+
+        entries = []
+        for v in next_hop:
+            route = self._route_from_next_hop(v, next_hop)
+            next_node = route.path[1] if len(route.path) > 1 else None
+            entries.append((v, next_node, route.destination, route.distance))
+        return entries
+
+    def build_next_hop_table(self) -> NextHopTable:
+        """
+        Builds the next hop table for every (node, building, floor), one reverse search per (building, floor)
+        """
+        groups = self.get_destination_groups()
+        next_hop_table = NextHopTable(sorted(self.get_node_ids()), groups)
 
-        same_node_ids = self.get_node_ids() == other.get_node_ids()
-        same_nodes = any([self.get_node(v) == other.get_node(v) for v in self.get_node_ids()]) \
-            if same_node_ids else False
+        for building, floor in groups:
+            for v, next_node, destination, route_distance in self.next_hop_entries(building, floor):
+                next_hop_table.set_entry(v, building, floor, next_node, destination, route_distance)
 
-        same_buildings = self.get_building_names() == other.get_building_names()
-        same_nodes_by_building = all([self.get_nodes_by_building(b) == other.get_nodes_by_building(b)
-                                      for b in self.get_building_names()]) if same_buildings else False
+        return next_hop_table
 
-        same_floors = self.get_floor_numbers() == other.get_floor_numbers()
-        same_nodes_by_floor = all([self.get_nodes_by_floor(f) == other.get_nodes_by_floor(f)
-                                   for f in self.get_floor_numbers()]) if same_floors else False
+    def find_next_hop(self, src: str, building_name: str, floor: int = 1) -> Tuple[Optional[str], Optional[str], float]:
+        """
+        Returns (next node, destination, distance) of the shortest path from src to building_name on floor without
+        materializing the path when the next hop table is loaded. Next node is None if src is the destination.
+        """
+        key = (src, building_name, floor)
+        if self.next_hop_table is not None and key in self.next_hop_table:
+            instrumentation.count("next_hop_table_hits")
+            return self.next_hop_table.get_next_hop(*key)
+
+        route = self.find_shortest_path(src, building_name, floor, use_astar=True)
+        next_node = route.path[1] if route.path is not None and len(route.path) > 1 else None
+        return next_node, route.destination, route.distance
 
-        same_edges = self.adj == other.adj
+    def find_next_hops(self, srcs: List[str], building_name: str,
+                       floor: int = 1) -> List[Tuple[Optional[str], Optional[str], float]]:
+        """
+        find_next_hop for many sources towards the same (building_name, floor). Sources missing from the caches share
+        a single reverse search from the destination nodes instead of one search each, unless a contraction hierarchy
+        answers them.
+        """
+        assert self.contains_building(building_name)
+
+        misses = [src for src in srcs if (src, building_name, floor) not in self.apsp_cache and
+                  (self.next_hop_table is None or (src, building_name, floor) not in self.next_hop_table)]
+        if len(misses) <= 1 or self.contraction_hierarchy is not None:
+            return [self.find_next_hop(src, building_name, floor) for src in srcs]
+
+        targets = self.get_nodes_by_building_and_floor_and_type(building_name, floor, NodeType.BUILDING)
+        _, next_hop = self.search_from_nodes(targets)
+
+        hops = []
+        for src in srcs:
+            assert self.contains_node(src)
+            if src not in next_hop:
+                hops.append((None, None, float('inf')))
+                continue
+            route = self._route_from_next_hop(src, next_hop)
+            hops.append((route.path[1] if len(route.path) > 1 else None, route.destination, route.distance))
+        return hops
+
+    def clear_cache(self):
+        self.apsp_cache = dict()
+        self.next_hop_table = None
+        self.contraction_hierarchy = None
 
-        return same_nodes and same_nodes_by_building and same_nodes_by_floor and same_edges
+    def __eq__(self, other):
+        """
+        Graphs are equal if they have the same fingerprint, which is O(1) once both fingerprints are known
+        """
+        if not isinstance(other, Graph):
+            return NotImplemented
+        return self.fingerprint() == other.fingerprint()
 
 
 class Polygon:
@@ -456,117 +978,176 @@ class Polygon:
         return f"{self.vertices}"
 
 
-def parse_polygons(polygons_csv_file_path: str) -> Dict[str, Polygon]:
+class BuildingLocator:
     """
-    Returns dictionary mapping building name to polygon representation of building
-
-    CSV structure is assumes to be <Polygon str>, <building num>, <description>
+    Vectorized version of trying every Polygon.is_within_area in order. Every polygon's edges are stored as NumPy
+    arrays, and a point is only ray cast against the polygons whose bounding box contains it. The ray casting is the
+    same arithmetic as Polygon.is_within_area, so the first matching building (in the polygons' dict order) is the same.
     """
-    polygons = dict()
-    with open(polygons_csv_file_path) as nodes_csv:
-        csv_reader = csv.reader(nodes_csv, delimiter=',')
-        line_count = 0
-        for row in csv_reader:
-            if line_count == 0:
-                line_count += 1
+
+    def __init__(self, polygons: Dict[str, Polygon]):
+        self.polygons = polygons
+        self.buildings = list(polygons.keys())
+
+        num_buildings = len(self.buildings)
+        self.min_lat, self.max_lat = np.empty(num_buildings), np.empty(num_buildings)
+        self.min_lon, self.max_lon = np.empty(num_buildings), np.empty(num_buildings)
+        self._edges = []  # (v_1 lat, v_1 lon, v_2 lat, v_2 lon, min lon, max lon) per building
+
+        for i, polygon in enumerate(polygons.values()):
+            lat = np.array([vertex.lat for vertex in polygon.vertices], dtype=float)
+            lon = np.array([vertex.lon for vertex in polygon.vertices], dtype=float)
+            self.min_lat[i], self.max_lat[i] = (lat.min(), lat.max()) if len(lat) else (np.inf, -np.inf)
+            self.min_lon[i], self.max_lon[i] = (lon.min(), lon.max()) if len(lon) else (np.inf, -np.inf)
+
+            # same edges as Polygon._get_edges_to_check: consecutive vertices plus (first, last)
+            v_1 = np.append(np.arange(len(lat) - 1), 0) if len(lat) else np.array([], dtype=int)
+            v_2 = np.append(np.arange(1, len(lat)), -1) if len(lat) else np.array([], dtype=int)
+            self._edges.append((lat[v_1], lon[v_1], lat[v_2], lon[v_2],
+                                np.minimum(lon[v_1], lon[v_2]), np.maximum(lon[v_1], lon[v_2])))
+
+    def _contains(self, building_index: int, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """
+        Ray casts every point against one building's edges at once
+        """
+        lat_1, lon_1, lat_2, lon_2, min_lon, max_lon = self._edges[building_index]
+        lats = lats[:, None]
+        lons = lons[:, None]
+
+        crosses = (min_lon < lons) & (lons < max_lon)
+        x_1 = lat_1 - lats
+        x_2 = lat_2 - lats
+        y_1 = lon_1 - lons
+        y_2 = lon_2 - lons
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intersection_x = (x_1 * y_2 - x_2 * y_1) / (y_2 - y_1)
+
+        count = np.count_nonzero(crosses & (intersection_x > 0), axis=1)
+        return count % 2 == 1
+
+    def _candidates(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        return (self.min_lat <= lat) & (lat <= self.max_lat) & (self.min_lon < lon) & (lon < self.max_lon)
+
+    def locate(self, point: Location) -> Optional[str]:
+        lats = np.array([point.lat])
+        lons = np.array([point.lon])
+        for i in np.flatnonzero(self._candidates(point.lat, point.lon)):
+            if self._contains(i, lats, lons)[0]:
+                return self.buildings[i]
+        return None
+
+    def locate_batch(self, lats, lons) -> List[Optional[str]]:
+        """
+        Returns the building containing each (lat, lon) point, None for points outside every building
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        located = np.full(len(lats), -1)
+
+        for i in range(len(self.buildings)):
+            unassigned = np.flatnonzero((located == -1) & (self.min_lat[i] <= lats) & (lats <= self.max_lat[i]) &
+                                        (self.min_lon[i] < lons) & (lons < self.max_lon[i]))
+            if len(unassigned) == 0:
                 continue
+            inside = self._contains(i, lats[unassigned], lons[unassigned])
+            located[unassigned[inside]] = i
 
-            raw_polygon_str, building, _ = row
-            vertices_str = raw_polygon_str[10: -2]
-            raw_vertices = vertices_str.split(",")
+        return [self.buildings[i] if i >= 0 else None for i in located]
 
-            vertices = []
-            for vertex_str in raw_vertices:
-                lon, lat = vertex_str.split()
-                vertex = Location(lat=float(lat), lon=float(lon))
-                vertices.append(vertex)
 
-            polygons[building] = Polygon(vertices)
-            line_count += 1
+_building_locator: Optional[BuildingLocator] = None
 
-    return polygons
 
+def get_building_locator(polygons: Dict[str, Polygon]) -> BuildingLocator:
+    """
+    Returns a locator for polygons, reusing the last one built for the same (unmodified) polygons dictionary
+    """
+    global _building_locator
+    if _building_locator is None or _building_locator.polygons is not polygons or \
+            len(_building_locator.buildings) != len(polygons):
+        _building_locator = BuildingLocator(polygons)
+    return _building_locator
 
-def parse_nodes(nodes_csv_file_path: str, polygons: Dict[str, Polygon], floor: Optional[int],
-                node_type: NodeType = NodeType.BUILDING) -> List[Node]:
+
+def parse_polygons(polygons_csv_file_path: str) -> Dict[str, Polygon]:
     """
-    CSV structure is assumes to be <location str>, <building num>, <description>
+    Returns dictionary mapping building name to polygon representation of building
+
+    CSV structure is assumes to be <Polygon str>, <building num>, <description>
     """
+    polygons = dict()
+    for names, coordinates, offsets in wkt.read_geometries(polygons_csv_file_path):
+        lons, lats = coordinates[:, 0].tolist(), coordinates[:, 1].tolist()
+        for i, building in enumerate(names):
+            polygons[building] = Polygon([Location(lat=lats[j], lon=lons[j])
+                                          for j in range(offsets[i], offsets[i + 1])])
 
-    nodes = []
-    with open(nodes_csv_file_path) as nodes_csv:
-        csv_reader = csv.reader(nodes_csv, delimiter=',')
-        line_count = 0
-        for row in csv_reader:
-            if line_count == 0:
-                line_count += 1
-                continue
+    return polygons
 
-            raw_location_str, node_name, _ = row
-            location_str = raw_location_str[7: -1]
-            lon, lat = location_str.split()
-            location = Location(lat=float(lat), lon=float(lon))
 
-            building = None
-            for key, polygon in polygons.items():
-                if polygon.is_within_area(location):
-                    building = key
-                    break
+def iter_nodes(nodes_csv_file_path: str, polygons: Dict[str, Polygon], floor: Optional[int],
+               node_type: NodeType = NodeType.BUILDING) -> Iterator[Node]:
+    """
+    Streams the nodes of a CSV, locating the buildings of a whole chunk of rows at once
 
+    CSV structure is assumes to be <location str>, <building num>, <description>
+    """
+    building_locator = get_building_locator(polygons)
+    for names, coordinates, offsets in wkt.read_geometries(nodes_csv_file_path):
+        if len(coordinates) != len(names):
+            raise ValueError(f"Every node of {nodes_csv_file_path} must be a POINT")
+        lons, lats = coordinates[:, 0], coordinates[:, 1]
+        buildings = building_locator.locate_batch(lats, lons)
+
+        for node_name, lat, lon, building in zip(names, lats.tolist(), lons.tolist(), buildings):
             node_name = node_name.split(".")
             node_name.insert(1, str(floor))
             node_name.append(node_type.value)
             node_id = ".".join(node_name)
-            node = Node(id=node_id, location=location, building=building, floor=floor, node_type=node_type)
-            nodes.append(node)
-            line_count += 1
+            yield Node(id=node_id, location=Location(lat=lat, lon=lon), building=building, floor=floor,
+                       node_type=node_type)
 
-    return nodes
 
+def parse_nodes(nodes_csv_file_path: str, polygons: Dict[str, Polygon], floor: Optional[int],
+                node_type: NodeType = NodeType.BUILDING) -> List[Node]:
+    return list(iter_nodes(nodes_csv_file_path, polygons, floor, node_type))
 
-def parse_edges(edges_csv_file_path: str, nodes: List[Node]) -> List[Tuple[str, str]]:
 
-    locations_to_node_ids = dict()
-    for node in nodes:
-        locations_to_node_ids[node.location.values] = node.id
-
-    edges = []
-    with open(edges_csv_file_path) as edges_csv:
-        csv_reader = csv.reader(edges_csv, delimiter=',')
-        line_count = 0
-        for row in csv_reader:
-            if line_count == 0:
-                line_count += 1
-                continue
-
-            raw_line_str, _, _ = row
-            line_str = raw_line_str[12: -1]
-            raw_points = line_str.split(",")
+def locations_to_node_ids(nodes: Iterable[Node]) -> Dict[Tuple[float, float], str]:
+    return {node.location.values: node.id for node in nodes}
 
-            for i in range(len(raw_points)-1):
-                lon_1, lat_1 = [float(val) for val in raw_points[i].split()]
-                lon_2, lat_2 = [float(val) for val in raw_points[i+1].split()]
-                node_1_id = locations_to_node_ids[(lat_1, lon_1)]
-                node_2_id = locations_to_node_ids[(lat_2, lon_2)]
 
-                edge = (node_1_id, node_2_id)
-                edges.append(edge)
+def iter_edges(edges_csv_file_path: str,
+               node_ids_by_location: Dict[Tuple[float, float], str]) -> Iterator[Tuple[str, str]]:
+    """
+    Streams the edges of a CSV of LINESTRINGs, one per consecutive pair of points, whose (lat, lon) are looked up in
+    node_ids_by_location
+    """
+    for _, coordinates, offsets in wkt.read_geometries(edges_csv_file_path):
+        lons, lats = coordinates[:, 0].tolist(), coordinates[:, 1].tolist()
+        for i in range(len(offsets) - 1):
+            for j in range(offsets[i], offsets[i + 1] - 1):
+                yield node_ids_by_location[(lats[j], lons[j])], node_ids_by_location[(lats[j + 1], lons[j + 1])]
 
-            line_count += 1
 
-    return edges
+def parse_edges(edges_csv_file_path: str, nodes: List[Node]) -> List[Tuple[str, str]]:
+    return list(iter_edges(edges_csv_file_path, locations_to_node_ids(nodes)))
 
 
-def create_graph(nodes: List[Node], edges: List[Tuple[str, str]], num_floors: int) -> Graph:
+def create_graph(nodes: Iterable[Node], edges: Iterable[Tuple[str, str]], num_floors: int) -> Graph:
     """
     Hard coded list of edges where each edge is a pair of node ids
+
+    nodes and edges are consumed once, in that order, so both can be streamed from iter_nodes / iter_edges
     """
     graph = Graph()
 
+    vertical_nodes = []
     for node in nodes:
         if node.node_type == NodeType.BUILDING:
             graph.add_node(node)
             continue
+        vertical_nodes.append(node)
 
     for v1_id, v2_id in edges:
         if not graph.contains_node(v1_id):
@@ -582,10 +1163,7 @@ def create_graph(nodes: List[Node], edges: List[Tuple[str, str]], num_floors: in
     # Handle Stair / Elevator Nodes
     # For each stair / elevator node, add an node to each floor, add edge to losest node on eachh floor, and connect
     # vertically with same "node" with default weight=20
-    for node in nodes:
-        if node.node_type == NodeType.BUILDING:
-            continue
-
+    for node in vertical_nodes:
         nodes_to_add = []
         edges_to_add = []
         for floor in range(num_floors):
@@ -612,7 +1190,7 @@ def create_graph(nodes: List[Node], edges: List[Tuple[str, str]], num_floors: in
             v1_id = nodes_to_add[i].id
             v2_id = nodes_to_add[i+1].id
 
-            graph.add_edge(v1_id, v2_id, weight=20)
+            graph.add_edge(v1_id, v2_id, weight=FLOOR_CHANGE_WEIGHT)
 
     return graph
 
@@ -623,7 +1201,11 @@ def create_all_graph_components(num_floors: int = 2, use_cache: bool = True):
     if use_cache:
         graph = Graph()
         graph.load_from_json(GRAPH_JSON_FILE_PATH)
-        graph.load_apsp_from_json(APSP_JSON_FILE_PATH)
+        # a cache built from another graph is dropped and routes are computed on demand
+        if os.path.exists(NEXT_HOP_JSON_FILE_PATH):
+            graph.load_next_hop_table_from_json(NEXT_HOP_JSON_FILE_PATH)
+        else:
+            graph.load_apsp_from_json(APSP_JSON_FILE_PATH)
         return polygons, graph
 
     nodes_stairs = parse_nodes(
@@ -633,36 +1215,47 @@ def create_all_graph_components(num_floors: int = 2, use_cache: bool = True):
     nodes_0 = parse_nodes(NODES_0_CSV_FILE_PATH, polygons, 0)
     nodes_1 = parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
 
-    edges_0 = parse_edges(EDGES_0_CSV_FILE_PATH, nodes_0)
-    edges_1 = parse_edges(EDGES_1_CSV_FILE_PATH, nodes_1)
+    # edges are streamed into the graph rather than parsed into lists first
+    edges = itertools.chain(iter_edges(EDGES_0_CSV_FILE_PATH, locations_to_node_ids(nodes_0)),
+                            iter_edges(EDGES_1_CSV_FILE_PATH, locations_to_node_ids(nodes_1)))
 
     nodes = nodes_stairs + nodes_elevators + nodes_0 + nodes_1
-    edges = edges_0 + edges_1
     graph = create_graph(nodes, edges, num_floors=num_floors)
     return polygons, graph
 
 
-def compare_cache_vs_no_cache():
+def compare_cache_vs_no_cache(repetitions: int = 10):
+    """
+    Times find_shortest_path with and without the APSP cache. The cache files are written to a temporary directory,
+    see benchmark.py for the full suite.
+    """
     _, graph = create_all_graph_components(use_cache=False)
 
-    graph.save_to_json(GRAPH_JSON_FILE_PATH)
-    graph.save_apsp_to_json(APSP_JSON_FILE_PATH)
-
     graph_2 = Graph()
-    graph_2.load_from_json(GRAPH_JSON_FILE_PATH)
-    graph_2.load_apsp_from_json(APSP_JSON_FILE_PATH)
-
-    start = time.time()
-    for building in graph.get_building_names():
-        graph.find_shortest_path("1.1.1.b", building, use_cache=False)
-    end = time.time()
-    avg_non_cache_time = (end - start) / len(graph.get_building_names())
-
-    start = time.time()
-    for building in graph_2.get_building_names():
-        graph_2.find_shortest_path("1.1.1.b", building, use_cache=True)
-    end = time.time()
-    avg_cache_time = (end - start) / len(graph_2.get_building_names())
+    with tempfile.TemporaryDirectory() as temp_dir:
+        graph_json_file_path = os.path.join(temp_dir, "graph.json")
+        apsp_json_file_path = os.path.join(temp_dir, "apsp.json")
+        graph.save_to_json(graph_json_file_path)
+        graph.save_apsp_to_json(apsp_json_file_path)
+
+        graph_2.load_from_json(graph_json_file_path)
+        graph_2.load_apsp_from_json(apsp_json_file_path)
+
+    num_queries = repetitions * len(graph.get_building_names())
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for building in graph.get_building_names():
+            graph.find_shortest_path("1.1.1.b", building, use_cache=False)
+    end = time.perf_counter()
+    avg_non_cache_time = (end - start) / num_queries
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for building in graph_2.get_building_names():
+            graph_2.find_shortest_path("1.1.1.b", building, use_cache=True)
+    end = time.perf_counter()
+    avg_cache_time = (end - start) / num_queries
 
     print("Cache vs No Cache Comparison:")
     print(f"Avg time (non cache): {avg_non_cache_time}")
@@ -674,13 +1267,8 @@ def compare_cache_vs_no_cache():
 
 
 def get_current_building(polygons: Dict[str, Polygon], point: Location) -> str:
-    building_num = None
-    for building, polygon in polygons.items():  # loop thru all the polygons we got from polygons.csv
-        if polygon.is_within_area(point):
-            building_num = building
-            break
-
-    return building_num
+    with instrumentation.stage("get_current_building"):
+        return get_building_locator(polygons).locate(point)
 
 
 def calculate_eta(distance: float, avg_velocity: float = 1.34112):
@@ -691,8 +1279,106 @@ def calculate_eta(distance: float, avg_velocity: float = 1.34112):
     return round(distance / avg_velocity, 2)
 
 
-def calculate_distance(point_1: Location, point_2: Location) -> distance.meters:
-    return geodesic(point_1.values, point_2.values).meters
+@unique
+class DistanceBackend(str, Enum):
+    """
+    Maximum error against GEODESIC measured on pairs of points around MIT:
+
+    GEODESIC          Karney's algorithm on the WGS84 ellipsoid (geopy), the reference
+    HAVERSINE         great circle on a sphere of mean radius, up to 0.3% of the distance (~0.56% worst case globally)
+    LOCAL_PROJECTION  equirectangular projection at the mid latitude with the local WGS84 radii of curvature, under
+                      1 mm for points up to 3 km apart and ~2 cm at 15 km
+    """
+    GEODESIC = "geodesic"
+    HAVERSINE = "haversine"
+    LOCAL_PROJECTION = "local-projection"
+
+
+EARTH_MEAN_RADIUS = 6371008.8  # metres
+
+# geopy's geodesic builds a new Geodesic for every distance, which costs more than the distance itself. The same
+# ellipsoid (in km, as geopy has it) gives bit-identical distances.
+_WGS84_GEODESIC = Geodesic(ELLIPSOIDS["WGS-84"][0], ELLIPSOIDS["WGS-84"][2])
+
+
+def _geodesic_meters(lat_1: float, lon_1: float, lat_2: float, lon_2: float) -> float:
+    """
+    Same as geodesic((lat_1, lon_1), (lat_2, lon_2)).meters
+    """
+    return _WGS84_GEODESIC.Inverse(lat_1, lon_1, lat_2, lon_2, Geodesic.DISTANCE)["s12"] * 1000
+
+
+_distance_backend = DistanceBackend.GEODESIC
+
+
+def set_distance_backend(backend: DistanceBackend):
+    """
+    Selects the backend used by calculate_distance and calculate_distances when none is passed. Edge weights are
+    computed when edges are added, so graphs and caches built with another backend keep their weights.
+    """
+    global _distance_backend
+    _distance_backend = DistanceBackend(backend)
+
+
+def get_distance_backend() -> DistanceBackend:
+    return _distance_backend
+
+
+def calculate_distance(point_1: Location, point_2: Location,
+                       backend: Optional[DistanceBackend] = None) -> distance.meters:
+    backend = _distance_backend if backend is None else backend
+
+    if backend == DistanceBackend.GEODESIC:
+        return _geodesic_meters(point_1.lat, point_1.lon, point_2.lat, point_2.lon)
+
+    if backend == DistanceBackend.HAVERSINE:
+        lat_1 = math.radians(point_1.lat)
+        lat_2 = math.radians(point_2.lat)
+        a = math.sin((lat_2 - lat_1) / 2) ** 2 + \
+            math.cos(lat_1) * math.cos(lat_2) * math.sin(math.radians(point_2.lon - point_1.lon) / 2) ** 2
+        return 2 * EARTH_MEAN_RADIUS * math.asin(math.sqrt(a))
+
+    if backend == DistanceBackend.LOCAL_PROJECTION:
+        mid_lat = (point_1.lat + point_2.lat) / 2
+        meridional_radius, prime_vertical_radius = ellipsoid_radii(mid_lat)
+        dy = math.radians(point_2.lat - point_1.lat) * meridional_radius
+        dx = math.radians(point_2.lon - point_1.lon) * prime_vertical_radius * math.cos(math.radians(mid_lat))
+        return math.hypot(dx, dy)
+
+    raise ValueError(f"Unknown distance backend {backend}")
+
+
+def calculate_distances(lats_1, lons_1, lats_2, lons_2, backend: Optional[DistanceBackend] = None) -> np.ndarray:
+    """
+    Vectorized calculate_distance over arrays of coordinates (broadcasting like NumPy), in meters
+    """
+    backend = _distance_backend if backend is None else backend
+    lats_1, lons_1 = np.asarray(lats_1, dtype=float), np.asarray(lons_1, dtype=float)
+    lats_2, lons_2 = np.asarray(lats_2, dtype=float), np.asarray(lons_2, dtype=float)
+
+    if backend == DistanceBackend.GEODESIC:
+        # no vectorized geodesic, fall back to one call per pair
+        lats_1, lons_1, lats_2, lons_2 = np.broadcast_arrays(lats_1, lons_1, lats_2, lons_2)
+        distances = [_geodesic_meters(lat_1, lon_1, lat_2, lon_2)
+                     for lat_1, lon_1, lat_2, lon_2 in zip(lats_1.ravel(), lons_1.ravel(),
+                                                           lats_2.ravel(), lons_2.ravel())]
+        return np.array(distances, dtype=float).reshape(lats_1.shape)
+
+    if backend == DistanceBackend.HAVERSINE:
+        phi_1 = np.radians(lats_1)
+        phi_2 = np.radians(lats_2)
+        a = np.sin((phi_2 - phi_1) / 2) ** 2 + \
+            np.cos(phi_1) * np.cos(phi_2) * np.sin(np.radians(lons_2 - lons_1) / 2) ** 2
+        return 2 * EARTH_MEAN_RADIUS * np.arcsin(np.sqrt(a))
+
+    if backend == DistanceBackend.LOCAL_PROJECTION:
+        mid_lat = np.radians((lats_1 + lats_2) / 2)
+        w = np.sqrt(1 - WGS84_E2 * np.sin(mid_lat) ** 2)
+        dy = np.radians(lats_2 - lats_1) * WGS84_A * (1 - WGS84_E2) / w ** 3
+        dx = np.radians(lons_2 - lons_1) * WGS84_A / w * np.cos(mid_lat)
+        return np.hypot(dx, dy)
+
+    raise ValueError(f"Unknown distance backend {backend}")
 
 
 # def calculate_direction(first_point, second_point):
@@ -771,6 +1457,7 @@ if __name__ == "__main__":
 
     print("Path Finding:")
     print(graph.find_shortest_path("7.1.1.b", "2"))
+    print(graph.find_route_to_node("7.1.1.b", "2.1.1.b"))
     print("---------")
 
     compare_cache_vs_no_cache()
@@ -0,0 +1,178 @@
+"""
+Per-stage latency timers and counters for the request path.
+
+Instrumentation is off by default and then costs one global check per stage: stage() returns a shared no-op context
+manager and count() returns immediately. Once enabled, with enable() or by setting NAVIGATION_INSTRUMENTATION=1 for
+the sandbox, every stage records its count, total and max time and counters accumulate (apsp_cache hits and misses,
+a miss being a lookup that none of the caches answered, nodes settled and heap pushes of the searches, ...).
+get_snapshot() exports them, e.g. on the server's /metrics.
+
+With a trace log, each request_trace() additionally appends one JSON line with the time of every stage of that
+request to the log file (NAVIGATION_TRACE_LOG for the sandbox), which stays open while instrumentation is enabled.
+Traces leave out who and where the device is (user_id, lat, lon) unless trace_locations is set
+(NAVIGATION_TRACE_LOCATIONS=1), see traces_locations().
+"""
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Dict, Optional, TextIO
+
+INSTRUMENTATION_ENV_VAR = "NAVIGATION_INSTRUMENTATION"
+TRACE_LOG_ENV_VAR = "NAVIGATION_TRACE_LOG"
+TRACE_LOCATIONS_ENV_VAR = "NAVIGATION_TRACE_LOCATIONS"
+
+
+@dataclass
+class StageTimer:
+    count: int = 0
+    total: float = 0.0  # seconds
+    max: float = 0.0  # seconds
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count if self.count else 0.0,
+                "max": self.max}
+
+
+_enabled = False
+_trace_log: Optional[TextIO] = None
+_trace_locations = False
+
+_lock = threading.Lock()
+_stages: Dict[str, StageTimer] = dict()
+_counters: Dict[str, int] = dict()
+_local = threading.local()  # .trace, the stage times of the request being traced on this thread
+
+_NOOP = nullcontext()
+
+
+def enable(trace_log_file_path: Optional[str] = None, trace_locations: bool = False):
+    global _enabled, _trace_log, _trace_locations
+    disable()
+    with _lock:
+        if trace_log_file_path is not None:
+            # line buffered, so every trace reaches the file as it is written
+            _trace_log = open(trace_log_file_path, "a", buffering=1)
+        _trace_locations = trace_locations
+        _enabled = True
+
+
+def disable():
+    global _enabled, _trace_log, _trace_locations
+    with _lock:
+        _enabled = False
+        _trace_locations = False
+        if _trace_log is not None:
+            _trace_log.close()
+            _trace_log = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def is_tracing() -> bool:
+    """
+    Whether request_trace() writes traces, callers can skip building their fields otherwise
+    """
+    return _enabled and _trace_log is not None
+
+
+def traces_locations() -> bool:
+    """
+    Whether request traces may include the device's user_id and exact location
+    """
+    return _trace_locations
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            timer = _stages.get(self.name)
+            if timer is None:
+                timer = _stages[self.name] = StageTimer()
+            timer.count += 1
+            timer.total += elapsed
+            timer.max = max(timer.max, elapsed)
+
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace["stages"][self.name] = trace["stages"].get(self.name, 0.0) + elapsed
+
+
+def stage(name: str):
+    """
+    Context manager timing the stage name, a no-op when instrumentation is disabled
+    """
+    if not _enabled:
+        return _NOOP
+    return _Stage(name)
+
+
+def count(name: str, n: int = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["counters"][name] = trace["counters"].get(name, 0) + n
+
+
+class _RequestTrace:
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        _local.trace = {"stages": dict(), "counters": dict()}
+
+    def __exit__(self, *exc_info):
+        trace, _local.trace = _local.trace, None
+        record = dict(self.fields, timestamp=time.time(), total=time.perf_counter() - self.start, **trace)
+        line = json.dumps(record)
+        with _lock:
+            if _trace_log is not None:
+                _trace_log.write(line + "\n")
+
+
+def request_trace(**fields):
+    """
+    Context manager around one request. With a trace log, the request's stage times and counters are appended to it
+    as one JSON line along with fields.
+    """
+    if not is_tracing():
+        return _NOOP
+    return _RequestTrace(fields)
+
+
+def get_snapshot() -> dict:
+    with _lock:
+        return {
+            "enabled": _enabled,
+            "stages": {name: timer.to_dict() for name, timer in sorted(_stages.items())},
+            "counters": dict(sorted(_counters.items())),
+        }
+
+
+if os.environ.get(INSTRUMENTATION_ENV_VAR) == "1":
+    enable(os.environ.get(TRACE_LOG_ENV_VAR), trace_locations=os.environ.get(TRACE_LOCATIONS_ENV_VAR) == "1")
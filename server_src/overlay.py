@@ -0,0 +1,205 @@
+"""
+Two-level router over the buildings of a Graph.
+
+Every building is a cell. Its portals are the nodes with an edge to another building, plus its stairs and elevators.
+Each cell keeps a shortest path tree from every portal restricted to the cell, which gives the intra-building distance
+table between its portals and from its portals to every node of the building. The overlay graph has the portals as
+nodes, the edges between buildings, and an edge between every two portals of a building weighted by their
+intra-building distance.
+
+A query leaves the source's building through one of its portals, crosses the overlay and enters the destination
+building through one of its portals, or stays inside the building when source and destination share it. Precompute
+and memory grow with the number of portals and building sizes instead of with V * B * F routes.
+"""
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
+
+from graph import Graph, NodeType, Route
+
+PORTAL_NODE_TYPES = {NodeType.STAIR, NodeType.ELEVATOR}
+
+Tree = Tuple[Dict[str, float], Dict[str, Optional[str]]]  # (distance, parent towards the root)
+
+
+class BuildingCell:
+
+    def __init__(self, graph: Graph, building_name: Optional[str]):
+        self.building_name = building_name
+        self.nodes = set(graph.get_nodes_by_building(building_name))
+        self.portals = sorted(node_id for node_id in self.nodes
+                              if NodeType(graph.get_node(node_id).node_type) in PORTAL_NODE_TYPES
+                              or any(n not in self.nodes for n in graph.adj[node_id]))
+        self.trees: Dict[str, Tree] = {portal: search_in_cell(graph, self.nodes, portal) for portal in self.portals}
+
+    def distance(self, portal: str, node_id: str) -> float:
+        return self.trees[portal][0].get(node_id, float('inf'))
+
+    def path_to_portal(self, node_id: str, portal: str) -> List[str]:
+        """
+        Intra-building shortest path from node_id to portal
+        """
+        parent = self.trees[portal][1]
+        path = [node_id]
+        while parent[path[-1]] is not None:
+            path.append(parent[path[-1]])
+        return path
+
+
+def search_in_cell(graph: Graph, cell_nodes: Set[str], src: str, targets: Optional[Set[str]] = None) -> Tree:
+    """
+    Dijkstra from src that never leaves cell_nodes. Stops at the first settled target if targets are given.
+    """
+    dist = {src: 0}
+    parent = {src: None}
+    pq = [(0, src)]
+    while pq:
+        (d, current_vertex) = heapq.heappop(pq)
+        if d > dist[current_vertex]:
+            continue  # stale entry
+        if targets is not None and current_vertex in targets:
+            break
+        for n, edge_weight in graph.adj[current_vertex].items():
+            new_cost = d + edge_weight
+            if n in cell_nodes and new_cost < dist.get(n, float('inf')):
+                heapq.heappush(pq, (new_cost, n))
+                dist[n] = new_cost
+                parent[n] = current_vertex
+    return dist, parent
+
+
+class BuildingOverlayRouter:
+
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self.cells: Dict[Optional[str], BuildingCell] = {building_name: BuildingCell(graph, building_name)
+                                                         for building_name in graph.get_building_names()}
+
+        self.overlay: Dict[str, Dict[str, float]] = dict()  # portal -> {portal: weight}
+        for cell in self.cells.values():
+            for portal in cell.portals:
+                neighbors = self.overlay.setdefault(portal, dict())
+                for other_portal in cell.portals:
+                    distance = cell.distance(portal, other_portal)
+                    if other_portal != portal and distance < float('inf'):
+                        neighbors[other_portal] = distance
+                for n, edge_weight in graph.adj[portal].items():
+                    if n not in cell.nodes:
+                        neighbors[n] = edge_weight
+
+        self._exits: Dict[Tuple[str, int], Dict[str, Tuple[float, str]]] = dict()  # computed lazily
+
+    @property
+    def num_portals(self) -> int:
+        return len(self.overlay)
+
+    @property
+    def num_overlay_edges(self) -> int:
+        return sum(len(neighbors) for neighbors in self.overlay.values()) // 2
+
+    @property
+    def num_table_entries(self) -> int:
+        """
+        Stored intra-building distances, one per (portal, node of its building)
+        """
+        return sum(len(tree[0]) for cell in self.cells.values() for tree in cell.trees.values())
+
+    def _cell_of(self, node_id: str) -> BuildingCell:
+        return self.cells[self.graph.get_node(node_id).building]
+
+    def _exits_to(self, building_name: str, floor: int) -> Dict[str, Tuple[float, str]]:
+        """
+        For every portal of building_name, the (distance, node) of its closest building node on floor
+        """
+        key = (building_name, floor)
+        if key not in self._exits:
+            cell = self.cells[building_name]
+            targets = self.graph.get_nodes_by_building_and_floor_and_type(building_name, floor, NodeType.BUILDING)
+            exits = dict()
+            for portal in cell.portals:
+                reachable = [(cell.distance(portal, target), target) for target in sorted(targets)]
+                distance, target = min(reachable, default=(float('inf'), None))
+                if target is not None and distance < float('inf'):
+                    exits[portal] = (distance, target)
+            self._exits[key] = exits
+        return self._exits[key]
+
+    def find_shortest_path(self, src: str, building_name: str, floor: int = 1) -> Route:
+        assert self.graph.contains_node(src)
+        assert self.graph.contains_building(building_name)
+
+        targets = self.graph.get_nodes_by_building_and_floor_and_type(building_name, floor, NodeType.BUILDING)
+        src_cell = self._cell_of(src)
+        best_distance = float('inf')
+        best_path = None
+
+        if src_cell.building_name == building_name and targets:
+            dist, parent = search_in_cell(self.graph, src_cell.nodes, src, targets)
+            reached = [target for target in targets if target in dist]
+            if reached:
+                target = min(reached, key=lambda node_id: (dist[node_id], node_id))
+                best_distance = dist[target]
+                best_path = [target]
+                while parent[best_path[-1]] is not None:
+                    best_path.append(parent[best_path[-1]])
+                best_path.reverse()
+
+        # overlay search seeded with the distances from src to the portals of its building
+        exits = self._exits_to(building_name, floor)
+        dist = dict()
+        parent = dict()
+        pq = []
+        for portal in src_cell.portals:
+            distance = src_cell.distance(portal, src)
+            if distance < float('inf'):
+                dist[portal] = distance
+                parent[portal] = None
+                pq.append((distance, portal))
+        heapq.heapify(pq)
+
+        best_exit = None
+        while pq:
+            (d, current_vertex) = heapq.heappop(pq)
+            if d >= best_distance:
+                break
+            if d > dist[current_vertex]:
+                continue  # stale entry
+            if current_vertex in exits and d + exits[current_vertex][0] < best_distance:
+                best_distance = d + exits[current_vertex][0]
+                best_exit = current_vertex
+
+            for n, edge_weight in self.overlay[current_vertex].items():
+                new_cost = d + edge_weight
+                if new_cost < dist.get(n, float('inf')):
+                    heapq.heappush(pq, (new_cost, n))
+                    dist[n] = new_cost
+                    parent[n] = current_vertex
+
+        if best_exit is not None:
+            best_path = self._expand(src, best_exit, parent, exits[best_exit][1])
+        if best_path is None:
+            return Route(source=src, destination=None, path=None, distance=float('inf'))
+
+        # distances are re-accumulated from src so they match Graph's searches exactly
+        distance = 0
+        for v1_id, v2_id in zip(best_path, best_path[1:]):
+            distance += self.graph.adj[v1_id][v2_id]
+        return Route(source=src, destination=best_path[-1], path=best_path, distance=distance)
+
+    def _expand(self, src: str, exit_portal: str, parent: Dict[str, Optional[str]], target: str) -> List[str]:
+        """
+        Turns src -> portals -> target into a path over the original edges
+        """
+        portals = [exit_portal]
+        while parent[portals[-1]] is not None:
+            portals.append(parent[portals[-1]])
+        portals.reverse()
+
+        path = self._cell_of(src).path_to_portal(src, portals[0])
+        for v1_id, v2_id in zip(portals, portals[1:]):
+            cell = self._cell_of(v1_id)
+            if v2_id in cell.nodes:
+                path.extend(cell.path_to_portal(v1_id, v2_id)[1:])
+            else:
+                path.append(v2_id)
+        path.extend(reversed(self._cell_of(exit_portal).path_to_portal(target, exit_portal)[:-1]))
+        return path
@@ -0,0 +1,122 @@
+"""
+Offline regeneration of the APSP cache and next hop table.
+
+    python precompute.py --workers 8 --next-hop-json data/next_hop.json
+
+Destination groups ((building, floor) pairs) are independent of each other, so they are partitioned across a process
+pool. Every worker receives the read-only graph once through the pool initializer. Results are merged in chunk order,
+which is not the serial group order, but the APSP JSON is written with sorted keys and next hop entries are stored by
+(node, group) position, so the files written are still byte-identical to the serial build.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import graph as graph_utils
+from graph import Graph, NextHopTable, Route
+
+Group = Tuple[str, int]
+
+_worker_graph: Optional[Graph] = None
+
+
+def _init_worker(graph: Graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _apsp_for_groups(groups: List[Group]) -> Dict[Tuple[str, str, int], Route]:
+    apsp = {}
+    for building, floor in groups:
+        apsp.update(_worker_graph.apsp_to_building(building, floor))
+    return apsp
+
+
+def _next_hop_entries_for_groups(groups: List[Group]) -> List[Tuple[Group, list]]:
+    return [((building, floor), _worker_graph.next_hop_entries(building, floor)) for building, floor in groups]
+
+
+def partition(groups: List[Group], num_chunks: int) -> List[List[Group]]:
+    """
+    Round-robin split, so every chunk gets a similar mix of large and small buildings
+    """
+    chunks = [groups[i::num_chunks] for i in range(num_chunks)]
+    return [chunk for chunk in chunks if chunk]
+
+
+def _routing_graph(graph: Graph) -> Graph:
+    """
+    Returns a copy of graph without its caches, which is all the workers need
+    """
+    routing_graph = Graph()
+    routing_graph._vertices = graph._vertices
+    routing_graph.buildings = graph.buildings
+    routing_graph.floors = graph.floors
+    routing_graph.types = graph.types
+    routing_graph.adj = graph.adj
+    return routing_graph
+
+
+def _map_groups(graph: Graph, function, workers: int, chunks_per_worker: int = 4) -> list:
+    chunks = partition(graph.get_destination_groups(), workers * chunks_per_worker)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_routing_graph(graph),)) as executor:
+        return list(executor.map(function, chunks))
+
+
+def build_apsp(graph: Graph, workers: int = 1) -> Dict[Tuple[str, str, int], Route]:
+    if workers <= 1:
+        return graph.apsp()
+
+    apsp = {}
+    for chunk_apsp in _map_groups(graph, _apsp_for_groups, workers):
+        apsp.update(chunk_apsp)
+    return apsp
+
+
+def build_next_hop_table(graph: Graph, workers: int = 1) -> NextHopTable:
+    if workers <= 1:
+        return graph.build_next_hop_table()
+
+    next_hop_table = NextHopTable(sorted(graph.get_node_ids()), graph.get_destination_groups())
+    for chunk_entries in _map_groups(graph, _next_hop_entries_for_groups, workers):
+        for (building, floor), entries in chunk_entries:
+            for v, next_node, destination, distance in entries:
+                next_hop_table.set_entry(v, building, floor, next_node, destination, distance)
+    return next_hop_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerates the APSP cache and next hop table")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes, 1 runs the serial build")
+    parser.add_argument("--rebuild-graph", action="store_true",
+                        help="rebuild the graph from the CSV exports and overwrite --graph-json first")
+    parser.add_argument("--graph-json", default=graph_utils.GRAPH_JSON_FILE_PATH)
+    parser.add_argument("--apsp-json", default=graph_utils.APSP_JSON_FILE_PATH)
+    parser.add_argument("--next-hop-json", default=None, help="also write the next hop table to this path")
+    args = parser.parse_args()
+
+    if args.rebuild_graph:
+        _, graph = graph_utils.create_all_graph_components(use_cache=False)
+        graph.save_to_json(args.graph_json)
+    else:
+        graph = Graph()
+        graph.load_from_json(args.graph_json)
+
+    start = time.perf_counter()
+    apsp = build_apsp(graph, workers=args.workers)
+    graph.save_apsp_to_json(args.apsp_json, apsp=apsp)
+    print(f"Wrote {len(apsp)} routes to {args.apsp_json} in {time.perf_counter() - start:.2f}s")
+
+    if args.next_hop_json is not None:
+        start = time.perf_counter()
+        next_hop_table = build_next_hop_table(graph, workers=args.workers)
+        graph.save_next_hop_table_to_json(args.next_hop_json, next_hop_table=next_hop_table)
+        print(f"Wrote next hop table to {args.next_hop_json} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
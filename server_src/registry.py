@@ -0,0 +1,205 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import contraction
+import graph as graph_utils
+import snapshot
+
+
+GraphComponents = Tuple[Dict[str, graph_utils.Polygon], graph_utils.Graph]
+
+JSON_FILE_PATHS = [
+    graph_utils.POLYGONS_CSV_FILE_PATH,
+    graph_utils.GRAPH_JSON_FILE_PATH,
+    graph_utils.APSP_JSON_FILE_PATH,
+]
+NEXT_HOP_JSON_FILE_PATHS = [
+    graph_utils.POLYGONS_CSV_FILE_PATH,
+    graph_utils.GRAPH_JSON_FILE_PATH,
+    graph_utils.NEXT_HOP_JSON_FILE_PATH,
+]
+SNAPSHOT_FILE_PATHS = [
+    graph_utils.POLYGONS_CSV_FILE_PATH,
+    graph_utils.GRAPH_SNAPSHOT_FILE_PATH,
+]
+
+
+@dataclass
+class RegistryStats:
+    hits: int = 0
+    misses: int = 0
+    loads: int = 0
+    last_load_time: float = 0.0  # seconds
+    total_load_time: float = 0.0  # seconds
+
+
+@dataclass(frozen=True)
+class FileSignature:
+    mtime_ns: int
+    size: int
+    sha256: str
+
+
+def _hash_file(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@dataclass(frozen=True)
+class LoadMode:
+    """
+    Which of the optional precomputed files the default loader uses. It is resolved once, so the registry watches the
+    files it actually loads even if one of them appears or disappears later.
+    """
+    snapshot: bool
+    next_hop_table: bool
+    contraction_hierarchy: bool
+
+    @classmethod
+    def detect(cls) -> "LoadMode":
+        return cls(snapshot=os.path.exists(graph_utils.GRAPH_SNAPSHOT_FILE_PATH),
+                   next_hop_table=os.path.exists(graph_utils.NEXT_HOP_JSON_FILE_PATH),
+                   contraction_hierarchy=os.path.exists(contraction.CH_JSON_FILE_PATH))
+
+    @property
+    def file_paths(self) -> List[str]:
+        if self.snapshot:
+            file_paths = SNAPSHOT_FILE_PATHS
+        elif self.next_hop_table:
+            file_paths = NEXT_HOP_JSON_FILE_PATHS
+        else:
+            file_paths = JSON_FILE_PATHS
+
+        if self.contraction_hierarchy:
+            file_paths = file_paths + [contraction.CH_JSON_FILE_PATH]
+        return file_paths
+
+
+def _default_loader(mode: LoadMode) -> GraphComponents:
+    """
+    Prefers the binary snapshot when one has been built, otherwise falls back to the JSON graph and its next hop table
+    or APSP cache. A contraction hierarchy built for the graph answers the queries missing from the cache.
+    """
+    polygons = graph_utils.parse_polygons(graph_utils.POLYGONS_CSV_FILE_PATH)
+    if mode.snapshot:
+        graph = snapshot.load_snapshot(graph_utils.GRAPH_SNAPSHOT_FILE_PATH)
+    else:
+        graph = graph_utils.Graph()
+        graph.load_from_json(graph_utils.GRAPH_JSON_FILE_PATH)
+        # a cache built from another graph is dropped and routes are computed on demand
+        if mode.next_hop_table:
+            graph.load_next_hop_table_from_json(graph_utils.NEXT_HOP_JSON_FILE_PATH)
+        else:
+            graph.load_apsp_from_json(graph_utils.APSP_JSON_FILE_PATH)
+
+    if mode.contraction_hierarchy:
+        contraction.attach_contraction_hierarchy(graph)
+    return polygons, graph
+
+
+class GraphRegistry:
+    """
+    Loads the graph components once per process and hands out the same (polygons, graph) pair on every call.
+
+    The backing files are stat-ed on every call. If a file's mtime or size changed, its content hash is compared with
+    the one recorded at load time, so a file that was only touched does not trigger a reload.
+
+    The returned objects are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, file_paths: Optional[List[str]] = None,
+                 loader: Optional[Callable[[], GraphComponents]] = None):
+        mode = LoadMode.detect() if file_paths is None or loader is None else None
+        self.file_paths = list(mode.file_paths if file_paths is None else file_paths)
+        self.stats = RegistryStats()
+
+        self._loader = functools.partial(_default_loader, mode) if loader is None else loader
+        self._lock = threading.Lock()
+        self._components: Optional[GraphComponents] = None
+        self._signatures: Dict[str, FileSignature] = dict()
+
+    def get(self) -> GraphComponents:
+        with self._lock:
+            if self._components is not None and not self._is_stale():
+                self.stats.hits += 1
+                return self._components
+
+            self.stats.misses += 1
+            self._load()
+            return self._components
+
+    def invalidate(self):
+        """
+        Forces the next call to get() to reload the graph components
+        """
+        with self._lock:
+            self._components = None
+            self._signatures = dict()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return asdict(self.stats)
+
+    def _load(self):
+        start = time.perf_counter()
+
+        signatures = {file_path: self._sign(file_path) for file_path in self.file_paths}
+        self._components = self._loader()
+        self._signatures = signatures
+
+        load_time = time.perf_counter() - start
+        self.stats.loads += 1
+        self.stats.last_load_time = load_time
+        self.stats.total_load_time += load_time
+
+    @staticmethod
+    def _sign(file_path: str) -> FileSignature:
+        stat = os.stat(file_path)
+        return FileSignature(mtime_ns=stat.st_mtime_ns, size=stat.st_size, sha256=_hash_file(file_path))
+
+    def _is_stale(self) -> bool:
+        """
+        Returns whether any backing file changed since the last load. Files whose mtime changed but whose content did
+        not have their recorded signature refreshed instead.
+        """
+        for file_path in self.file_paths:
+            signature = self._signatures.get(file_path)
+
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                return True
+
+            if signature is None:
+                return True
+            if stat.st_mtime_ns == signature.mtime_ns and stat.st_size == signature.size:
+                continue
+
+            sha256 = _hash_file(file_path)
+            if sha256 != signature.sha256:
+                return True
+            self._signatures[file_path] = FileSignature(mtime_ns=stat.st_mtime_ns, size=stat.st_size, sha256=sha256)
+
+        return False
+
+
+_registry = GraphRegistry()
+
+
+def get_registry() -> GraphRegistry:
+    return _registry
+
+
+def get_graph_components() -> GraphComponents:
+    """
+    Returns the process-wide shared (polygons, graph) pair, loading it on first use
+    """
+    return _registry.get()
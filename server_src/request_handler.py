@@ -3,10 +3,25 @@ sys.path.append('/var/jail/home/team8/server_src')
 # POLYGONS_CSV_FILE_PATH = "/var/jail/home/team8/server_src/polygons.csv"
 
 # from server_src import graph as graph_utils
+import instrumentation
+import registry
+import response_cache
+import sessions
 import json
 import graph as graph_utils
 from dataclasses import dataclass, asdict
 
+MAX_BATCH_SIZE = 1000  # requests per POST
+
+# the 'format' GET parameter, compact is the ';' separated line encode_compact_response writes
+JSON_FORMAT = "json"
+COMPACT_FORMAT = "compact"
+RESPONSE_FORMATS = (JSON_FORMAT, COMPACT_FORMAT)
+
+# GET parameters written to the trace log, the identifying ones only with instrumentation.traces_locations()
+TRACED_VALUES = ("current_floor", "destination", "destination_floor", "format")
+IDENTIFYING_VALUES = ("user_id", "lat", "lon")
+
 
 @dataclass
 class RequestValues:
@@ -15,6 +30,7 @@ class RequestValues:
     destination: str
     current_floor: int
     destination_floor: int
+    response_format: str = JSON_FORMAT
 
 
 @dataclass
@@ -32,8 +48,10 @@ class Response:
 
 
 def try_parse_get_request(request) -> RequestValues:
-    values = request.get("values")
+    return parse_request_values(request.get("values"))
 
+
+def parse_request_values(values: dict) -> RequestValues:
     assert "user_id" in values, "Missing data: 'user_id'"
     assert "lat" in values, "Missing data: 'lat'"
     assert "lon" in values, "Missing data: 'lon'"
@@ -48,46 +66,219 @@ def try_parse_get_request(request) -> RequestValues:
     destination = str(int(destination))
     current_floor = int(values.get("current_floor"))
     destination_floor = int(values.get("destination_floor"))
+    response_format = values.get("format", JSON_FORMAT)
+    assert response_format in RESPONSE_FORMATS, f"format must be one of {', '.join(RESPONSE_FORMATS)}"
 
     point = graph_utils.Location(lat=lat, lon=lon)
 
     return RequestValues(user_id=user_id, point=point, destination=destination, current_floor=current_floor,
-                         destination_floor=destination_floor)
+                         destination_floor=destination_floor, response_format=response_format)
+
+
+def try_parse_post_request(request) -> list:
+    """
+    The batch form has a single 'requests' field: a JSON array of objects with the GET parameters
+    """
+    form = request.get("form") or dict()
+    assert "requests" in form, "Missing data: requests"
+    try:
+        requests = json.loads(form["requests"])
+    except ValueError:
+        raise AssertionError("requests must be a JSON array")
+    assert isinstance(requests, list), "requests must be a JSON array"
+    assert len(requests) <= MAX_BATCH_SIZE, f"At most {MAX_BATCH_SIZE} requests per batch"
+    return requests
+
+
+def has_arrived(request_values: RequestValues, curr_node: graph_utils.Node, curr_building: str) -> bool:
+    return (curr_building == request_values.destination and
+            request_values.current_floor == request_values.destination_floor) or \
+           (curr_node.building == request_values.destination and
+            curr_node.floor == request_values.destination_floor)
+
+
+def build_response(graph, request_values: RequestValues, curr_node_id: str, curr_building: str,
+                   next_node_id: str, dest_node_id: str, route_distance: float) -> dict:
+    curr_node = graph.get_node(curr_node_id)
+    next_node = graph.get_node(next_node_id) if next_node_id is not None else curr_node
+    dest_node = graph.get_node(dest_node_id)
+
+    dist_next_node = graph_utils.calculate_distance(curr_node.location, next_node.location)
+    dir_next_node = graph_utils.calculate_direction(curr_node.location, next_node.location)
+    eta = graph_utils.calculate_eta(route_distance)
+
+    response = Response(curr_building=curr_node.building, next_building=next_node.building,
+                        curr_node=curr_node.id, next_node=next_node.id,
+                        dist_next_node=dist_next_node, dir_next_node=dir_next_node,
+                        has_arrived=has_arrived(request_values, curr_node, curr_building), eta=eta,
+                        dest_node=dest_node.id, dest_building=dest_node.building)
+
+    response_dict = asdict(response)
+    response_dict["has_arrived"] = int(response.has_arrived)
+    return response_dict
+
+
+def encode_compact_response(graph, request_values: RequestValues, curr_node_id: str, curr_building: str,
+                            next_node_id: str, dest_node_id: str, route_distance: float) -> str:
+    """
+    The fields of Response, in declaration order, on one ';' separated line written straight from the node ids,
+    e.g. "1;1;1.1.1.b;1.1.2.b;12.3;-90.0;0;84.5;2.1.1.b;2". Distances, the direction and the eta are rounded to 0.1,
+    has_arrived is 0 or 1 and a missing building is an empty field.
+    """
+    curr_node = graph.get_node(curr_node_id)
+    next_node = graph.get_node(next_node_id) if next_node_id is not None else curr_node
+    dest_node = graph.get_node(dest_node_id)
+
+    return (f"{curr_node.building or ''};{next_node.building or ''};{curr_node.id};{next_node.id};"
+            f"{graph_utils.calculate_distance(curr_node.location, next_node.location):.1f};"
+            f"{graph_utils.calculate_direction(curr_node.location, next_node.location):.1f};"
+            f"{int(has_arrived(request_values, curr_node, curr_building))};"
+            f"{graph_utils.calculate_eta(route_distance):.1f};{dest_node.id};{dest_node.building or ''}")
 
 
 def request_handler(request):
+    if request['method'] == "POST":
+        try:
+            with instrumentation.request_trace(method="POST"):
+                return json.dumps(navigate_batch(try_parse_post_request(request)))
+        except AssertionError as e:
+            return e
     if request['method'] != "GET":
         return f"{request['method']} requests not allowed."
 
+    if not instrumentation.is_tracing():
+        return handle_get_request(request)
+    with instrumentation.request_trace(method="GET", values=trace_values(request.get("values"))):
+        return handle_get_request(request)
+
+
+def trace_values(values) -> dict:
+    if not isinstance(values, dict):
+        return dict()
+    keys = TRACED_VALUES + IDENTIFYING_VALUES if instrumentation.traces_locations() else TRACED_VALUES
+    return {key: values[key] for key in keys if key in values}
+
+
+def handle_get_request(request):
     try:
-        request_values = try_parse_get_request(request)
+        with instrumentation.stage("parse"):
+            request_values = try_parse_get_request(request)
     except AssertionError as e:
         return e
     except ValueError:
         return "Both lat and lon must be valid coordinates"
 
-    polygons, graph = graph_utils.create_all_graph_components(use_cache=True)
-    curr_node = graph.get_node(graph.get_closest_node(request_values.point, floor=request_values.current_floor))
+    with instrumentation.stage("graph_components"):
+        polygons, graph = registry.get_graph_components()
+
+    # the device's session advances along its route, and only reroutes when the device left it
+    with instrumentation.stage("route"):
+        session = sessions.navigate(graph, request_values.user_id, request_values.point,
+                                    request_values.current_floor, request_values.destination,
+                                    request_values.destination_floor)
+        if session is not None:
+            curr_node_id = session.current_node
+            next_node_id, dest_node_id, route_distance = session.next_node, session.path[-1], \
+                session.remaining_distance
+        else:
+            curr_node_id = graph.get_closest_node(request_values.point, floor=request_values.current_floor)
+            next_node_id, dest_node_id, route_distance = graph.find_next_hop(curr_node_id, request_values.destination,
+                                                                             request_values.destination_floor)
+
     curr_building = graph_utils.get_current_building(polygons, request_values.point)
-    has_arrived = (curr_building == request_values.destination and
-                   request_values.current_floor == request_values.destination_floor) or \
-                  (curr_node.building == request_values.destination and
-                   curr_node.floor == request_values.destination_floor)
 
-    route = graph.find_shortest_path(curr_node.id, request_values.destination, request_values.destination_floor)
+    # polls on the same route from the same few metres and building get the same response, which is only built once
+    cache = response_cache.get_response_cache()
+    with instrumentation.stage("response_cache"):
+        cache_key = cache.make_key(request_values.point, request_values.current_floor, request_values.destination,
+                                   request_values.destination_floor, request_values.response_format,
+                                   curr_building=curr_building,
+                                   route=(curr_node_id, next_node_id, dest_node_id, route_distance))
+        cached_response = cache.get(cache_key, graph.fingerprint())
+    if cached_response is not None:
+        instrumentation.count("response_cache_hits")
+        return cached_response
+    instrumentation.count("response_cache_misses")
 
-    next_node = graph.get_node(route.path[1]) if len(route.path) > 1 else curr_node
-    dest_node = graph.get_node(route.destination)
+    if request_values.response_format == COMPACT_FORMAT:
+        with instrumentation.stage("response"):
+            response_body = encode_compact_response(graph, request_values, curr_node_id, curr_building,
+                                                    next_node_id, dest_node_id, route_distance)
+    else:
+        with instrumentation.stage("response"):
+            response_dict = build_response(graph, request_values, curr_node_id, curr_building, next_node_id,
+                                           dest_node_id, route_distance)
+        with instrumentation.stage("serialize"):
+            response_body = json.dumps(response_dict)
+    cache.put(cache_key, graph.fingerprint(), response_body)
+    return response_body
 
-    dist_next_node = graph_utils.calculate_distance(curr_node.location, next_node.location)
-    dir_next_node = graph_utils.calculate_direction(curr_node.location, next_node.location)
-    eta = graph_utils.calculate_eta(route.distance)
 
-    response = Response(curr_building=curr_node.building, next_building=next_node.building,
-                        curr_node=curr_node.id, next_node=next_node.id,
-                        dist_next_node=dist_next_node, dir_next_node=dir_next_node,
-                        has_arrived=has_arrived, eta=eta, dest_node=dest_node.id, dest_building=dest_node.building)
+def navigate_batch(requests: list) -> dict:
+    """
+    Answers many devices at once: the request objects (the GET parameters of request_handler) are parsed, located in
+    their buildings with one vectorized polygon pass, matched to their closest nodes floor by floor and routed
+    destination by destination, so requests towards the same (building, floor) share one search.
 
-    response_dict = asdict(response)
-    response_dict["has_arrived"] = int(response.has_arrived)
-    return json.dumps(response_dict)
+    Returns {"responses": [...]} in the order of requests, with {"error": message} in place of a response for the
+    requests that could not be answered. Batches are stateless: they neither read nor update the device sessions.
+    """
+    polygons, graph = registry.get_graph_components()
+
+    responses = [None] * len(requests)
+    parsed = dict()  # index -> RequestValues
+    for i, values in enumerate(requests):
+        try:
+            assert isinstance(values, dict), "Each request must be a JSON object"
+            parsed[i] = parse_request_values(values)
+        except AssertionError as e:
+            responses[i] = {"error": str(e)}
+        except (TypeError, ValueError):
+            responses[i] = {"error": "Both lat and lon must be valid coordinates"}
+
+    indices = list(parsed)
+    points = [parsed[i].point for i in indices]
+    buildings = graph_utils.get_building_locator(polygons).locate_batch([point.lat for point in points],
+                                                                        [point.lon for point in points])
+    curr_buildings = dict(zip(indices, buildings))
+
+    curr_node_ids = dict()
+    by_floor = dict()
+    for i in indices:
+        by_floor.setdefault(parsed[i].current_floor, []).append(i)
+    for floor, group in by_floor.items():
+        if not graph.contains_floor(floor):
+            for i in group:
+                responses[i] = {"error": f"Unknown floor {floor}"}
+            continue
+        nearest = graph.get_spatial_index(floor).nearest_batch([parsed[i].point.lat for i in group],
+                                                               [parsed[i].point.lon for i in group])
+        for i, closest in zip(group, nearest):
+            if closest:
+                curr_node_ids[i] = closest[0][0]
+            else:
+                responses[i] = {"error": f"No nodes on floor {floor}"}
+
+    by_destination = dict()
+    for i in curr_node_ids:
+        by_destination.setdefault((parsed[i].destination, parsed[i].destination_floor), []).append(i)
+    for (destination, destination_floor), group in by_destination.items():
+        if not graph.contains_building(destination):
+            for i in group:
+                responses[i] = {"error": f"Unknown destination {destination}"}
+            continue
+        if not graph.contains_floor(destination_floor) or not graph.get_nodes_by_building_and_floor_and_type(
+                destination, destination_floor, graph_utils.NodeType.BUILDING):
+            for i in group:
+                responses[i] = {"error": f"Destination {destination} has no floor {destination_floor}"}
+            continue
+
+        hops = graph.find_next_hops([curr_node_ids[i] for i in group], destination, destination_floor)
+        for i, (next_node_id, dest_node_id, route_distance) in zip(group, hops):
+            if dest_node_id is None:
+                responses[i] = {"error": "No route to destination"}
+                continue
+            responses[i] = build_response(graph, parsed[i], curr_node_ids[i], curr_buildings[i], next_node_id,
+                                          dest_node_id, route_distance)
+
+    return {"responses": responses}
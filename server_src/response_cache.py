@@ -0,0 +1,115 @@
+"""
+LRU cache of request_handler responses keyed on a quantized location and the route they were built from.
+
+Routes come from the device's session, so they are resolved before the cache is consulted and are part of the key: two
+devices only share a response when they are on the same (current node, next node, destination node, remaining
+distance) route. Besides that, the response only depends on the device's position through the building it is in, which
+is located before the lookup too (a cell can straddle a building boundary), so polls from the same CELL_SIZE metre
+grid cell with the same floor, destination, building and route get the same response. A hit skips the response
+encoding. Entries built for another graph (by fingerprint) are dropped, so a registry reload or an edge update never
+serves stale routes.
+"""
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional, Tuple
+
+from graph import Location
+from spatial import ellipsoid_radii
+
+CELL_SIZE = 5.0  # metres
+MAX_ENTRIES = 4096
+
+# (current node, next node, destination node, remaining distance) a response is built from
+RouteKey = Tuple[Optional[str], Optional[str], Optional[str], Optional[float]]
+# (lat cell, lon cell, current floor, destination, destination floor, response format, current building, route)
+CacheKey = Tuple[int, int, int, str, int, str, Optional[str], RouteKey]
+
+
+def quantize(point: Location, cell_size: float = CELL_SIZE) -> Tuple[int, int]:
+    """
+    Returns the (lat, lon) index of the roughly cell_size x cell_size metre cell containing point. Cells in the same
+    row of latitude share a width in degrees of longitude.
+    """
+    meridional_radius, _ = ellipsoid_radii(point.lat)
+    lat_cell = math.floor(point.lat / math.degrees(cell_size / meridional_radius))
+
+    row_lat = (lat_cell + 0.5) * math.degrees(cell_size / meridional_radius)
+    _, prime_vertical_radius = ellipsoid_radii(row_lat)
+    lon_cell_size = math.degrees(cell_size / (prime_vertical_radius * math.cos(math.radians(row_lat))))
+    return lat_cell, math.floor(point.lon / lon_cell_size)
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0  # clears caused by a new graph
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, cell_size: float = CELL_SIZE):
+        self.max_entries = max_entries
+        self.cell_size = cell_size
+        self.stats = ResponseCacheStats()
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[CacheKey, str]" = OrderedDict()
+        self._fingerprint: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def make_key(self, point: Location, current_floor: int, destination: str, destination_floor: int,
+                 response_format: str = "json", curr_building: Optional[str] = None,
+                 route: RouteKey = (None, None, None, None)) -> CacheKey:
+        lat_cell, lon_cell = quantize(point, self.cell_size)
+        return lat_cell, lon_cell, current_floor, destination, destination_floor, response_format, curr_building, route
+
+    def get(self, key: CacheKey, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            response = self._entries.get(key)
+            if response is None:
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return response
+
+    def put(self, key: CacheKey, fingerprint: str, response: str):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_fingerprint(self, fingerprint: str):
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.stats.invalidations += 1
+            self._entries.clear()
+            self._fingerprint = fingerprint
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats.hits + self.stats.misses
+            return dict(asdict(self.stats), entries=len(self._entries),
+                        hit_rate=self.stats.hits / lookups if lookups else 0.0)
+
+
+_cache = ResponseCache()
+
+
+def get_response_cache() -> ResponseCache:
+    return _cache
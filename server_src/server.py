@@ -0,0 +1,318 @@
+"""
+Standalone asyncio HTTP server for the navigation endpoint.
+
+Serves the same GET contract and response as request_handler.request_handler, which is written for the per-request
+sandbox, from one long-running process: the graph components are loaded once at startup, routes are computed in a
+thread or process pool so the event loop only does I/O, and connections are kept alive between polls.
+
+    python server.py --port 8080 --workers 4 [--processes] [--sessions-db sessions.sqlite] [--instrument]
+
+POST a form with a 'requests' field, or a JSON array body, to route many devices in one call (see
+request_handler.navigate_batch).
+
+Navigation sessions are kept in memory, per process. With --processes, pass --sessions-db so every worker process
+shares them. GET /metrics returns the server counters and the graph registry, session and response cache stats
+as JSON, and with --instrument the per-stage timers and search counters of the instrumentation module. Those are
+kept per process too, so with --processes they only cover the server process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import instrumentation
+import registry
+import request_handler
+import response_cache
+import sessions
+
+NAVIGATION_PATHS = {"/", "/navigate", "/request_handler.py"}
+METRICS_PATH = "/metrics"
+
+REQUEST_TIMEOUT = 10.0  # seconds to compute a response
+KEEP_ALIVE_TIMEOUT = 30.0  # seconds an idle connection is kept open
+MAX_BODY_SIZE = 1 << 20  # bytes
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    504: "Gateway Timeout",
+}
+
+Handler = Callable[[dict], object]  # same signature as request_handler.request_handler
+
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    values: Dict[str, str]  # query string parameters
+    headers: Dict[str, str]  # lower-cased names
+    body: bytes = b""
+    version: str = "HTTP/1.1"
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def to_sandbox_request(self) -> dict:
+        """
+        The request dict request_handler expects
+        """
+        request = {"method": self.method, "values": self.values, "args": list(self.values)}
+        content_type = self.headers.get("content-type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            request["form"] = dict(parse_qsl(self.body.decode("utf-8"), keep_blank_values=True))
+        elif content_type.startswith("application/json"):
+            # a bare JSON array is the batch form's requests field
+            request["form"] = {"requests": self.body.decode("utf-8")}
+        return request
+
+
+@dataclass
+class ServerMetrics:
+    connections_opened: int = 0
+    connections_active: int = 0
+    requests: int = 0
+    navigation_requests: int = 0
+    requests_in_flight: int = 0
+    responses_by_status: Dict[int, int] = field(default_factory=dict)
+    timeouts: int = 0
+    errors: int = 0
+    total_latency: float = 0.0  # seconds, navigation requests only
+    max_latency: float = 0.0  # seconds, navigation requests only
+
+
+class BadRequest(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+    """
+    Reads one request from the connection. Returns None if the client closed it between requests.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    # split() rather than split(" "), some clients send more than one space before the version
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise BadRequest(400, "Malformed request line")
+    method, target, version = parts
+
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        content_length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest(400, "Invalid Content-Length")
+    if content_length > MAX_BODY_SIZE:
+        raise BadRequest(413, "Request body too large")
+    body = await reader.readexactly(content_length) if content_length else b""
+
+    # the ESP32 client sends the absolute sandbox URL as the request target, .../server_src/request_handler.py
+    url = urlsplit(target)
+    path = url.path or "/"
+    if path.endswith(".py"):
+        path = "/" + path.rsplit("/", 1)[-1]
+    values = dict(parse_qsl(url.query, keep_blank_values=True))
+    return HttpRequest(method=method, path=path, values=values, headers=headers, body=body, version=version)
+
+
+def encode_response(status: int, body: str, keep_alive: bool, content_type: str = "text/plain; charset=utf-8") -> bytes:
+    payload = body.encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n")
+    return head.encode("latin-1") + payload
+
+
+def _initialize_worker(sessions_db: Optional[str] = None):
+    """
+    Loads the graph components and opens the shared session store once per process
+    """
+    registry.get_graph_components()
+    if sessions_db is not None:
+        sessions.set_session_store(sessions.SQLiteSessionStore(sessions_db))
+
+
+class NavigationServer:
+
+    def __init__(self, handler: Handler = request_handler.request_handler, executor: Optional[Executor] = None,
+                 request_timeout: float = REQUEST_TIMEOUT, keep_alive_timeout: float = KEEP_ALIVE_TIMEOUT):
+        """
+        handler is called with the sandbox request dict in executor, which defaults to a thread pool. It must be
+        picklable for a process pool.
+        """
+        self.handler = handler
+        self.executor = ThreadPoolExecutor() if executor is None else executor
+        self.request_timeout = request_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        self.metrics = ServerMetrics()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080) -> Tuple[str, int]:
+        """
+        Starts listening and returns the bound (host, port), port 0 picks a free one
+        """
+        self._server = await asyncio.start_server(self.handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.metrics.connections_opened += 1
+        self.metrics.connections_active += 1
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break  # idle keep-alive connection
+                except BadRequest as e:
+                    self._count(e.status)
+                    writer.write(encode_response(e.status, str(e), keep_alive=False))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+
+                keep_alive = request.keep_alive
+                status, body, content_type = await self.dispatch(request)
+                writer.write(encode_response(status, body, keep_alive, content_type))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.metrics.connections_active -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def dispatch(self, request: HttpRequest) -> Tuple[int, str, str]:
+        """
+        Returns (status, body, content type)
+        """
+        self.metrics.requests += 1
+        if request.path == METRICS_PATH:
+            return self._count(200), json.dumps(self.get_metrics()), "application/json"
+        if request.path not in NAVIGATION_PATHS:
+            return self._count(404), f"Unknown path {request.path}", "text/plain; charset=utf-8"
+
+        return await self._run_handler(request.to_sandbox_request())
+
+    async def _run_handler(self, sandbox_request: dict) -> Tuple[int, str, str]:
+        start = time.perf_counter()
+        self.metrics.navigation_requests += 1
+        self.metrics.requests_in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self.executor, self.handler, sandbox_request),
+                                            self.request_timeout)
+            status, body = 200, str(result)
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            status, body = 504, "Timed out computing the route"
+        except Exception as e:
+            self.metrics.errors += 1
+            status, body = 500, f"{type(e).__name__}: {e}"
+        finally:
+            self.metrics.requests_in_flight -= 1
+
+        latency = time.perf_counter() - start
+        self.metrics.total_latency += latency
+        self.metrics.max_latency = max(self.metrics.max_latency, latency)
+        return self._count(status), body, "text/plain; charset=utf-8"
+
+    def _count(self, status: int) -> int:
+        self.metrics.responses_by_status[status] = self.metrics.responses_by_status.get(status, 0) + 1
+        return status
+
+    def get_metrics(self) -> dict:
+        metrics = asdict(self.metrics)
+        navigation_requests = self.metrics.navigation_requests
+        metrics["avg_latency"] = self.metrics.total_latency / navigation_requests if navigation_requests else 0.0
+        metrics["registry"] = registry.get_registry().get_stats()
+        metrics["sessions"] = sessions.get_session_store().get_stats()
+        metrics["response_cache"] = response_cache.get_response_cache().get_stats()
+        metrics["instrumentation"] = instrumentation.get_snapshot()
+        return metrics
+
+
+def create_executor(workers: Optional[int], processes: bool, sessions_db: Optional[str] = None) -> Executor:
+    """
+    Process pool workers load the graph components once, when they start
+    """
+    if processes:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker, initargs=(sessions_db,))
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+async def main(args: argparse.Namespace):
+    if args.instrument or args.trace_log is not None:
+        # the environment reaches the process pool workers, which import instrumentation on their own
+        os.environ[instrumentation.INSTRUMENTATION_ENV_VAR] = "1"
+        if args.trace_log is not None:
+            os.environ[instrumentation.TRACE_LOG_ENV_VAR] = args.trace_log
+        if args.trace_locations:
+            os.environ[instrumentation.TRACE_LOCATIONS_ENV_VAR] = "1"
+        instrumentation.enable(args.trace_log, trace_locations=args.trace_locations)
+    _initialize_worker(args.sessions_db)
+    server = NavigationServer(executor=create_executor(args.workers, args.processes, args.sessions_db),
+                              request_timeout=args.request_timeout, keep_alive_timeout=args.keep_alive_timeout)
+    host, port = await server.start(args.host, args.port)
+    print(f"Serving navigation on http://{host}:{port}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the navigation endpoint over HTTP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="pool size (default: executor default)")
+    parser.add_argument("--processes", action="store_true", help="compute routes in a process pool")
+    parser.add_argument("--request-timeout", type=float, default=REQUEST_TIMEOUT)
+    parser.add_argument("--keep-alive-timeout", type=float, default=KEEP_ALIVE_TIMEOUT)
+    parser.add_argument("--sessions-db", default=None, help="SQLite file shared by the workers' session stores")
+    parser.add_argument("--instrument", action="store_true", help="record per-stage timers and search counters")
+    parser.add_argument("--trace-log", default=None, help="append one JSON line per request to this file")
+    parser.add_argument("--trace-locations", action="store_true",
+                        help="include the user_id, lat and lon of every request in the trace log")
+    asyncio.run(main(parser.parse_args()))
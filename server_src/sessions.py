@@ -0,0 +1,306 @@
+"""
+Per-device navigation sessions, keyed by user_id.
+
+A session remembers the route a device is walking. On each ping the device is matched against the next few nodes of
+that route only; while it stays within OFF_ROUTE_DISTANCE of the route it just advances along it, and it is rerouted
+from scratch once it deviates, changes destination or its session expires. A session also records the fingerprint of
+the graph its route was computed on and is rerouted once the graph changes (an edge closed by DynamicRouter, a
+reloaded graph, a SQLite session outliving a restart), so stored paths never go over closed edges or missing nodes.
+
+Sessions live in memory with TTL and LRU eviction (MemorySessionStore), or in a local SQLite file when they must be
+shared between worker processes or survive restarts (SQLiteSessionStore).
+"""
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, replace
+from typing import Callable, List, Optional
+
+from graph import Graph, Location, Route
+from spatial import LocalProjection
+
+SESSION_TTL = 15 * 60  # seconds since the last ping
+MAX_SESSIONS = 10000
+
+LOOKAHEAD = 4  # route nodes past the current one a ping is matched against
+OFF_ROUTE_DISTANCE = 20.0  # metres from the route segments before a device is rerouted
+
+Clock = Callable[[], float]
+
+
+@dataclass
+class Session:
+    user_id: str
+    destination: str
+    destination_floor: int
+    path: List[str]
+    remaining: List[float]  # distance from every path node to the destination
+    position: int = 0  # index of the device's current node in path
+    updated_at: float = 0.0
+    fingerprint: str = ""  # of the graph path was computed on
+
+    @classmethod
+    def from_route(cls, graph: Graph, user_id: str, destination: str, destination_floor: int, route: Route,
+                   now: float) -> "Session":
+        remaining = [route.distance]
+        for v1_id, v2_id in zip(route.path, route.path[1:]):
+            remaining.append(remaining[-1] - graph.get_weight(v1_id, v2_id))
+        return cls(user_id=user_id, destination=destination, destination_floor=destination_floor,
+                   path=list(route.path), remaining=remaining, updated_at=now, fingerprint=graph.fingerprint())
+
+    def matches(self, graph: Graph, destination: str, destination_floor: int) -> bool:
+        """
+        Whether the stored route still leads to destination on graph
+        """
+        return self.destination == destination and self.destination_floor == destination_floor and \
+            self.fingerprint == graph.fingerprint()
+
+    @property
+    def current_node(self) -> str:
+        return self.path[self.position]
+
+    @property
+    def next_node(self) -> Optional[str]:
+        return self.path[self.position + 1] if self.position + 1 < len(self.path) else None
+
+    @property
+    def remaining_distance(self) -> float:
+        return self.remaining[self.position]
+
+    def advance(self, graph: Graph, point: Location, floor: int) -> bool:
+        """
+        Moves position to the closest of the next LOOKAHEAD route nodes on floor. Returns False, leaving the session
+        unchanged, if the device is more than OFF_ROUTE_DISTANCE away from the route there.
+        """
+        window = range(self.position, min(self.position + LOOKAHEAD + 1, len(self.path)))
+        nodes = [graph.get_node(self.path[i]) for i in window]
+
+        projection = LocalProjection(point.lat, point.lon)
+        points = [projection.project(node.location.lat, node.location.lon) for node in nodes]
+        on_floor = [node.floor == floor for node in nodes]
+        if not any(on_floor):
+            return False
+
+        # distance from the device (the origin) to the route, segment by segment
+        if len(points) == 1:
+            off_route = math.hypot(*points[0])
+        else:
+            off_route = min(_distance_to_segment(points[i], points[i + 1]) for i in range(len(points) - 1))
+        if off_route > OFF_ROUTE_DISTANCE:
+            return False
+
+        closest = min((math.hypot(*points[i]), i) for i in range(len(nodes)) if on_floor[i])[1]
+        self.position = window[closest]
+        return True
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, values: str) -> "Session":
+        return cls(**json.loads(values))
+
+
+def _distance_to_segment(a, b) -> float:
+    """
+    Distance from the origin to segment ab in the plane
+    """
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length_squared = dx * dx + dy * dy
+    t = 0.0 if length_squared == 0 else max(0.0, min(1.0, -(a[0] * dx + a[1] * dy) / length_squared))
+    return math.hypot(a[0] + t * dx, a[1] + t * dy)
+
+
+@dataclass
+class SessionStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evicted: int = 0
+    advanced: int = 0  # pings served by advancing along the stored route
+    rerouted: int = 0  # pings that computed a new route
+
+
+class MemorySessionStore:
+    """
+    Thread-safe in-memory store. Sessions expire ttl seconds after their last update and the least recently used one
+    is evicted beyond max_sessions. get returns a copy, so a session is only changed through put.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS, clock: Clock = time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.stats = SessionStats()
+
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                self.stats.misses += 1
+                return None
+            if self.clock() - session.updated_at > self.ttl:
+                del self._sessions[user_id]
+                self.stats.expired += 1
+                self.stats.misses += 1
+                return None
+
+            self._sessions.move_to_end(user_id)
+            self.stats.hits += 1
+            # path and remaining are never changed in place, only position and updated_at are
+            return replace(session)
+
+    def put(self, session: Session):
+        with self._lock:
+            session.updated_at = self.clock()
+            self._sessions[session.user_id] = session
+            self._sessions.move_to_end(session.user_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.stats.evicted += 1
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def record_ping(self, advanced: bool):
+        with self._lock:
+            if advanced:
+                self.stats.advanced += 1
+            else:
+                self.stats.rerouted += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(asdict(self.stats), sessions=len(self._sessions))
+
+
+class SQLiteSessionStore:
+    """
+    Store backed by a local SQLite file, so sessions are shared between processes and survive restarts. Expired and
+    least recently updated sessions beyond max_sessions are purged every PURGE_INTERVAL puts.
+    """
+    PURGE_INTERVAL = 100
+
+    def __init__(self, database_file_path: str, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS,
+                 clock: Clock = time.time):
+        self.database_file_path = database_file_path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.stats = SessionStats()
+
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._connection = sqlite3.connect(database_file_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS sessions "
+                                 "(user_id TEXT PRIMARY KEY, updated_at REAL NOT NULL, session TEXT NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def get(self, user_id: str) -> Optional[Session]:
+        with self._lock:
+            row = self._connection.execute("SELECT updated_at, session FROM sessions WHERE user_id = ?",
+                                           (user_id,)).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            if self.clock() - row[0] > self.ttl:
+                self._connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+                self.stats.expired += 1
+                self.stats.misses += 1
+                return None
+
+            self.stats.hits += 1
+            return Session.from_json(row[1])
+
+    def put(self, session: Session):
+        with self._lock:
+            session.updated_at = self.clock()
+            self._connection.execute("INSERT OR REPLACE INTO sessions (user_id, updated_at, session) VALUES (?, ?, ?)",
+                                     (session.user_id, session.updated_at, session.to_json()))
+            self._puts += 1
+            if self._puts % self.PURGE_INTERVAL == 0:
+                self._purge()
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def record_ping(self, advanced: bool):
+        with self._lock:
+            if advanced:
+                self.stats.advanced += 1
+            else:
+                self.stats.rerouted += 1
+
+    def _purge(self):
+        self.stats.expired += self._connection.execute("DELETE FROM sessions WHERE updated_at < ?",
+                                                       (self.clock() - self.ttl,)).rowcount
+        self.stats.evicted += self._connection.execute(
+            "DELETE FROM sessions WHERE user_id IN "
+            "(SELECT user_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)).rowcount
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            sessions = self._connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return dict(asdict(self.stats), sessions=sessions)
+
+
+_store = MemorySessionStore()
+
+
+def get_session_store():
+    return _store
+
+
+def set_session_store(store):
+    """
+    Replaces the process-wide store, e.g. with a SQLiteSessionStore shared by several worker processes
+    """
+    global _store
+    _store = store
+
+
+def navigate(graph: Graph, user_id: str, point: Location, current_floor: int, destination: str,
+             destination_floor: int, store=None) -> Optional[Session]:
+    """
+    Returns the device's session after this ping: advanced along its stored route when it is still on it, otherwise
+    rerouted from its closest node. Returns None if the destination is unreachable.
+    """
+    store = get_session_store() if store is None else store
+
+    session = store.get(user_id)
+    if session is not None and session.matches(graph, destination, destination_floor) and \
+            session.advance(graph, point, current_floor):
+        store.record_ping(advanced=True)
+        store.put(session)
+        return session
+
+    store.record_ping(advanced=False)
+    curr_node = graph.get_closest_node(point, floor=current_floor)
+    route = graph.find_shortest_path(curr_node, destination, destination_floor)
+    if route.path is None:
+        store.delete(user_id)
+        return None
+
+    session = Session.from_route(graph, user_id, destination, destination_floor, route, store.clock())
+    store.put(session)
+    return session
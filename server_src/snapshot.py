@@ -0,0 +1,469 @@
+"""
+Binary, memory-mappable snapshot format for a Graph and its APSP cache.
+
+Layout (little-endian, every section aligned to 8 bytes):
+
+    header          magic, version, number of sections, number of nodes, number of routes, graph fingerprint
+    section table   (offset, length) in bytes for every section below
+    node table      node ids (sorted, so a node's index is its rank), lat, lon, floor, building, node type
+    strings         building names referenced by the node and route tables
+    CSR adjacency   per node offsets into contiguous target / weight arrays
+    route table     routes sorted by (source, building, floor), with all paths concatenated in one array
+    next hop table  (building, floor) groups and the per (node, group) next node, destination and distance
+
+Nothing is deserialized when a snapshot is opened; node lookups and route lookups are binary searches over the
+mapped arrays, and the next hop table is served straight from the mapped arrays. The JSON format written by
+Graph.save_to_json / Graph.save_apsp_to_json stays available for export.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import graph as graph_utils
+from graph import Graph, Location, NextHopTable, Node, NodeType, Route
+
+MAGIC = b"MITNAVSN"
+VERSION = 3
+
+HEADER = struct.Struct("<8sHHII32s")  # magic, version, num_sections, num_nodes, num_routes, sha256 fingerprint
+SECTION = struct.Struct("<QQ")  # offset, length
+ALIGNMENT = 8
+
+FLOOR_NONE = -2 ** 31  # sentinel for nodes without a floor
+INDEX_NONE = -1  # sentinel for missing building / destination
+
+# section ids
+ID_BLOB = 0
+ID_OFFSETS = 1
+NODE_LAT = 2
+NODE_LON = 3
+NODE_FLOOR = 4
+NODE_BUILDING = 5
+NODE_TYPE = 6
+STRING_BLOB = 7
+STRING_OFFSETS = 8
+ADJ_OFFSETS = 9
+ADJ_TARGETS = 10
+ADJ_WEIGHTS = 11
+ROUTE_SRC = 12
+ROUTE_BUILDING = 13
+ROUTE_FLOOR = 14
+ROUTE_DEST = 15
+ROUTE_DISTANCE = 16
+ROUTE_PATH_OFFSETS = 17
+ROUTE_PATHS = 18
+NEXT_HOP_GROUP_BUILDING = 19
+NEXT_HOP_GROUP_FLOOR = 20
+NEXT_HOP_NODE = 21
+NEXT_HOP_DESTINATION = 22
+NEXT_HOP_DISTANCE = 23
+NUM_SECTIONS = 24
+
+SECTION_FORMATS = {
+    ID_BLOB: "B",
+    ID_OFFSETS: "I",
+    NODE_LAT: "d",
+    NODE_LON: "d",
+    NODE_FLOOR: "i",
+    NODE_BUILDING: "i",
+    NODE_TYPE: "B",
+    STRING_BLOB: "B",
+    STRING_OFFSETS: "I",
+    ADJ_OFFSETS: "I",
+    ADJ_TARGETS: "I",
+    ADJ_WEIGHTS: "d",
+    ROUTE_SRC: "I",
+    ROUTE_BUILDING: "i",
+    ROUTE_FLOOR: "i",
+    ROUTE_DEST: "i",
+    ROUTE_DISTANCE: "d",
+    ROUTE_PATH_OFFSETS: "I",
+    ROUTE_PATHS: "I",
+    NEXT_HOP_GROUP_BUILDING: "i",
+    NEXT_HOP_GROUP_FLOOR: "i",
+    NEXT_HOP_NODE: "i",
+    NEXT_HOP_DESTINATION: "i",
+    NEXT_HOP_DISTANCE: "d",
+}
+
+GRAPH_SNAPSHOT_FILE_PATH = graph_utils.GRAPH_SNAPSHOT_FILE_PATH
+
+
+def _encode_strings(strings: List[str]) -> Tuple[array, array]:
+    blob = array("B")
+    offsets = array("I", [0])
+    for string in strings:
+        blob.frombytes(string.encode("utf-8"))
+        offsets.append(len(blob))
+    return blob, offsets
+
+
+def _encode_floor(floor: Optional[int]) -> int:
+    return FLOOR_NONE if floor is None else floor
+
+
+def _decode_floor(floor: int) -> Optional[int]:
+    return None if floor == FLOOR_NONE else floor
+
+
+def save_snapshot(graph: Graph, file_path: str, apsp: Optional[Dict[Tuple[str, str, int], Route]] = None,
+                  next_hop_table: Optional[NextHopTable] = None):
+    """
+    Writes graph and its routes to a binary snapshot. Routes and the next hop table default to the graph's current
+    apsp_cache and next_hop_table.
+    """
+    apsp = graph.apsp_cache if apsp is None else apsp
+    next_hop_table = graph.next_hop_table if next_hop_table is None else next_hop_table
+
+    node_ids = sorted(graph.get_node_ids())
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+    building_names = sorted(name for name in graph.get_building_names() if name is not None)
+    building_index = {name: i for i, name in enumerate(building_names)}
+    building_index[None] = INDEX_NONE
+
+    sections: Dict[int, array] = dict()
+    sections[ID_BLOB], sections[ID_OFFSETS] = _encode_strings(node_ids)
+    sections[STRING_BLOB], sections[STRING_OFFSETS] = _encode_strings(building_names)
+
+    lat, lon, floor, building, node_type = array("d"), array("d"), array("i"), array("i"), array("B")
+    adj_offsets, adj_targets, adj_weights = array("I", [0]), array("I"), array("d")
+    for node_id in node_ids:
+        node = graph.get_node(node_id)
+        lat.append(node.location.lat)
+        lon.append(node.location.lon)
+        floor.append(_encode_floor(node.floor))
+        building.append(building_index[node.building])
+        node_type.append(ord(NodeType(node.node_type).value))
+
+        for neighbor_id, weight in graph.adj[node_id].items():
+            adj_targets.append(node_index[neighbor_id])
+            adj_weights.append(weight)
+        adj_offsets.append(len(adj_targets))
+
+    sections[NODE_LAT], sections[NODE_LON], sections[NODE_FLOOR] = lat, lon, floor
+    sections[NODE_BUILDING], sections[NODE_TYPE] = building, node_type
+    sections[ADJ_OFFSETS], sections[ADJ_TARGETS], sections[ADJ_WEIGHTS] = adj_offsets, adj_targets, adj_weights
+
+    route_src, route_building, route_floor = array("I"), array("i"), array("i")
+    route_dest, route_distance = array("i"), array("d")
+    path_offsets, paths = array("I", [0]), array("I")
+
+    def route_sort_key(key):
+        src, building_name, route_floor_value = key
+        return node_index[src], building_index[building_name], _encode_floor(route_floor_value)
+
+    for key in sorted(apsp, key=route_sort_key):
+        route = apsp[key]
+        src, building_name, route_floor_value = route_sort_key(key)
+        route_src.append(src)
+        route_building.append(building_name)
+        route_floor.append(route_floor_value)
+        route_dest.append(INDEX_NONE if route.destination is None else node_index[route.destination])
+        route_distance.append(route.distance)
+        if route.path is not None:
+            paths.extend(node_index[node_id] for node_id in route.path)
+        path_offsets.append(len(paths))
+
+    sections[ROUTE_SRC], sections[ROUTE_BUILDING], sections[ROUTE_FLOOR] = route_src, route_building, route_floor
+    sections[ROUTE_DEST], sections[ROUTE_DISTANCE] = route_dest, route_distance
+    sections[ROUTE_PATH_OFFSETS], sections[ROUTE_PATHS] = path_offsets, paths
+
+    group_building, group_floor = array("i"), array("i")
+    next_node, next_hop_destination, next_hop_distance = array("i"), array("i"), array("d")
+    if next_hop_table is not None:
+        for building_name, group_floor_value in next_hop_table.groups:
+            group_building.append(building_index[building_name])
+            group_floor.append(_encode_floor(group_floor_value))
+
+        # rows are re-ordered to the snapshot's node order
+        num_groups = len(next_hop_table.groups)
+        remap = [NextHopTable.NONE] * len(next_hop_table.node_ids)
+        for node_id in next_hop_table.node_ids:
+            remap[next_hop_table.node_index[node_id]] = node_index[node_id]
+        for node_id in node_ids:
+            row = next_hop_table.node_index[node_id] * num_groups
+            for position in range(row, row + num_groups):
+                next_index = next_hop_table.next_node[position]
+                destination_index = next_hop_table.destination[position]
+                next_node.append(NextHopTable.NONE if next_index == NextHopTable.NONE else remap[next_index])
+                next_hop_destination.append(NextHopTable.NONE if destination_index == NextHopTable.NONE
+                                            else remap[destination_index])
+                next_hop_distance.append(next_hop_table.distance[position])
+
+    sections[NEXT_HOP_GROUP_BUILDING], sections[NEXT_HOP_GROUP_FLOOR] = group_building, group_floor
+    sections[NEXT_HOP_NODE], sections[NEXT_HOP_DESTINATION] = next_node, next_hop_destination
+    sections[NEXT_HOP_DISTANCE] = next_hop_distance
+
+    _write_sections(file_path, sections, num_nodes=len(node_ids), num_routes=len(route_src),
+                    fingerprint=graph.fingerprint())
+
+
+def _write_sections(file_path: str, sections: Dict[int, array], num_nodes: int, num_routes: int, fingerprint: str):
+    payloads = []
+    offset = HEADER.size + NUM_SECTIONS * SECTION.size
+    table = []
+    for section_id in range(NUM_SECTIONS):
+        values = sections[section_id]
+        assert values.typecode == SECTION_FORMATS[section_id]
+
+        if sys.byteorder != "little":
+            values = array(values.typecode, values)
+            values.byteswap()
+        payload = values.tobytes()
+
+        padding = -offset % ALIGNMENT
+        payloads.append(b"\0" * padding + payload)
+        offset += padding
+        table.append((offset, len(payload)))
+        offset += len(payload)
+
+    with open(file_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, NUM_SECTIONS, num_nodes, num_routes, bytes.fromhex(fingerprint)))
+        for section_offset, section_length in table:
+            f.write(SECTION.pack(section_offset, section_length))
+        for payload in payloads:
+            f.write(payload)
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped view of a snapshot written by save_snapshot
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_sections, self.num_nodes, self.num_routes, fingerprint = HEADER.unpack_from(self._mmap, 0)
+        self.fingerprint = fingerprint.hex()
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a graph snapshot")
+        if version != VERSION or num_sections != NUM_SECTIONS:
+            raise ValueError(f"Unsupported snapshot version {version} in {file_path}")
+
+        self._buffer = memoryview(self._mmap)
+        self._sections = []
+        for section_id in range(NUM_SECTIONS):
+            offset, length = SECTION.unpack_from(self._mmap, HEADER.size + section_id * SECTION.size)
+            view = self._buffer[offset: offset + length]
+            if sys.byteorder != "little":
+                values = array(SECTION_FORMATS[section_id], view.tobytes())
+                values.byteswap()
+                view = memoryview(values)
+            self._sections.append(view.cast(SECTION_FORMATS[section_id]))
+
+        self._building_names = self._decode_strings(STRING_BLOB, STRING_OFFSETS)
+        self._building_index = {name: i for i, name in enumerate(self._building_names)}
+        self.routes = RouteTable(self)
+
+    def _decode_strings(self, blob_section: int, offsets_section: int) -> List[str]:
+        blob = self._sections[blob_section]
+        offsets = self._sections[offsets_section]
+        return [bytes(blob[offsets[i]: offsets[i + 1]]).decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def close(self):
+        self.routes = None
+        for view in self._sections:
+            view.release()
+        self._sections = []
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def num_edges(self) -> int:
+        return len(self._sections[ADJ_TARGETS])
+
+    def node_id(self, index: int) -> str:
+        blob = self._sections[ID_BLOB]
+        offsets = self._sections[ID_OFFSETS]
+        return bytes(blob[offsets[index]: offsets[index + 1]]).decode("utf-8")
+
+    def node_index(self, node_id: str) -> Optional[int]:
+        """
+        Binary search over the sorted node ids. Returns None if the node is not in the snapshot.
+        """
+        target = node_id.encode("utf-8")
+        blob = self._sections[ID_BLOB]
+        offsets = self._sections[ID_OFFSETS]
+
+        lo, hi = 0, self.num_nodes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = bytes(blob[offsets[mid]: offsets[mid + 1]])
+            if current < target:
+                lo = mid + 1
+            elif current > target:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def building_name(self, index: int) -> Optional[str]:
+        return None if index == INDEX_NONE else self._building_names[index]
+
+    def building_index(self, building_name: Optional[str]) -> Optional[int]:
+        if building_name is None:
+            return INDEX_NONE
+        return self._building_index.get(building_name)
+
+    def get_node(self, node_id: str) -> Node:
+        index = self.node_index(node_id)
+        if index is None:
+            raise KeyError(node_id)
+        return self._node_at(index, node_id)
+
+    def _node_at(self, index: int, node_id: str) -> Node:
+        location = Location(lat=self._sections[NODE_LAT][index], lon=self._sections[NODE_LON][index])
+        return Node(id=node_id, location=location,
+                    building=self.building_name(self._sections[NODE_BUILDING][index]),
+                    floor=_decode_floor(self._sections[NODE_FLOOR][index]),
+                    node_type=NodeType(chr(self._sections[NODE_TYPE][index])))
+
+    def get_adj(self, node_id: str) -> Dict[str, float]:
+        index = self.node_index(node_id)
+        if index is None:
+            raise KeyError(node_id)
+        return self._adj_at(index)
+
+    def _adj_at(self, index: int) -> Dict[str, float]:
+        offsets = self._sections[ADJ_OFFSETS]
+        targets = self._sections[ADJ_TARGETS]
+        weights = self._sections[ADJ_WEIGHTS]
+        return {self.node_id(targets[i]): weights[i] for i in range(offsets[index], offsets[index + 1])}
+
+    def _route_position(self, key: Tuple[str, str, int]) -> Optional[int]:
+        src, building_name, floor = key
+        src_index = self.node_index(src)
+        building_index = self.building_index(building_name)
+        if src_index is None or building_index is None:
+            return None
+        target = (src_index, building_index, _encode_floor(floor))
+
+        route_src = self._sections[ROUTE_SRC]
+        route_building = self._sections[ROUTE_BUILDING]
+        route_floor = self._sections[ROUTE_FLOOR]
+
+        lo, hi = 0, self.num_routes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = (route_src[mid], route_building[mid], route_floor[mid])
+            if current < target:
+                lo = mid + 1
+            elif current > target:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _route_at(self, position: int) -> Route:
+        src = self.node_id(self._sections[ROUTE_SRC][position])
+        dest_index = self._sections[ROUTE_DEST][position]
+        distance = self._sections[ROUTE_DISTANCE][position]
+        if dest_index == INDEX_NONE:
+            return Route(source=src, destination=None, path=None, distance=distance)
+
+        path_offsets = self._sections[ROUTE_PATH_OFFSETS]
+        paths = self._sections[ROUTE_PATHS]
+        path = [self.node_id(paths[i]) for i in range(path_offsets[position], path_offsets[position + 1])]
+        return Route(source=src, destination=self.node_id(dest_index), path=path, distance=distance)
+
+    def _route_key_at(self, position: int) -> Tuple[str, str, int]:
+        return (self.node_id(self._sections[ROUTE_SRC][position]),
+                self.building_name(self._sections[ROUTE_BUILDING][position]),
+                _decode_floor(self._sections[ROUTE_FLOOR][position]))
+
+    def find_route(self, src: str, building_name: str, floor: int) -> Optional[Route]:
+        position = self._route_position((src, building_name, floor))
+        return None if position is None else self._route_at(position)
+
+    @property
+    def num_groups(self) -> int:
+        return len(self._sections[NEXT_HOP_GROUP_BUILDING])
+
+    def get_next_hop_table(self, node_ids: Optional[List[str]] = None) -> Optional[NextHopTable]:
+        """
+        Returns a next hop table backed by the mapped arrays, or None if the snapshot was written without one
+        """
+        if self.num_groups == 0:
+            return None
+
+        node_ids = [self.node_id(i) for i in range(self.num_nodes)] if node_ids is None else node_ids
+        groups = [(self.building_name(self._sections[NEXT_HOP_GROUP_BUILDING][i]),
+                   _decode_floor(self._sections[NEXT_HOP_GROUP_FLOOR][i])) for i in range(self.num_groups)]
+        return NextHopTable(node_ids, groups, next_node=self._sections[NEXT_HOP_NODE],
+                            destination=self._sections[NEXT_HOP_DESTINATION],
+                            distance=self._sections[NEXT_HOP_DISTANCE])
+
+    def to_graph(self, lazy_routes: bool = True) -> Graph:
+        """
+        Materializes the node table and adjacency into a Graph. With lazy_routes, the graph's apsp_cache is backed by
+        the mapped route table, so routes are only decoded when they are looked up.
+        """
+        graph = Graph()
+        node_ids = [self.node_id(i) for i in range(self.num_nodes)]
+        for index, node_id in enumerate(node_ids):
+            graph.add_node(self._node_at(index, node_id))
+
+        offsets = self._sections[ADJ_OFFSETS]
+        targets = self._sections[ADJ_TARGETS]
+        weights = self._sections[ADJ_WEIGHTS]
+        for index, node_id in enumerate(node_ids):
+            graph.adj[node_id] = {node_ids[targets[i]]: weights[i] for i in range(offsets[index], offsets[index + 1])}
+
+        graph.apsp_cache = self.routes if lazy_routes else dict(self.routes.items())
+        graph.next_hop_table = self.get_next_hop_table(node_ids)
+        graph._fingerprint = self.fingerprint
+        return graph
+
+
+class RouteTable(Mapping):
+    """
+    Read-only (src, building, floor) -> Route mapping over a snapshot's route table. Can be used as Graph.apsp_cache.
+    """
+
+    def __init__(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def __getitem__(self, key: Tuple[str, str, int]) -> Route:
+        position = self._snapshot._route_position(key)
+        if position is None:
+            raise KeyError(key)
+        return self._snapshot._route_at(position)
+
+    def __contains__(self, key) -> bool:
+        return self._snapshot._route_position(key) is not None
+
+    def __iter__(self) -> Iterator[Tuple[str, str, int]]:
+        for position in range(self._snapshot.num_routes):
+            yield self._snapshot._route_key_at(position)
+
+    def __len__(self) -> int:
+        return self._snapshot.num_routes
+
+
+def load_snapshot(file_path: str, lazy_routes: bool = True) -> Graph:
+    """
+    Loads a Graph from a snapshot. The snapshot stays mapped for as long as the graph's apsp_cache references it.
+    """
+    return Snapshot(file_path).to_graph(lazy_routes=lazy_routes)
+
+
+if __name__ == "__main__":
+    # Converts the JSON graph into a snapshot serving routes from a next hop table
+    graph = Graph()
+    graph.load_from_json(graph_utils.GRAPH_JSON_FILE_PATH)
+    graph.next_hop_table = graph.build_next_hop_table()
+    save_snapshot(graph, GRAPH_SNAPSHOT_FILE_PATH, apsp={})
+    print(f"Wrote {len(graph.get_node_ids())} nodes and {len(graph.next_hop_table.groups)} destination groups to "
+          f"{GRAPH_SNAPSHOT_FILE_PATH}")
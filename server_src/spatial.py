@@ -0,0 +1,190 @@
+"""
+Static 2-d tree for nearest node lookups.
+
+Points are projected onto a local tangent plane (metres) around the centroid of the indexed points, using the WGS84
+meridional and prime vertical radii of curvature at that latitude. At campus scale the planar distance is within a
+fraction of a percent of the geodesic one, so the tree is used to find the candidates and, when an exact distance
+function is given, the candidates within a safety margin of the k-th best are re-ranked with it.
+"""
+import heapq
+import math
+from array import array
+from typing import Callable, List, Optional, Sequence, Tuple
+
+WGS84_A = 6378137.0  # semi-major axis in metres
+WGS84_E2 = 6.69437999014e-3  # first eccentricity squared
+
+# candidates within (1 + RELATIVE_MARGIN) * d_k + ABSOLUTE_MARGIN of the k-th planar distance d_k are re-checked
+RELATIVE_MARGIN = 0.01
+ABSOLUTE_MARGIN = 1.0  # metres
+
+Point = Tuple[float, float]  # (lat, lon)
+ExactDistance = Callable[[Point, Point], float]
+
+
+def ellipsoid_radii(lat: float) -> Tuple[float, float]:
+    """
+    Returns the WGS84 (meridional, prime vertical) radii of curvature in metres at latitude lat (degrees)
+    """
+    sin_lat = math.sin(math.radians(lat))
+    w = math.sqrt(1 - WGS84_E2 * sin_lat * sin_lat)
+    return WGS84_A * (1 - WGS84_E2) / (w * w * w), WGS84_A / w
+
+
+class LocalProjection:
+    """
+    Equirectangular projection around (lat_0, lon_0) with the local ellipsoid radii, x east and y north in metres
+    """
+
+    def __init__(self, lat_0: float, lon_0: float):
+        self.lat_0 = lat_0
+        self.lon_0 = lon_0
+
+        meridional_radius, prime_vertical_radius = ellipsoid_radii(lat_0)
+        self.metres_per_degree_lat = math.radians(1) * meridional_radius
+        self.metres_per_degree_lon = math.radians(1) * prime_vertical_radius * math.cos(math.radians(lat_0))
+
+    def project(self, lat: float, lon: float) -> Tuple[float, float]:
+        return (lon - self.lon_0) * self.metres_per_degree_lon, (lat - self.lat_0) * self.metres_per_degree_lat
+
+
+class SpatialIndex:
+
+    def __init__(self, ids: Sequence[str], lats: Sequence[float], lons: Sequence[float],
+                 exact_distance: Optional[ExactDistance] = None):
+        """
+        Builds the tree over the given points. exact_distance((lat, lon), (lat, lon)) is used to re-rank candidates.
+        """
+        assert len(ids) == len(lats) == len(lons)
+
+        self.exact_distance = exact_distance
+        num_points = len(ids)
+        self.projection = LocalProjection(sum(lats) / num_points if num_points else 0.0,
+                                          sum(lons) / num_points if num_points else 0.0)
+
+        projected = [self.projection.project(lat, lon) for lat, lon in zip(lats, lons)]
+        order = list(range(num_points))
+        self._axes = array('b', [0]) * num_points
+        self._build(order, projected, 0, num_points)
+
+        # points are stored in tree order
+        self.ids = [ids[i] for i in order]
+        self.lats = array('d', [lats[i] for i in order])
+        self.lons = array('d', [lons[i] for i in order])
+        self._x = array('d', [projected[i][0] for i in order])
+        self._y = array('d', [projected[i][1] for i in order])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _build(self, order: List[int], projected: List[Tuple[float, float]], lo: int, hi: int):
+        """
+        Sorts order[lo:hi] into an implicit tree: the median is the node, splitting along the axis with the larger
+        spread, and both halves are built recursively
+        """
+        if hi - lo <= 1:
+            return
+
+        xs = [projected[i][0] for i in order[lo:hi]]
+        ys = [projected[i][1] for i in order[lo:hi]]
+        axis = 0 if max(xs) - min(xs) >= max(ys) - min(ys) else 1
+
+        order[lo:hi] = sorted(order[lo:hi], key=lambda i: projected[i][axis])
+        mid = (lo + hi) // 2
+        self._axes[mid] = axis
+
+        self._build(order, projected, lo, mid)
+        self._build(order, projected, mid + 1, hi)
+
+    def _planar_nearest(self, x: float, y: float, k: int) -> List[Tuple[float, int]]:
+        """
+        Returns the k (squared planar distance, position) pairs closest to (x, y), closest first
+        """
+        xs, ys, axes = self._x, self._y, self._axes
+        best = []  # max-heap of (-squared distance, -position)
+
+        def visit(lo: int, hi: int):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            dx = x - xs[mid]
+            dy = y - ys[mid]
+            d2 = dx * dx + dy * dy
+            if len(best) < k:
+                heapq.heappush(best, (-d2, -mid))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, -mid))
+
+            diff = dx if axes[mid] == 0 else dy
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            visit(*near)
+            if len(best) < k or diff * diff < -best[0][0]:
+                visit(*far)
+
+        visit(0, len(self.ids))
+        return sorted((-d2, -position) for d2, position in best)
+
+    def _planar_within(self, x: float, y: float, radius: float) -> List[Tuple[float, int]]:
+        xs, ys, axes = self._x, self._y, self._axes
+        r2 = radius * radius
+        found = []
+
+        def visit(lo: int, hi: int):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            dx = x - xs[mid]
+            dy = y - ys[mid]
+            d2 = dx * dx + dy * dy
+            if d2 <= r2:
+                found.append((d2, mid))
+
+            diff = dx if axes[mid] == 0 else dy
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            visit(*near)
+            if diff * diff <= r2:
+                visit(*far)
+
+        visit(0, len(self.ids))
+        return sorted(found)
+
+    def _exact(self, lat: float, lon: float, position: int) -> float:
+        return self.exact_distance((lat, lon), (self.lats[position], self.lons[position]))
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[str, float]]:
+        """
+        Returns the k closest (id, distance) pairs, closest first. Distances are exact if the index has an exact
+        distance function, planar otherwise.
+        """
+        x, y = self.projection.project(lat, lon)
+        candidates = self._planar_nearest(x, y, k)
+        if not candidates:
+            return []
+        if self.exact_distance is None:
+            return [(self.ids[position], math.sqrt(d2)) for d2, position in candidates]
+
+        radius = math.sqrt(candidates[-1][0]) * (1 + RELATIVE_MARGIN) + ABSOLUTE_MARGIN
+        rechecked = sorted((self._exact(lat, lon, position), position)
+                           for _, position in self._planar_within(x, y, radius))
+        return [(self.ids[position], distance) for distance, position in rechecked[:k]]
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Tuple[str, float]]:
+        """
+        Returns every (id, distance) pair within radius metres, closest first
+        """
+        x, y = self.projection.project(lat, lon)
+        if self.exact_distance is None:
+            return [(self.ids[position], math.sqrt(d2)) for d2, position in self._planar_within(x, y, radius)]
+
+        candidates = self._planar_within(x, y, radius * (1 + RELATIVE_MARGIN) + ABSOLUTE_MARGIN)
+        rechecked = sorted((self._exact(lat, lon, position), position) for _, position in candidates)
+        return [(self.ids[position], distance) for distance, position in rechecked if distance <= radius]
+
+    def nearest_batch(self, lats: Sequence[float], lons: Sequence[float], k: int = 1) -> List[List[Tuple[str, float]]]:
+        assert len(lats) == len(lons)
+        return [self.nearest(lat, lon, k) for lat, lon in zip(lats, lons)]
+
+    def within_batch(self, lats: Sequence[float], lons: Sequence[float],
+                     radius: float) -> List[List[Tuple[str, float]]]:
+        assert len(lats) == len(lons)
+        return [self.within(lat, lon, radius) for lat, lon in zip(lats, lons)]
@@ -0,0 +1,238 @@
+"""
+Seeded generator of synthetic campuses, for testing routing and precompute at scale.
+
+    python synthetic.py data/synthetic --buildings 400 --floors 5 --nodes-per-floor 500 --seed 1
+
+The CSVs use the WKT formats of the campus data (polygons.csv, nodes_<floor>.csv, edges_<floor>.csv,
+nodes_stairs.csv and nodes_elevators.csv), so they go through parse_polygons, parse_nodes, parse_edges and
+create_graph unchanged. Buildings are rectangles laid out on a grid around MIT, each floor of a building is a grid of
+nodes node_spacing metres apart. Every row of that grid is a corridor, the first column connects the rows and every
+other vertical link exists with probability corridor_density. Neighbouring buildings are joined by a bridge on every
+floor, and stairs and elevators are placed on random nodes of each building.
+
+The number of nodes is buildings * floors * nodes_per_floor plus the stairs and elevators on every floor.
+Rows are written as they are generated, so a million node campus never lives in memory as a whole.
+"""
+import argparse
+import csv
+import itertools
+import math
+import os
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import graph as graph_utils
+from graph import Graph, NodeType, Polygon
+from spatial import LocalProjection
+
+ORIGIN = (42.3590, -71.0920)  # (lat, lon) of the south west corner of the campus
+COORDINATE_DECIMALS = 7  # as in the exported campus data, about 1 cm
+
+
+@dataclass
+class CampusSpec:
+    num_buildings: int = 10
+    num_floors: int = 2
+    nodes_per_floor: int = 25
+    corridor_density: float = 0.5  # probability of each optional vertical link inside a floor
+    stairs_per_building: int = 2
+    elevators_per_building: int = 1
+    node_spacing: float = 5.0  # metres
+    building_gap: float = 20.0  # metres between neighbouring buildings
+    seed: int = 0
+
+    def __post_init__(self):
+        if self.num_buildings < 1 or self.num_floors < 1 or self.nodes_per_floor < 1:
+            raise ValueError("A campus needs at least one building, floor and node per floor")
+        if not 0 <= self.corridor_density <= 1:
+            raise ValueError(f"corridor_density must be in [0, 1], got {self.corridor_density}")
+        if self.stairs_per_building + self.elevators_per_building < 1 and self.num_floors > 1:
+            raise ValueError("Floors can only be connected with stairs or elevators")
+
+    @property
+    def num_nodes(self) -> int:
+        num_vertical = self.num_buildings * (min(self.stairs_per_building, self.nodes_per_floor) +
+                                             min(self.elevators_per_building, self.nodes_per_floor))
+        return self.num_buildings * self.num_floors * self.nodes_per_floor + num_vertical * self.num_floors
+
+
+@dataclass
+class CampusFiles:
+    polygons: str
+    nodes: List[str]  # one per floor
+    edges: List[str]  # one per floor
+    stairs: str
+    elevators: str
+
+    @classmethod
+    def in_directory(cls, directory: str, num_floors: int) -> "CampusFiles":
+        return cls(polygons=os.path.join(directory, "polygons.csv"),
+                   nodes=[os.path.join(directory, f"nodes_{floor}.csv") for floor in range(num_floors)],
+                   edges=[os.path.join(directory, f"edges_{floor}.csv") for floor in range(num_floors)],
+                   stairs=os.path.join(directory, "nodes_stairs.csv"),
+                   elevators=os.path.join(directory, "nodes_elevators.csv"))
+
+
+class _Layout:
+    """
+    Positions of the buildings and of the nodes inside them, in metres east and north of ORIGIN
+    """
+
+    def __init__(self, spec: CampusSpec):
+        self.spec = spec
+        self.width = math.ceil(math.sqrt(spec.nodes_per_floor))  # nodes per corridor
+        self.depth = math.ceil(spec.nodes_per_floor / self.width)  # corridors per floor
+        self.columns = math.ceil(math.sqrt(spec.num_buildings))  # buildings per row of the campus
+
+        self.building_width = self.width * spec.node_spacing
+        self.building_depth = self.depth * spec.node_spacing
+        self.projection = LocalProjection(*ORIGIN)
+
+    def building_origin(self, building: int) -> Tuple[float, float]:
+        row, column = divmod(building, self.columns)
+        return (column * (self.building_width + self.spec.building_gap),
+                row * (self.building_depth + self.spec.building_gap))
+
+    def node_position(self, building: int, index: int) -> Tuple[float, float]:
+        x, y = self.building_origin(building)
+        row, column = divmod(index, self.width)
+        return x + (column + 0.5) * self.spec.node_spacing, y + (row + 0.5) * self.spec.node_spacing
+
+    def wkt_point(self, x: float, y: float) -> str:
+        lat = ORIGIN[0] + y / self.projection.metres_per_degree_lat
+        lon = ORIGIN[1] + x / self.projection.metres_per_degree_lon
+        return f"{lon:.{COORDINATE_DECIMALS}f} {lat:.{COORDINATE_DECIMALS}f}"
+
+    def neighbour(self, building: int, dx: int, dy: int):
+        row, column = divmod(building, self.columns)
+        neighbour = (row + dy) * self.columns + column + dx
+        if column + dx >= self.columns or neighbour >= self.spec.num_buildings:
+            return None
+        return neighbour
+
+
+def building_name(building: int) -> str:
+    """
+    Buildings are numbered from 1, request_handler only accepts numeric destinations
+    """
+    return str(building + 1)
+
+
+def _floor_edges(layout: _Layout, rng: random.Random) -> List[Tuple[int, int]]:
+    """
+    (node index, node index) links inside one floor of a building: the corridors, the first column joining them and
+    the optional vertical links
+    """
+    n = layout.spec.nodes_per_floor
+    edges = []
+    for index in range(n):
+        row, column = divmod(index, layout.width)
+        if column + 1 < layout.width and index + 1 < n:
+            edges.append((index, index + 1))
+        if index + layout.width < n and (column == 0 or rng.random() < layout.spec.corridor_density):
+            edges.append((index, index + layout.width))
+    return edges
+
+
+def _write_rows(file_path: str, rows):
+    with open(file_path, "w", newline="") as f:
+        csv_writer = csv.writer(f, delimiter=",")
+        csv_writer.writerow(["WKT", "name", "description"])
+        csv_writer.writerows(rows)
+
+
+def generate_campus(spec: CampusSpec, directory: str) -> CampusFiles:
+    """
+    Writes the CSVs of the campus described by spec to directory. The same spec always writes the same files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = CampusFiles.in_directory(directory, spec.num_floors)
+    layout = _Layout(spec)
+    rng = random.Random(spec.seed)
+
+    def polygon_rows():
+        margin = spec.node_spacing / 4
+        for building in range(spec.num_buildings):
+            x, y = layout.building_origin(building)
+            corners = [(x - margin, y - margin), (x + layout.building_width + margin, y - margin),
+                       (x + layout.building_width + margin, y + layout.building_depth + margin),
+                       (x - margin, y + layout.building_depth + margin), (x - margin, y - margin)]
+            yield f"POLYGON (({', '.join(layout.wkt_point(*corner) for corner in corners)}))", \
+                building_name(building), ""
+    _write_rows(files.polygons, polygon_rows())
+
+    def point(building: int, index: int) -> str:
+        return layout.wkt_point(*layout.node_position(building, index))
+
+    # bridges leave a building from the end of its first corridor or the start of its last one
+    east_exit = min(layout.width, spec.nodes_per_floor) - 1
+    north_exit = (layout.depth - 1) * layout.width
+
+    for floor in range(spec.num_floors):
+        _write_rows(files.nodes[floor],
+                    ((f"POINT ({point(building, index)})", f"{building_name(building)}.{index + 1}", "")
+                     for building in range(spec.num_buildings) for index in range(spec.nodes_per_floor)))
+
+        def edge_rows():
+            for building in range(spec.num_buildings):
+                for v1, v2 in _floor_edges(layout, rng):
+                    yield f"LINESTRING ({point(building, v1)}, {point(building, v2)})", building_name(building), ""
+                for (dx, dy), exit_index in (((1, 0), east_exit), ((0, 1), north_exit)):
+                    neighbour = layout.neighbour(building, dx, dy)
+                    if neighbour is not None:
+                        yield f"LINESTRING ({point(building, exit_index)}, {point(neighbour, 0)})", \
+                            f"{building_name(building)}-{building_name(neighbour)}", ""
+        _write_rows(files.edges[floor], edge_rows())
+
+    def vertical_rows(count: int):
+        for building in range(spec.num_buildings):
+            indices = rng.sample(range(spec.nodes_per_floor), min(count, spec.nodes_per_floor))
+            for k, index in enumerate(indices):
+                x, y = layout.node_position(building, index)
+                # next to a node rather than on it, like a stairwell off a corridor
+                yield f"POINT ({layout.wkt_point(x + spec.node_spacing / 4, y)})", \
+                    f"{building_name(building)}.{k + 1}", ""
+    _write_rows(files.stairs, vertical_rows(spec.stairs_per_building))
+    _write_rows(files.elevators, vertical_rows(spec.elevators_per_building))
+
+    return files
+
+
+def load_campus(files: CampusFiles) -> Tuple[Dict[str, Polygon], Graph]:
+    """
+    Parses the CSVs of a campus into its polygons and graph, like create_all_graph_components does for the real one.
+    Edges are streamed into the graph, floor by floor.
+    """
+    polygons = graph_utils.parse_polygons(files.polygons)
+    nodes = graph_utils.parse_nodes(files.stairs, polygons, None, NodeType.STAIR) + \
+        graph_utils.parse_nodes(files.elevators, polygons, None, NodeType.ELEVATOR)
+    edges = []
+    for floor, (nodes_file_path, edges_file_path) in enumerate(zip(files.nodes, files.edges)):
+        floor_nodes = graph_utils.parse_nodes(nodes_file_path, polygons, floor)
+        nodes += floor_nodes
+        edges.append(graph_utils.iter_edges(edges_file_path, graph_utils.locations_to_node_ids(floor_nodes)))
+
+    return polygons, graph_utils.create_graph(nodes, itertools.chain.from_iterable(edges),
+                                              num_floors=len(files.nodes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic campus in the campus CSV formats.")
+    parser.add_argument("directory")
+    parser.add_argument("--buildings", type=int, default=CampusSpec.num_buildings)
+    parser.add_argument("--floors", type=int, default=CampusSpec.num_floors)
+    parser.add_argument("--nodes-per-floor", type=int, default=CampusSpec.nodes_per_floor)
+    parser.add_argument("--corridor-density", type=float, default=CampusSpec.corridor_density)
+    parser.add_argument("--stairs", type=int, default=CampusSpec.stairs_per_building, help="per building")
+    parser.add_argument("--elevators", type=int, default=CampusSpec.elevators_per_building, help="per building")
+    parser.add_argument("--node-spacing", type=float, default=CampusSpec.node_spacing)
+    parser.add_argument("--seed", type=int, default=CampusSpec.seed)
+    args = parser.parse_args()
+
+    campus_spec = CampusSpec(num_buildings=args.buildings, num_floors=args.floors,
+                             nodes_per_floor=args.nodes_per_floor, corridor_density=args.corridor_density,
+                             stairs_per_building=args.stairs, elevators_per_building=args.elevators,
+                             node_spacing=args.node_spacing, seed=args.seed)
+    generate_campus(campus_spec, args.directory)
+    print(f"Wrote a campus of {campus_spec.num_nodes} nodes to {args.directory}")
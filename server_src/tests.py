@@ -1,8 +1,31 @@
 import unittest
+import asyncio
 import csv
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # from server_src import graph as graph_utils
 import graph as graph_utils
+import benchmark
+import contraction
+import csr
+import dynamic
+import instrumentation
+import overlay
+import precompute
+import registry
+import request_handler
+import response_cache
+import server
+import sessions
+import snapshot
+import spatial
+import synthetic
+import wkt
 # from server_src.graph import POLYGONS_CSV_FILE_PATH, NODES_1_CSV_FILE_PATH, EDGES_1_CSV_FILE_PATH, GRAPH_JSON_FILE_PATH, \
 #    APSP_JSON_FILE_PATH
 from graph import POLYGONS_CSV_FILE_PATH, NODES_1_CSV_FILE_PATH, EDGES_1_CSV_FILE_PATH, GRAPH_JSON_FILE_PATH, \
@@ -111,6 +134,15 @@ class GraphTests(unittest.TestCase):
 
         self.assertEqual(self.graph.apsp(), graph.apsp_cache)
 
+    def test_apsp_matches_find_shortest_path(self):
+        apsp = self.graph.apsp()
+
+        expected_num_routes = len(self.graph.get_nodes_by_type(graph_utils.NodeType.BUILDING)) * \
+            len(self.graph.get_building_names()) * len(self.graph.get_floor_numbers())
+        self.assertEqual(expected_num_routes, len(apsp))
+        for (src, building, floor), route in apsp.items():
+            self.assertEqual(self.graph.find_shortest_path(src, building, floor, use_cache=False), route)
+
 
 class ClosestNodeTests(unittest.TestCase):
     def setUp(self):
@@ -143,6 +175,35 @@ class ClosestNodeTests(unittest.TestCase):
         #print("Between current location and 1.1.1.b:"+str(distance.distance(loc_from_google.values,node_1.location.values)))
         self.assertEqual(self.graph.get_closest_node(loc_from_google),"1.1.1.b")
 
+    def test_closest_node_matches_linear_scan(self):
+        for i in range(50):
+            point = graph_utils.Location(lat=42.357 + i * 0.0001, lon=-71.094 + i * 0.0001)
+            expected_node = min(self.graph.get_nodes_by_floor_and_type(1, graph_utils.NodeType.BUILDING),
+                                key=lambda v: graph_utils.calculate_distance(point, self.graph.get_node(v).location))
+            self.assertEqual(expected_node, self.graph.get_closest_node(point))
+
+    def test_spatial_index_k_nearest_and_radius(self):
+        index = self.graph.get_spatial_index(1)
+        point = graph_utils.Location(lat=42.3579114810823, lon=-71.09195835623672)
+
+        nearest = index.nearest(point.lat, point.lon, k=3)
+        self.assertEqual(3, len(nearest))
+        self.assertEqual("1.1.1.b", nearest[0][0])
+        self.assertEqual(sorted(distance for _, distance in nearest), [distance for _, distance in nearest])
+
+        radius = nearest[-1][1]
+        self.assertEqual(nearest, index.within(point.lat, point.lon, radius))
+
+        batch = index.nearest_batch([point.lat, point.lat], [point.lon, point.lon], k=3)
+        self.assertEqual([nearest, nearest], batch)
+
+    def test_spatial_index_without_exact_distance(self):
+        index = spatial.SpatialIndex(["a", "b"], [42.0, 42.001], [-71.0, -71.0])
+        (closest, distance), = index.nearest(42.0009, -71.0)
+
+        self.assertEqual("b", closest)
+        self.assertAlmostEqual(11.1, distance, places=1)
+
 
 class CurrentBuildingTests(unittest.TestCase):
     def setUp(self):
@@ -190,6 +251,25 @@ class CurrentBuildingTests(unittest.TestCase):
         unmapped_point = graph_utils.Location(lat=42.3588101176443, lon=-71.08914198461318)
         self.assertEqual(graph_utils.get_current_building(self.polygons,unmapped_point),None)
 
+    def test_locator_matches_polygons(self):
+        points = [graph_utils.Location(lat=42.357 + i * 0.00013, lon=-71.094 + j * 0.00017)
+                  for i in range(30) for j in range(30)]
+        locator = graph_utils.BuildingLocator(self.polygons)
+
+        expected_buildings = []
+        for point in points:
+            expected_building = None
+            for building, polygon in self.polygons.items():
+                if polygon.is_within_area(point):
+                    expected_building = building
+                    break
+            expected_buildings.append(expected_building)
+
+        self.assertEqual(expected_buildings, [locator.locate(point) for point in points])
+        self.assertEqual(expected_buildings, locator.locate_batch([point.lat for point in points],
+                                                                  [point.lon for point in points]))
+        self.assertTrue(any(building is not None for building in expected_buildings))
+
 
 class DijkstraTests(unittest.TestCase):
     def setUp(self):
@@ -282,6 +362,24 @@ class DijkstraTests(unittest.TestCase):
         self.assertEqual(expected_path, route.path)
         self.assertEqual(expected_dest, route.destination)
 
+    def test_shortest_path_to_building_matches_sssp(self):
+        for src in self.graph.get_nodes_by_type(graph_utils.NodeType.BUILDING):
+            dist, _ = self.graph.sssp(src)
+            for building in self.graph.get_building_names():
+                targets = self.graph.get_nodes_by_building_and_floor_and_type(building, 1,
+                                                                               graph_utils.NodeType.BUILDING)
+                route = self.graph.find_shortest_path(src, building, use_cache=False)
+
+                self.assertEqual(min(dist[v] for v in targets), route.distance)
+                self.assertEqual(route.distance, dist[route.destination])
+
+    def test_shortest_path_to_unreachable_nodes(self):
+        route = self.graph.find_route_to_nodes("3.1.1.b", set())
+
+        self.assertIsNone(route.destination)
+        self.assertIsNone(route.path)
+        self.assertEqual(float('inf'), route.distance)
+
 
 class DirectionTests(unittest.TestCase):
     def setUp(self):
@@ -305,5 +403,1223 @@ class DirectionTests(unittest.TestCase):
         # self.assertEqual(expected_dest, route.destination)
 
 
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "graph.json")
+        with open(self.file_path, 'w') as f:
+            f.write("{}")
+
+        self.num_loads = 0
+
+        def loader():
+            self.num_loads += 1
+            return {}, graph_utils.Graph()
+
+        self.registry = registry.GraphRegistry(file_paths=[self.file_path], loader=loader)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_loads_once(self):
+        polygons_1, graph_1 = self.registry.get()
+        polygons_2, graph_2 = self.registry.get()
+
+        self.assertIs(graph_1, graph_2)
+        self.assertEqual(1, self.num_loads)
+        self.assertEqual(1, self.registry.stats.misses)
+        self.assertEqual(1, self.registry.stats.hits)
+
+    def test_touch_without_change_does_not_reload(self):
+        self.registry.get()
+        stat = os.stat(self.file_path)
+        os.utime(self.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.registry.get()
+
+        self.assertEqual(1, self.num_loads)
+
+    def test_content_change_reloads(self):
+        _, graph_1 = self.registry.get()
+        with open(self.file_path, 'w') as f:
+            f.write("{\"changed\": true}")
+        _, graph_2 = self.registry.get()
+
+        self.assertIsNot(graph_1, graph_2)
+        self.assertEqual(2, self.num_loads)
+        self.assertEqual(2, self.registry.stats.loads)
+
+    def test_default_mode_is_resolved_once(self):
+        snapshot_file_path = graph_utils.GRAPH_SNAPSHOT_FILE_PATH
+        graph_utils.GRAPH_SNAPSHOT_FILE_PATH = os.path.join(self.temp_dir.name, "graph.snapshot")
+        try:
+            default_registry = registry.GraphRegistry()
+            self.assertNotIn(graph_utils.GRAPH_SNAPSHOT_FILE_PATH, default_registry.file_paths)
+
+            # a snapshot appearing later is neither watched nor loaded until a new registry is made
+            with open(graph_utils.GRAPH_SNAPSHOT_FILE_PATH, 'wb') as f:
+                f.write(b"not a snapshot")
+            _, graph = default_registry.get()
+            self.assertNotIn(graph_utils.GRAPH_SNAPSHOT_FILE_PATH, default_registry.file_paths)
+            self.assertGreater(len(graph.get_node_ids()), 0)
+        finally:
+            graph_utils.GRAPH_SNAPSHOT_FILE_PATH = snapshot_file_path
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        self.graph = graph_utils.create_graph(nodes, edges, num_floors=2)
+        self.graph.apsp_cache = self.graph.apsp()
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_file_path = os.path.join(self.temp_dir.name, "graph.snapshot")
+        snapshot.save_snapshot(self.graph, self.snapshot_file_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save_and_load_snapshot(self):
+        graph = snapshot.load_snapshot(self.snapshot_file_path)
+
+        self.assertEqual(self.graph, graph)
+        self.assertEqual(self.graph.apsp_cache, dict(graph.apsp_cache.items()))
+
+    def test_query_snapshot_without_loading(self):
+        with snapshot.Snapshot(self.snapshot_file_path) as graph_snapshot:
+            self.assertEqual(self.graph.get_node("3.1.1.b"), graph_snapshot.get_node("3.1.1.b"))
+            self.assertEqual(self.graph.adj["3.1.1.b"], graph_snapshot.get_adj("3.1.1.b"))
+            self.assertEqual(self.graph.apsp_cache[("3.1.1.b", "2", 1)], graph_snapshot.find_route("3.1.1.b", "2", 1))
+            self.assertIsNone(graph_snapshot.find_route("3.1.1.b", "not a building", 1))
+            self.assertIsNone(graph_snapshot.node_index("not a node"))
+
+
+class CSRGraphTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        self.nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, self.nodes)
+        self.graph = graph_utils.create_graph(self.nodes, edges, num_floors=2)
+        self.csr = csr.CSRGraph.from_graph(self.graph)
+
+    def test_conversion(self):
+        self.assertEqual(len(self.graph.get_node_ids()), self.csr.num_nodes)
+        self.assertEqual(sum(len(adj) for adj in self.graph.adj.values()), self.csr.num_edges)
+
+        nodes = self.csr.get_nodes("3", 1, graph_utils.NodeType.BUILDING)
+        expected_nodes = self.graph.get_nodes_by_building_and_floor_and_type("3", 1, graph_utils.NodeType.BUILDING)
+        self.assertEqual(sorted(self.csr.index[node_id] for node_id in expected_nodes), nodes.tolist())
+        self.assertEqual(self.csr.num_nodes, len(self.csr.get_nodes()))
+        self.assertEqual(0, len(self.csr.get_nodes("3", 7)))
+
+    def test_shortest_path(self):
+        dist, parent = self.csr.sssp("8.1.2.b")
+        shortest_path = self.csr.parse_sssp_parent(parent, self.csr.index["4.1.1.b"])
+
+        self.assertEqual(["8.1.2.b", "8.1.1.b", "4.1.3.b", "4.1.2.b", "4.1.1.b"], shortest_path)
+
+    def test_shortest_path_to_building_matches_graph(self):
+        for src in ["3.1.1.b", "1.1.1.b", "4.1.4.b", "10.1.2.b"]:
+            for building in self.graph.get_building_names():
+                self.assertEqual(self.graph.find_shortest_path(src, building),
+                                 self.csr.find_shortest_path(src, building))
+
+    def test_closest_node(self):
+        for node in self.nodes:
+            self.assertEqual(node.id, self.csr.get_closest_node(node.location))
+
+
+class NextHopTableTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        self.graph = graph_utils.create_graph(nodes, edges, num_floors=2)
+        self.apsp = self.graph.apsp()
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_routes_match_apsp(self):
+        next_hop_table = self.graph.build_next_hop_table()
+
+        for key, route in self.apsp.items():
+            self.assertEqual(route, next_hop_table.get_route(*key))
+
+            next_node = route.path[1] if len(route.path) > 1 else None
+            self.assertEqual((next_node, route.destination, route.distance), next_hop_table.get_next_hop(*key))
+
+    def test_save_and_load_next_hop_json(self):
+        json_file_path = os.path.join(self.temp_dir.name, "next_hop.json")
+        self.graph.save_next_hop_table_to_json(json_file_path)
+
+        graph_file_path = os.path.join(self.temp_dir.name, "graph.json")
+        self.graph.save_to_json(graph_file_path)
+
+        graph = graph_utils.Graph()
+        graph.load_from_json(graph_file_path)
+        self.assertTrue(graph.load_next_hop_table_from_json(json_file_path))
+
+        for key, route in self.apsp.items():
+            self.assertEqual(route, graph.next_hop_table.get_route(*key))
+
+    def test_next_hop_table_in_snapshot(self):
+        self.graph.next_hop_table = self.graph.build_next_hop_table()
+        snapshot_file_path = os.path.join(self.temp_dir.name, "graph.snapshot")
+        snapshot.save_snapshot(self.graph, snapshot_file_path, apsp={})
+
+        graph = snapshot.load_snapshot(snapshot_file_path)
+        self.assertEqual(0, len(graph.apsp_cache))
+        for (src, building, floor), route in self.apsp.items():
+            self.assertEqual(route, graph.find_shortest_path(src, building, floor))
+            self.assertEqual(route.destination, graph.find_next_hop(src, building, floor)[1])
+
+
+class PrecomputeTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        self.graph = graph_utils.create_graph(nodes, edges, num_floors=2)
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _read(self, file_name):
+        with open(os.path.join(self.temp_dir.name, file_name), 'rb') as f:
+            return f.read()
+
+    def test_partition(self):
+        groups = self.graph.get_destination_groups()
+        chunks = precompute.partition(groups, 4)
+
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(sorted(groups), sorted(group for chunk in chunks for group in chunk))
+
+    def test_parallel_apsp_is_identical_to_serial(self):
+        serial = precompute.build_apsp(self.graph, workers=1)
+        parallel = precompute.build_apsp(self.graph, workers=2)
+        self.assertEqual(serial, parallel)
+
+        self.graph.save_apsp_to_json(os.path.join(self.temp_dir.name, "serial.json"), apsp=serial)
+        self.graph.save_apsp_to_json(os.path.join(self.temp_dir.name, "parallel.json"), apsp=parallel)
+        self.assertEqual(self._read("serial.json"), self._read("parallel.json"))
+
+    def test_parallel_next_hop_table_is_identical_to_serial(self):
+        serial = precompute.build_next_hop_table(self.graph, workers=1)
+        parallel = precompute.build_next_hop_table(self.graph, workers=2)
+
+        self.graph.save_next_hop_table_to_json(os.path.join(self.temp_dir.name, "serial.json"), serial)
+        self.graph.save_next_hop_table_to_json(os.path.join(self.temp_dir.name, "parallel.json"), parallel)
+        self.assertEqual(self._read("serial.json"), self._read("parallel.json"))
+
+
+class DistanceBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.points = [graph_utils.Location(lat=42.357 + i * 0.0003, lon=-71.094 + (i * 7 % 20) * 0.0003)
+                       for i in range(20)]
+
+    def tearDown(self):
+        graph_utils.set_distance_backend(graph_utils.DistanceBackend.GEODESIC)
+
+    def test_backends_within_documented_error(self):
+        for point_1 in self.points:
+            for point_2 in self.points:
+                geodesic = graph_utils.calculate_distance(point_1, point_2, graph_utils.DistanceBackend.GEODESIC)
+                haversine = graph_utils.calculate_distance(point_1, point_2, graph_utils.DistanceBackend.HAVERSINE)
+                local = graph_utils.calculate_distance(point_1, point_2, graph_utils.DistanceBackend.LOCAL_PROJECTION)
+
+                self.assertLessEqual(abs(haversine - geodesic), 0.003 * geodesic + 1e-9)
+                self.assertLessEqual(abs(local - geodesic), 0.001)
+
+    def test_vectorized_matches_scalar(self):
+        lats = [point.lat for point in self.points]
+        lons = [point.lon for point in self.points]
+        origin = self.points[0]
+
+        for backend in graph_utils.DistanceBackend:
+            distances = graph_utils.calculate_distances(origin.lat, origin.lon, lats, lons, backend)
+            expected_distances = [graph_utils.calculate_distance(origin, point, backend) for point in self.points]
+            for expected_distance, distance in zip(expected_distances, distances):
+                self.assertAlmostEqual(expected_distance, distance, places=6)
+
+    def test_set_distance_backend(self):
+        graph_utils.set_distance_backend("haversine")
+
+        self.assertEqual(graph_utils.DistanceBackend.HAVERSINE, graph_utils.get_distance_backend())
+        self.assertEqual(graph_utils.calculate_distance(self.points[0], self.points[1],
+                                                        graph_utils.DistanceBackend.HAVERSINE),
+                         graph_utils.calculate_distance(self.points[0], self.points[1]))
+
+
+class DynamicRouterTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        self.graph = graph_utils.create_graph(nodes, edges, num_floors=2)
+        self.graph.apsp_cache = self.graph.apsp()
+        self.router = dynamic.DynamicRouter(self.graph)
+
+    def assertCacheIsFresh(self):
+        for (src, building, floor), route in self.graph.apsp_cache.items():
+            expected_route = self.graph.find_shortest_path(src, building, floor, use_cache=False)
+            self.assertEqual(expected_route.destination is None, route.destination is None)
+            if route.destination is not None:
+                self.assertAlmostEqual(expected_route.distance, route.distance)
+
+    def test_close_and_reopen_edge(self):
+        route = self.graph.find_shortest_path("3.1.1.b", "2")
+        self.assertEqual(["3.1.1.b", "kc.1.2.b", "2.1.1.b"], route.path)
+
+        report = self.router.close_edge("kc.1.2.b", "2.1.1.b")
+        self.assertGreater(report.routes_touched, 0)
+        self.assertLess(report.routes_touched, len(self.graph.apsp_cache))
+        self.assertNotIn("2.1.1.b", self.graph.find_shortest_path("3.1.1.b", "2").path[:-1])
+        self.assertCacheIsFresh()
+
+        self.router.reopen_edge("kc.1.2.b", "2.1.1.b")
+        self.assertEqual(route, self.graph.find_shortest_path("3.1.1.b", "2"))
+        self.assertCacheIsFresh()
+
+    def test_reweight_edge(self):
+        self.router.reweight_edge("3.1.1.b", "kc.1.2.b", 1000)
+        self.assertCacheIsFresh()
+
+        self.router.reweight_edge("3.1.1.b", "kc.1.2.b", 1)
+        self.assertCacheIsFresh()
+
+    def test_astar_stays_optimal_after_cheaper_edge(self):
+        _, graph = graph_utils.create_all_graph_components(use_cache=False)
+        self.assertEqual(1.0, graph.heuristic_scale())
+
+        dynamic.DynamicRouter(graph).reweight_edge("4.0.1.b", "4.0.2.b", 1.0)
+        self.assertLess(graph.heuristic_scale(), 1.0)
+        for src in sorted(graph.get_node_ids()):
+            for building, floor in graph.get_destination_groups():
+                expected_route = graph.find_shortest_path(src, building, floor, use_cache=False)
+                route = graph.find_shortest_path(src, building, floor, use_cache=False, use_astar=True)
+                if expected_route.destination is not None:
+                    self.assertAlmostEqual(expected_route.distance, route.distance)
+
+    def test_disable_node(self):
+        self.router.disable_node("kc.1.2.b")
+
+        for (src, building, floor), route in self.graph.apsp_cache.items():
+            if src != "kc.1.2.b" and route.path is not None:
+                self.assertNotIn("kc.1.2.b", route.path)
+        self.assertCacheIsFresh()
+
+        self.router.enable_node("kc.1.2.b")
+        self.assertEqual(self.graph.apsp(), self.graph.apsp_cache)
+
+    def test_unrelated_edge_touches_nothing(self):
+        report = self.router.reweight_edge("3.1.1.b", "kc.1.2.b", self.graph.get_weight("3.1.1.b", "kc.1.2.b"))
+
+        self.assertEqual(0, report.routes_touched)
+        self.assertEqual(0, report.cache_entries_updated)
+
+    def test_invalid_updates(self):
+        with self.assertRaises(ValueError):
+            self.router.close_edge("3.1.1.b", "4.1.1.b")
+        with self.assertRaises(ValueError):
+            self.router.reopen_edge("3.1.1.b", "kc.1.2.b")
+
+
+class FingerprintTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        self.graph = graph_utils.create_graph(nodes, edges, num_floors=2)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.graph_file_path = os.path.join(self.temp_dir.name, "graph.json")
+        self.apsp_file_path = os.path.join(self.temp_dir.name, "apsp.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def other_graph(self) -> graph_utils.Graph:
+        graph = graph_utils.Graph()
+        graph.load_from_json(self.graph_file_path)
+        graph.add_edge("3.1.1.b", "kc.1.2.b", weight=1000)
+        return graph
+
+    def test_fingerprint_is_stable(self):
+        self.graph.save_to_json(self.graph_file_path)
+
+        graph = graph_utils.Graph()
+        graph.load_from_json(self.graph_file_path)
+
+        self.assertEqual(self.graph.fingerprint(), graph.fingerprint())
+        self.assertEqual(self.graph.fingerprint(), graph.compute_fingerprint())
+
+    def test_fingerprint_changes_with_graph(self):
+        fingerprint = self.graph.fingerprint()
+
+        self.graph.add_edge("3.1.1.b", "kc.1.2.b", weight=1000)
+        self.assertNotEqual(fingerprint, self.graph.fingerprint())
+
+    def test_equality_compares_every_node(self):
+        self.graph.save_to_json(self.graph_file_path)
+        graph = graph_utils.Graph()
+        graph.load_from_json(self.graph_file_path)
+
+        node = graph.get_node("3.1.1.b")
+        graph.add_node(graph_utils.Node(id=node.id, location=graph_utils.Location(lat=0, lon=0),
+                                        building=node.building, floor=node.floor, node_type=node.node_type))
+        graph.adj["3.1.1.b"] = self.graph.adj["3.1.1.b"]
+
+        self.assertNotEqual(self.graph, graph)
+
+    def test_mismatched_apsp_cache_is_not_loaded(self):
+        self.graph.save_to_json(self.graph_file_path)
+        self.graph.save_apsp_to_json(self.apsp_file_path)
+
+        graph = self.other_graph()
+        self.assertFalse(graph.load_apsp_from_json(self.apsp_file_path))
+        self.assertEqual({}, graph.apsp_cache)
+        self.assertEqual(graph.find_shortest_path("3.1.1.b", "2", use_cache=False),
+                         graph.find_shortest_path("3.1.1.b", "2"))
+
+    def test_mismatched_next_hop_table_is_not_loaded(self):
+        next_hop_file_path = os.path.join(self.temp_dir.name, "next_hop.json")
+        self.graph.save_to_json(self.graph_file_path)
+        self.graph.save_next_hop_table_to_json(next_hop_file_path)
+
+        self.assertFalse(self.other_graph().load_next_hop_table_from_json(next_hop_file_path))
+
+    def test_snapshot_keeps_fingerprint(self):
+        snapshot_file_path = os.path.join(self.temp_dir.name, "graph.snapshot")
+        snapshot.save_snapshot(self.graph, snapshot_file_path, apsp=self.graph.apsp())
+
+        with snapshot.Snapshot(snapshot_file_path) as graph_snapshot:
+            self.assertEqual(self.graph.fingerprint(), graph_snapshot.fingerprint)
+            graph = graph_snapshot.to_graph(lazy_routes=False)
+            self.assertEqual(self.graph.fingerprint(), graph.compute_fingerprint())
+
+
+class AStarTests(unittest.TestCase):
+    def setUp(self):
+        _, self.graph = graph_utils.create_all_graph_components(use_cache=False)
+        self.keys = [(src, building, floor) for src in sorted(self.graph.get_node_ids())
+                     for building, floor in self.graph.get_destination_groups()]
+
+    def test_matches_dijkstra(self):
+        for src, building, floor in self.keys:
+            route = self.graph.find_shortest_path(src, building, floor, use_cache=False)
+            astar_route = self.graph.find_shortest_path(src, building, floor, use_cache=False, use_astar=True)
+
+            self.assertEqual(route.destination, astar_route.destination)
+            self.assertAlmostEqual(route.distance, astar_route.distance)
+
+    def test_expands_fewer_nodes(self):
+        sssp_stats = graph_utils.SearchStats()
+        dijkstra_stats = graph_utils.SearchStats()
+        astar_stats = graph_utils.SearchStats()
+        for src, building, floor in self.keys:
+            self.graph.sssp(src, sssp_stats)
+            self.graph.find_shortest_path(src, building, floor, use_cache=False, stats=dijkstra_stats)
+            self.graph.find_shortest_path(src, building, floor, use_cache=False, use_astar=True, stats=astar_stats)
+
+        self.assertEqual(len(self.keys) * len(self.graph.get_node_ids()), sssp_stats.nodes_expanded)
+        self.assertLess(astar_stats.nodes_expanded, dijkstra_stats.nodes_expanded)
+        self.assertLess(astar_stats.nodes_expanded, sssp_stats.nodes_expanded / 4)
+
+    def test_heuristic_is_consistent(self):
+        for building, floor in self.graph.get_destination_groups():
+            targets = self.graph.get_nodes_by_building_and_floor_and_type(building, floor,
+                                                                          graph_utils.NodeType.BUILDING)
+            heuristic = self.graph.target_heuristic(targets)
+
+            for target in targets:
+                self.assertEqual(0, heuristic(target))
+            for v1_id in self.graph.get_node_ids():
+                for v2_id, weight in self.graph.adj[v1_id].items():
+                    self.assertLessEqual(heuristic(v1_id), weight + heuristic(v2_id) + 1e-9)
+
+    def test_unreachable(self):
+        route = self.graph.find_route_astar("3.1.1.b", set())
+        self.assertIsNone(route.destination)
+        self.assertEqual(float('inf'), route.distance)
+
+
+class BidirectionalSearchTests(unittest.TestCase):
+    def setUp(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        self.graph = graph_utils.create_graph(nodes, edges, num_floors=2)
+
+    def test_shortest_paths(self):
+        self.assertEqual(["8.1.2.b", "8.1.1.b", "4.1.3.b", "4.1.2.b", "4.1.1.b"],
+                         self.graph.find_route_to_node("8.1.2.b", "4.1.1.b").path)
+        self.assertEqual(["11.1.1.b", "3.1.3.b", "3.1.2.b", "3.1.1.b", "kc.1.2.b", "2.1.1.b"],
+                         self.graph.find_route_to_node("11.1.1.b", "2.1.1.b").path)
+
+    def test_matches_sssp(self):
+        for src in self.graph.get_node_ids():
+            dist, _ = self.graph.sssp(src)
+            for dest in self.graph.get_node_ids():
+                route = self.graph.find_route_to_node(src, dest)
+
+                self.assertEqual(dest, route.destination)
+                self.assertEqual(src, route.path[0])
+                self.assertAlmostEqual(dist[dest], route.distance)
+
+    def test_matches_find_route_to_nodes(self):
+        for src in self.graph.get_node_ids():
+            for building in self.graph.get_building_names():
+                targets = self.graph.get_nodes_by_building(building)
+                expected_route = self.graph.find_route_to_nodes(src, targets)
+                route = self.graph.find_route_bidirectional(src, targets)
+
+                self.assertIn(route.destination, targets)
+                self.assertAlmostEqual(expected_route.distance, route.distance)
+
+    def test_source_is_target(self):
+        route = self.graph.find_route_to_node("3.1.1.b", "3.1.1.b")
+        self.assertEqual(["3.1.1.b"], route.path)
+        self.assertEqual(0, route.distance)
+
+    def test_unreachable(self):
+        self.graph.add_node(graph_utils.Node(id="x.1.1.b", location=graph_utils.Location(lat=0, lon=0),
+                                             building="x", floor=1))
+
+        route = self.graph.find_route_to_node("3.1.1.b", "x.1.1.b")
+        self.assertIsNone(route.destination)
+        self.assertIsNone(route.path)
+        self.assertIsNone(self.graph.find_route_bidirectional("3.1.1.b", set()).destination)
+
+    def test_expands_fewer_nodes_on_grid(self):
+        graph = graph_utils.Graph()
+        size = 40
+        for i in range(size):
+            for j in range(size):
+                graph.add_node(graph_utils.Node(id=f"{i}.{j}", location=graph_utils.Location(lat=i, lon=j),
+                                                building="grid", floor=1))
+        for i in range(size):
+            for j in range(size):
+                if i + 1 < size:
+                    graph.add_edge(f"{i}.{j}", f"{i + 1}.{j}", weight=1 + (i * j) % 3)
+                if j + 1 < size:
+                    graph.add_edge(f"{i}.{j}", f"{i}.{j + 1}", weight=1 + (i + j) % 2)
+
+        stats = graph_utils.SearchStats()
+        bidirectional_stats = graph_utils.SearchStats()
+        route = graph.find_route_to_nodes("5.5", {"30.25"}, stats)
+        bidirectional_route = graph.find_route_to_node("5.5", "30.25", bidirectional_stats)
+
+        self.assertEqual(route.distance, bidirectional_route.distance)
+        self.assertLess(bidirectional_stats.nodes_expanded, stats.nodes_expanded)
+
+
+class ContractionHierarchyTests(unittest.TestCase):
+    def setUp(self):
+        _, self.graph = graph_utils.create_all_graph_components(use_cache=False)
+        self.contraction_hierarchy = contraction.ContractionHierarchy.build(self.graph)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.json_file_path = os.path.join(self.temp_dir.name, "ch.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_every_node_is_contracted(self):
+        self.assertEqual(sorted(self.graph.get_node_ids()), sorted(self.contraction_hierarchy.order))
+
+    def test_matches_find_shortest_path(self):
+        for src in self.graph.get_node_ids():
+            for building, floor in self.graph.get_destination_groups():
+                expected_route = self.graph.find_shortest_path(src, building, floor, use_cache=False)
+                route = self.contraction_hierarchy.find_shortest_path(src, building, floor)
+
+                self.assertEqual(expected_route.destination is None, route.destination is None)
+                if route.destination is None:
+                    continue
+                self.assertAlmostEqual(expected_route.distance, route.distance)
+                self.assertEqual(src, route.path[0])
+                self.assertEqual(route.destination, route.path[-1])
+                for v1_id, v2_id in zip(route.path, route.path[1:]):
+                    self.assertTrue(self.graph.contains_edge(v1_id, v2_id))
+
+    def test_matches_sssp(self):
+        for src in self.graph.get_node_ids():
+            dist, _ = self.graph.sssp(src)
+            for dest in self.graph.get_node_ids():
+                self.assertAlmostEqual(dist[dest], self.contraction_hierarchy.find_route_to_node(src, dest).distance)
+
+    def test_save_and_load_json(self):
+        self.contraction_hierarchy.save_to_json(self.json_file_path)
+        contraction_hierarchy = contraction.ContractionHierarchy.load_from_json(self.graph, self.json_file_path)
+
+        self.assertEqual(self.contraction_hierarchy.order, contraction_hierarchy.order)
+        self.assertEqual(self.contraction_hierarchy.up, contraction_hierarchy.up)
+
+    def test_graph_uses_attached_hierarchy(self):
+        self.contraction_hierarchy.save_to_json(self.json_file_path)
+        self.assertTrue(contraction.attach_contraction_hierarchy(self.graph, self.json_file_path))
+
+        route = self.graph.find_shortest_path("7.1.1.b", "2")
+        self.assertEqual(self.graph.find_shortest_path("7.1.1.b", "2", use_cache=False).path, route.path)
+
+    def test_mismatched_graph_is_not_attached(self):
+        self.contraction_hierarchy.save_to_json(self.json_file_path)
+        self.graph.add_edge("3.1.1.b", "kc.1.2.b", weight=1000)
+
+        self.assertFalse(contraction.attach_contraction_hierarchy(self.graph, self.json_file_path))
+        self.assertIsNone(self.graph.contraction_hierarchy)
+
+
+class BuildingOverlayRouterTests(unittest.TestCase):
+    def setUp(self):
+        _, self.graph = graph_utils.create_all_graph_components(use_cache=False)
+        self.router = overlay.BuildingOverlayRouter(self.graph)
+
+    def test_portals(self):
+        for building_name, cell in self.router.cells.items():
+            for node_id in cell.nodes:
+                node = self.graph.get_node(node_id)
+                leaves_building = any(self.graph.get_node(n).building != building_name for n in self.graph.adj[node_id])
+                is_portal = leaves_building or node.node_type != graph_utils.NodeType.BUILDING
+                self.assertEqual(is_portal, node_id in cell.portals)
+
+        self.assertLess(self.router.num_portals, len(self.graph.get_node_ids()))
+
+    def test_matches_find_shortest_path(self):
+        for src in self.graph.get_node_ids():
+            for building, floor in self.graph.get_destination_groups():
+                expected_route = self.graph.find_shortest_path(src, building, floor, use_cache=False)
+                route = self.router.find_shortest_path(src, building, floor)
+
+                self.assertEqual(expected_route.destination is None, route.destination is None)
+                if route.destination is None:
+                    continue
+                self.assertAlmostEqual(expected_route.distance, route.distance)
+                self.assertEqual(src, route.path[0])
+                self.assertEqual(route.destination, route.path[-1])
+                for v1_id, v2_id in zip(route.path, route.path[1:]):
+                    self.assertTrue(self.graph.contains_edge(v1_id, v2_id))
+
+    def test_route_inside_building(self):
+        route = self.router.find_shortest_path("4.1.3.b", "4", 1)
+
+        self.assertEqual(["4.1.3.b"], route.path)
+        self.assertEqual(0, route.distance)
+
+
+def slow_handler(request):
+    time.sleep(float(request["values"].get("sleep", 0)))
+    return request["values"].get("echo", "")
+
+
+class ServerTests(unittest.IsolatedAsyncioTestCase):
+    QUERY = "user_id=a&lat=42.3594&lon=-71.0920&current_floor=1&destination=2&destination_floor=1"
+
+    async def asyncSetUp(self):
+        self.server = server.NavigationServer()
+        self.host, self.port = await self.server.start("127.0.0.1", 0)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def fetch(self, reader, writer, request_line: str, headers: str = "") -> tuple:
+        writer.write(f"{request_line}\r\nHost: localhost\r\n{headers}\r\n".encode())
+        await writer.drain()
+
+        head = (await reader.readuntil(b"\r\n\r\n")).decode().split("\r\n")
+        content_length = next(int(line.split(":")[1]) for line in head if line.lower().startswith("content-length"))
+        body = (await reader.readexactly(content_length)).decode()
+        return int(head[0].split()[1]), body
+
+    async def test_same_response_as_request_handler(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        # the ESP32 client sends the absolute sandbox URL and two spaces before the version
+        status, body = await self.fetch(
+            reader, writer,
+            f"GET https://608dev-2.net/sandbox/sc/team8/server_src/request_handler.py?{self.QUERY}  HTTP/1.1")
+        writer.close()
+
+        values = dict(value.split("=") for value in self.QUERY.split("&"))
+        self.assertEqual(200, status)
+        self.assertEqual(request_handler.request_handler({"method": "GET", "values": values}), body)
+
+    async def test_keep_alive(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        for _ in range(3):
+            status, _ = await self.fetch(reader, writer, f"GET /navigate?{self.QUERY} HTTP/1.1")
+            self.assertEqual(200, status)
+        writer.close()
+
+        self.assertEqual(1, self.server.metrics.connections_opened)
+        self.assertEqual(3, self.server.metrics.navigation_requests)
+
+    async def test_metrics(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        await self.fetch(reader, writer, f"GET /navigate?{self.QUERY} HTTP/1.1")
+        await self.fetch(reader, writer, "GET /unknown HTTP/1.1")
+        status, body = await self.fetch(reader, writer, "GET /metrics HTTP/1.1", "Connection: close\r\n")
+        self.assertEqual(b"", await reader.read())
+        writer.close()
+
+        metrics = json.loads(body)
+        self.assertEqual(200, status)
+        self.assertEqual(3, metrics["requests"])
+        self.assertEqual(1, metrics["navigation_requests"])
+        self.assertEqual({"200": 2, "404": 1}, metrics["responses_by_status"])  # including this one
+        self.assertIn("hits", metrics["registry"])
+
+    async def test_request_timeout(self):
+        await self.server.close()
+        self.server = server.NavigationServer(handler=slow_handler, request_timeout=0.05)
+        self.host, self.port = await self.server.start("127.0.0.1", 0)
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        status, _ = await self.fetch(reader, writer, "GET /?sleep=0.5 HTTP/1.1")
+        self.assertEqual(504, status)
+        status, body = await self.fetch(reader, writer, "GET /?echo=ok HTTP/1.1")
+        self.assertEqual((200, "ok"), (status, body))
+        writer.close()
+
+        self.assertEqual(1, self.server.metrics.timeouts)
+
+    async def test_malformed_request(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(b"NONSENSE\r\n\r\n")
+        await writer.drain()
+
+        self.assertTrue((await reader.read()).startswith(b"HTTP/1.1 400"))
+        writer.close()
+
+
+class SessionTests(unittest.TestCase):
+    def setUp(self):
+        _, self.graph = graph_utils.create_all_graph_components(use_cache=False)
+        self.now = 0.0
+        self.store = sessions.MemorySessionStore(ttl=60, max_sessions=2, clock=lambda: self.now)
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def ping(self, node_id: str, user_id: str = "device", destination: str = "2", lat_offset: float = 0.0):
+        node = self.graph.get_node(node_id)
+        point = graph_utils.Location(lat=node.location.lat + lat_offset, lon=node.location.lon)
+        return sessions.navigate(self.graph, user_id, point, node.floor, destination, 1, store=self.store)
+
+    def test_advances_along_route(self):
+        route = self.graph.find_shortest_path("7.1.1.b", "2")
+        self.assertGreater(len(route.path), 2)
+
+        for i, node_id in enumerate(route.path):
+            session = self.ping(node_id)
+            self.assertEqual(i, session.position)
+            self.assertEqual(route.path, session.path)
+            self.assertAlmostEqual(self.graph.find_shortest_path(node_id, "2").distance, session.remaining_distance)
+
+        self.assertEqual(1, self.store.stats.rerouted)
+        self.assertEqual(len(route.path) - 1, self.store.stats.advanced)
+
+    def test_reroutes_when_off_route(self):
+        self.ping("7.1.1.b")
+        session = self.ping("7.1.1.b", lat_offset=0.001)  # about 110 m north
+
+        self.assertEqual(2, self.store.stats.rerouted)
+        self.assertEqual(0, session.position)
+
+    def test_reroutes_on_new_destination(self):
+        self.ping("7.1.1.b")
+        session = self.ping("7.1.1.b", destination="10")
+
+        self.assertEqual(2, self.store.stats.rerouted)
+        self.assertEqual("10", self.graph.get_node(session.path[-1]).building)
+
+    def test_get_returns_a_copy(self):
+        self.ping("7.1.1.b")
+        session = self.store.get("device")
+        session.position += 1
+
+        self.assertEqual(0, self.store.get("device").position)
+
+    def test_concurrent_pings_are_counted(self):
+        store = sessions.MemorySessionStore()
+        route = self.graph.find_shortest_path("7.1.1.b", "2")
+
+        def walk(user_id: str):
+            for node_id in route.path:
+                node = self.graph.get_node(node_id)
+                sessions.navigate(self.graph, user_id, node.location, node.floor, "2", 1, store=store)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(walk, [f"device-{i}" for i in range(32)]))
+        self.assertEqual((32 * (len(route.path) - 1), 32), (store.stats.advanced, store.stats.rerouted))
+
+    def test_ttl_and_lru(self):
+        self.ping("7.1.1.b", user_id="a")
+        self.ping("7.1.1.b", user_id="b")
+        self.ping("7.1.1.b", user_id="c")
+        self.assertIsNone(self.store.get("a"))
+        self.assertEqual(1, self.store.stats.evicted)
+
+        self.now = 61
+        self.assertIsNone(self.store.get("b"))
+        self.assertEqual(1, self.store.stats.expired)
+
+    def test_sqlite_store(self):
+        database_file_path = os.path.join(self.temp_dir.name, "sessions.sqlite")
+        store = sessions.SQLiteSessionStore(database_file_path, ttl=60, clock=lambda: self.now)
+        session = sessions.navigate(self.graph, "device", self.graph.get_node("7.1.1.b").location, 1, "2", 1,
+                                    store=store)
+        store.close()
+
+        store = sessions.SQLiteSessionStore(database_file_path, ttl=60, clock=lambda: self.now)
+        self.assertEqual(session, store.get("device"))
+        self.now = 61
+        self.assertIsNone(store.get("device"))
+        store.close()
+
+    def test_reroutes_after_edge_is_closed(self):
+        route = self.graph.find_shortest_path("1.1.1.b", "2")
+        self.assertEqual(["1.1.1.b", "kc.1.1.b", "2.1.1.b"], route.path)
+        self.ping("1.1.1.b")
+
+        dynamic.DynamicRouter(self.graph).close_edge("1.1.1.b", "kc.1.1.b")
+        session = self.ping("1.1.1.b")
+
+        self.assertEqual(2, self.store.stats.rerouted)
+        self.assertNotEqual("kc.1.1.b", session.next_node)
+        self.assertEqual(self.graph.fingerprint(), session.fingerprint)
+
+    def test_reroutes_on_graph_without_session_nodes(self):
+        database_file_path = os.path.join(self.temp_dir.name, "sessions.sqlite")
+        store = sessions.SQLiteSessionStore(database_file_path, ttl=60, clock=lambda: self.now)
+        sessions.navigate(self.graph, "device", self.graph.get_node("7.1.1.b").location, 1, "2", 1, store=store)
+        store.close()
+
+        # a restart with a graph the stored path's nodes are missing from
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 1)
+        graph = graph_utils.create_graph([node for node in nodes if node.id != "kc.1.2.b"], [], num_floors=2)
+        store = sessions.SQLiteSessionStore(database_file_path, ttl=60, clock=lambda: self.now)
+        session = sessions.navigate(graph, "device", self.graph.get_node("2.1.1.b").location, 1, "2", 1, store=store)
+        store.close()
+
+        self.assertEqual(1, store.stats.rerouted)
+        self.assertEqual(graph.fingerprint(), session.fingerprint)
+
+
+class ResponseCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = response_cache.ResponseCache(max_entries=2)
+        self.point = graph_utils.Location(lat=42.3594, lon=-71.0920)
+
+    def test_cells_are_about_cell_size(self):
+        # 100 samples along 50 m to the north and to the east each cross about 10 cells
+        for dlat, dlon in ((0.5 / 111000, 0), (0, 0.5 / 82000)):
+            cells = {response_cache.quantize(graph_utils.Location(lat=self.point.lat + i * dlat,
+                                                                  lon=self.point.lon + i * dlon))
+                     for i in range(100)}
+            self.assertIn(len(cells), range(9, 13))
+
+    def test_lru_eviction_and_stats(self):
+        keys = [self.cache.make_key(self.point, 1, destination, 1) for destination in ("1", "2", "3")]
+        self.cache.put(keys[0], "graph", "a")
+        self.cache.put(keys[1], "graph", "b")
+        self.assertEqual("a", self.cache.get(keys[0], "graph"))
+        self.cache.put(keys[2], "graph", "c")
+
+        self.assertIsNone(self.cache.get(keys[1], "graph"))
+        self.assertEqual("a", self.cache.get(keys[0], "graph"))
+        stats = self.cache.get_stats()
+        self.assertEqual((2, 1, 1), (stats["hits"], stats["misses"], stats["evictions"]))
+        self.assertAlmostEqual(2 / 3, stats["hit_rate"])
+
+    def test_new_graph_invalidates(self):
+        key = self.cache.make_key(self.point, 1, "2", 1)
+        self.cache.put(key, "graph", "a")
+
+        self.assertIsNone(self.cache.get(key, "other graph"))
+        self.assertEqual(1, self.cache.stats.invalidations)
+
+    def test_request_handler_hits(self):
+        cache = response_cache.get_response_cache()
+        cache.clear()
+        values = {"user_id": "cache-a", "lat": "42.3594", "lon": "-71.0920", "current_floor": "1", "destination": "2",
+                  "destination_floor": "1"}
+
+        hits = cache.stats.hits
+        response = request_handler.request_handler({"method": "GET", "values": values})
+        self.assertEqual(response, request_handler.request_handler({"method": "GET", "values": values}))
+        self.assertEqual(hits + 1, cache.stats.hits)
+
+        request_handler.request_handler({"method": "GET", "values": dict(values, destination="10")})
+        self.assertEqual(hits + 1, cache.stats.hits)
+
+    def test_cell_across_building_boundary(self):
+        response_cache.get_response_cache().clear()
+        polygons, graph = registry.get_graph_components()
+        # the same cell and closest node (in building 1), on both sides of the wall between buildings 1 and 3
+        in_1 = graph_utils.Location(lat=42.3584408, lon=-71.0923027)
+        in_3 = graph_utils.Location(lat=42.3584408, lon=-71.0922627)
+        self.assertEqual(response_cache.quantize(in_1), response_cache.quantize(in_3))
+        self.assertEqual("1.1.4.b", graph.get_closest_node(in_1, floor=1))
+        self.assertEqual("1.1.4.b", graph.get_closest_node(in_3, floor=1))
+        self.assertEqual(("1", "3"), (graph_utils.get_current_building(polygons, in_1),
+                                      graph_utils.get_current_building(polygons, in_3)))
+
+        for user_id, point, arrived in (("boundary-1", in_1, 0), ("boundary-3", in_3, 1)):
+            values = {"user_id": user_id, "lat": str(point.lat), "lon": str(point.lon), "current_floor": "1",
+                      "destination": "3", "destination_floor": "1"}
+            response = json.loads(request_handler.request_handler({"method": "GET", "values": values}))
+            self.assertEqual(arrived, response["has_arrived"])
+
+    def test_sessions_advance_on_hits(self):
+        store = sessions.get_session_store()
+        _, graph = registry.get_graph_components()
+        path = ["1.1.1.b", "kc.1.1.b", "2.1.1.b"]
+        self.assertEqual(path, graph.find_shortest_path("1.1.1.b", "2", 1).path)
+
+        def poll(user_id: str, node_id: str):
+            location = graph.get_node(node_id).location
+            values = {"user_id": user_id, "lat": str(location.lat), "lon": str(location.lon), "current_floor": "1",
+                      "destination": "2", "destination_floor": "1"}
+            return json.loads(request_handler.request_handler({"method": "GET", "values": values}))
+
+        # every device polling from the same cell gets its own session, even when the response is a hit
+        for user_id in ("cache-walker", "cache-other"):
+            store.delete(user_id)
+            self.assertEqual("kc.1.1.b", poll(user_id, "1.1.1.b")["next_node"])
+            self.assertIsNotNone(store.get(user_id))
+
+        hits = response_cache.get_response_cache().stats.hits
+        for position, node_id in enumerate(path):
+            response = poll("cache-walker", node_id)
+            self.assertEqual(node_id, response["curr_node"])
+            self.assertEqual(position, store.get("cache-walker").position)
+        self.assertGreater(response_cache.get_response_cache().stats.hits, hits)
+        self.assertTrue(response["has_arrived"])
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        _, self.graph = registry.get_graph_components()
+        random.seed(20)
+        node_ids = sorted(self.graph.get_nodes_by_type(graph_utils.NodeType.BUILDING))
+        buildings = sorted(self.graph.get_building_names())
+        self.requests = []
+        for i, node_id in enumerate(node_ids):
+            node = self.graph.get_node(node_id)
+            self.requests.append({"user_id": f"batch-{i}", "lat": str(node.location.lat + 0.00002),
+                                  "lon": str(node.location.lon), "current_floor": str(node.floor),
+                                  "destination": random.choice(buildings[:3]), "destination_floor": "1"})
+
+    def test_same_responses_as_request_handler(self):
+        responses = request_handler.navigate_batch(self.requests)["responses"]
+
+        self.assertEqual(len(self.requests), len(responses))
+        for values, response in zip(self.requests, responses):
+            response_cache.get_response_cache().clear()
+            expected = request_handler.request_handler({"method": "GET", "values": values})
+            self.assertEqual(json.loads(expected), response)
+
+    def test_errors_are_per_request(self):
+        requests = [dict(self.requests[0], lat="north"), dict(self.requests[0], destination="999999"),
+                    {"user_id": "a"}, self.requests[0], dict(self.requests[0], current_floor="7"),
+                    dict(self.requests[0], destination_floor="5")]
+        responses = request_handler.navigate_batch(requests)["responses"]
+
+        self.assertEqual("Both lat and lon must be valid coordinates", responses[0]["error"])
+        self.assertIn("999999", responses[1]["error"])
+        self.assertEqual("Missing data: 'lat'", responses[2]["error"])
+        self.assertEqual(request_handler.navigate_batch(self.requests[:1])["responses"][0], responses[3])
+        self.assertEqual("Unknown floor 7", responses[4]["error"])
+        self.assertIn("no floor 5", responses[5]["error"])
+
+    def test_post_form(self):
+        response = request_handler.request_handler({"method": "POST", "values": {},
+                                                    "form": {"requests": json.dumps(self.requests[:5])}})
+        self.assertEqual(request_handler.navigate_batch(self.requests[:5]), json.loads(response))
+
+        self.assertEqual("Missing data: requests",
+                         str(request_handler.request_handler({"method": "POST", "values": {}, "form": {}})))
+
+    def test_shares_one_search_per_destination(self):
+        _, graph = graph_utils.create_all_graph_components(use_cache=False)
+        srcs = sorted(graph.get_nodes_by_type(graph_utils.NodeType.BUILDING))[:20]
+        for src, hop in zip(srcs, graph.find_next_hops(srcs, "2", 1)):
+            route = graph.find_shortest_path(src, "2", 1)
+            next_node = route.path[1] if len(route.path) > 1 else None
+            self.assertEqual((next_node, route.destination), hop[:2])
+            self.assertAlmostEqual(route.distance, hop[2])
+
+
+class CompactResponseTests(unittest.TestCase):
+    VALUES = {"user_id": "a", "lat": "42.3594", "lon": "-71.0920", "current_floor": "1", "destination": "2",
+              "destination_floor": "1"}
+
+    def test_same_fields_as_json(self):
+        response = json.loads(request_handler.request_handler({"method": "GET", "values": self.VALUES}))
+        compact = request_handler.request_handler({"method": "GET", "values": dict(self.VALUES, format="compact")})
+
+        fields = compact.split(";")
+        self.assertEqual(len(request_handler.Response.__dataclass_fields__), len(fields))
+        for (name, value), field in zip(response.items(), fields):
+            if isinstance(value, float):
+                self.assertAlmostEqual(value, float(field), delta=0.05)
+            else:
+                self.assertEqual("" if value is None else str(value), field)
+        self.assertLess(len(compact), len(json.dumps(response)) / 2)
+
+    def test_unknown_format(self):
+        response = request_handler.request_handler({"method": "GET", "values": dict(self.VALUES, format="xml")})
+        self.assertIsInstance(response, AssertionError)
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_percentile(self):
+        samples = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.assertEqual(3.0, benchmark.percentile(samples, 50))
+        self.assertEqual(5.0, benchmark.percentile(samples, 100))
+        self.assertAlmostEqual(4.6, benchmark.percentile(samples, 90))
+
+    def test_run_benchmark(self):
+        calls = []
+        result = benchmark.run_benchmark("append", lambda: calls.append("fn"), warmup=2, repetitions=5,
+                                         setup=lambda: calls.append("setup"))
+
+        # warm-up, timed and memory runs, each after its setup
+        self.assertEqual(["setup", "fn"] * 8, calls)
+        self.assertEqual(5, result.repetitions)
+        self.assertLessEqual(result.min, result.p50)
+        self.assertLessEqual(result.p50, result.p99)
+        self.assertLessEqual(result.p99, result.max)
+
+    def test_baseline_regressions(self):
+        fast = benchmark.run_benchmark("sleep", lambda: None, warmup=0, repetitions=3)
+        slow = benchmark.run_benchmark("sleep", lambda: time.sleep(0.01), warmup=0, repetitions=3)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            baseline_file_path = os.path.join(temp_dir, "baseline.json")
+            benchmark.save_baseline([fast], baseline_file_path)
+            baseline = benchmark.load_baseline(baseline_file_path)
+
+        self.assertEqual(fast, baseline["sleep"])
+        self.assertEqual([], benchmark.find_regressions([fast], baseline))
+        self.assertEqual(["sleep"], [regression.name for regression in benchmark.find_regressions([slow], baseline)])
+
+    def test_cached_handler_hits(self):
+        response_cache.get_response_cache().clear()
+        stats = response_cache.get_response_cache().stats
+        hits, misses = stats.hits, stats.misses
+        benchmark.run_suite(warmup=1, repetitions=20, only=["request_handler_cached"])
+
+        # the primed requests miss, then the warm-up, timed and memory calls all hit
+        self.assertEqual(benchmark.CACHED_REQUESTS, stats.misses - misses)
+        self.assertEqual(1 + 20 + 1, stats.hits - hits)
+
+    def test_compare_cache_vs_no_cache_keeps_data_files(self):
+        modified = [os.path.getmtime(file_path) for file_path in (GRAPH_JSON_FILE_PATH, APSP_JSON_FILE_PATH)]
+        graph_utils.compare_cache_vs_no_cache(repetitions=1)
+        self.assertEqual(modified, [os.path.getmtime(file_path)
+                                    for file_path in (GRAPH_JSON_FILE_PATH, APSP_JSON_FILE_PATH)])
+
+
+class SyntheticCampusTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.spec = synthetic.CampusSpec(num_buildings=7, num_floors=3, nodes_per_floor=10, seed=3)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_campus_is_parsed_and_connected(self):
+        polygons, graph = synthetic.load_campus(synthetic.generate_campus(self.spec, self.temp_dir.name))
+
+        self.assertEqual(self.spec.num_buildings, len(polygons))
+        self.assertEqual(self.spec.num_nodes, len(graph.get_node_ids()))
+        self.assertEqual({synthetic.building_name(i) for i in range(self.spec.num_buildings)},
+                         set(graph.get_building_names()))
+        dist, _ = graph.search_from_nodes({"1.0.1.b"})
+        self.assertEqual(self.spec.num_nodes, len(dist))
+
+    def test_same_seed_same_files(self):
+        first = synthetic.generate_campus(self.spec, os.path.join(self.temp_dir.name, "first"))
+        second = synthetic.generate_campus(self.spec, os.path.join(self.temp_dir.name, "second"))
+        other = synthetic.generate_campus(synthetic.CampusSpec(num_buildings=7, num_floors=3, nodes_per_floor=10,
+                                                               seed=4), os.path.join(self.temp_dir.name, "other"))
+
+        for file_path_1, file_path_2 in zip(first.edges, second.edges):
+            with open(file_path_1) as f1, open(file_path_2) as f2:
+                self.assertEqual(f1.read(), f2.read())
+        with open(first.edges[0]) as f1, open(other.edges[0]) as f2:
+            self.assertNotEqual(f1.read(), f2.read())
+
+    def test_invalid_spec(self):
+        with self.assertRaises(ValueError):
+            synthetic.CampusSpec(corridor_density=1.5)
+
+
+class InstrumentationTests(unittest.TestCase):
+    VALUES = {"user_id": "a", "lat": "42.3594", "lon": "-71.0920", "current_floor": "1", "destination": "2",
+              "destination_floor": "1"}
+
+    def setUp(self):
+        instrumentation.reset()
+        response_cache.get_response_cache().clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+        self.temp_dir.cleanup()
+
+    def test_disabled_records_nothing(self):
+        request_handler.request_handler({"method": "GET", "values": self.VALUES})
+        self.assertEqual({"enabled": False, "stages": {}, "counters": {}}, instrumentation.get_snapshot())
+
+    def test_request_stages(self):
+        instrumentation.enable()
+        request_handler.request_handler({"method": "GET", "values": self.VALUES})
+        request_handler.request_handler({"method": "GET", "values": self.VALUES})
+
+        snapshot = instrumentation.get_snapshot()
+        for stage in ("parse", "graph_components", "response_cache", "route", "get_current_building", "response",
+                      "serialize"):
+            self.assertIn(stage, snapshot["stages"])
+        self.assertEqual(2, snapshot["stages"]["parse"]["count"])
+        self.assertEqual(1, snapshot["stages"]["serialize"]["count"])
+        self.assertEqual(1, snapshot["counters"]["response_cache_hits"])
+
+    def test_search_counters(self):
+        _, graph = graph_utils.create_all_graph_components(use_cache=False)
+        instrumentation.enable()
+
+        graph.find_shortest_path("1.1.1.b", "2", 1)
+        stats = graph_utils.SearchStats()
+        graph.find_route_to_nodes("1.1.1.b", graph.get_nodes_by_building_and_floor_and_type(
+            "2", 1, graph_utils.NodeType.BUILDING), stats)
+        graph.apsp_cache[("1.1.1.b", "2", 1)] = graph.find_shortest_path("1.1.1.b", "2", 1, use_cache=False)
+        graph.find_shortest_path("1.1.1.b", "2", 1)
+
+        counters = instrumentation.get_snapshot()["counters"]
+        # the use_cache=False search is neither a hit nor a miss
+        self.assertEqual((1, 1, 2), (counters["apsp_cache_hits"], counters["apsp_cache_misses"],
+                                     counters["searches"]))
+        self.assertEqual(3 * stats.nodes_expanded, counters["nodes_settled"])
+        self.assertEqual(3 * stats.nodes_pushed, counters["heap_pushes"])
+
+    def test_next_hop_table_hits_are_not_misses(self):
+        _, graph = graph_utils.create_all_graph_components(use_cache=False)
+        graph.next_hop_table = graph.build_next_hop_table()
+        instrumentation.enable()
+
+        graph.find_shortest_path("1.1.1.b", "2", 1)
+
+        counters = instrumentation.get_snapshot()["counters"]
+        self.assertEqual(1, counters["next_hop_table_hits"])
+        self.assertNotIn("apsp_cache_misses", counters)
+        self.assertNotIn("searches", counters)
+
+    def test_trace_log(self):
+        trace_log_file_path = os.path.join(self.temp_dir.name, "trace.jsonl")
+        instrumentation.enable(trace_log_file_path)
+        request_handler.request_handler({"method": "GET", "values": self.VALUES})
+        request_handler.request_handler({"method": "GET", "values": dict(self.VALUES, lat="north")})
+
+        with open(trace_log_file_path) as f:
+            traces = [json.loads(line) for line in f]
+        self.assertEqual(2, len(traces))
+        self.assertEqual({"current_floor": "1", "destination": "2", "destination_floor": "1"}, traces[0]["values"])
+        self.assertIn("route", traces[0]["stages"])
+        self.assertGreaterEqual(traces[0]["total"], sum(traces[0]["stages"].get(stage, 0.0)
+                                                         for stage in ("parse", "route", "serialize")))
+        self.assertNotIn("route", traces[1]["stages"])
+
+    def test_trace_fields_only_built_when_tracing(self):
+        trace_values = request_handler.trace_values
+        calls = []
+        request_handler.trace_values = lambda values: calls.append(values) or trace_values(values)
+        try:
+            instrumentation.enable()
+            request_handler.request_handler({"method": "GET", "values": self.VALUES})
+            self.assertEqual([], calls)
+
+            instrumentation.enable(os.path.join(self.temp_dir.name, "trace.jsonl"))
+            request_handler.request_handler({"method": "GET", "values": self.VALUES})
+            self.assertEqual([self.VALUES], calls)
+        finally:
+            request_handler.trace_values = trace_values
+
+    def test_trace_locations_opt_in(self):
+        trace_log_file_path = os.path.join(self.temp_dir.name, "trace.jsonl")
+        instrumentation.enable(trace_log_file_path, trace_locations=True)
+        request_handler.request_handler({"method": "GET", "values": self.VALUES})
+        instrumentation.disable()
+
+        with open(trace_log_file_path) as f:
+            traces = [json.loads(line) for line in f]
+        self.assertEqual(self.VALUES, traces[0]["values"])
+
+
+class WktIngestionTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_geometry_body(self):
+        self.assertEqual("-71.09 42.35, -71.08 42.36", wkt.geometry_body("LINESTRING (-71.09 42.35, -71.08 42.36)"))
+        self.assertEqual("-71.09 42.35", wkt.geometry_body("POINT(-71.09 42.35)"))
+        self.assertEqual("1 2, 3 4, 1 2", wkt.geometry_body("POLYGON ((1 2, 3 4, 1 2))"))
+        with self.assertRaises(ValueError):
+            wkt.geometry_body("-71.09 42.35")
+        with self.assertRaises(ValueError):
+            wkt.geometry_body("POLYGON ((1 2, 3 4, 1 2), (5 6, 7 8, 5 6))")
+
+    def test_parse_coordinates(self):
+        wkts = ["POINT (-71.0920001 42.3590002)", "LINESTRING (1.5 2.5, 3 4, 5 6)"]
+        coordinates, offsets = wkt.parse_coordinates(wkts)
+
+        self.assertEqual([0, 1, 4], offsets.tolist())
+        self.assertEqual([[float("-71.0920001"), float("42.3590002")], [1.5, 2.5], [3, 4], [5, 6]],
+                         coordinates.tolist())
+        for wkts in (["LINESTRING (1 2, 3)"], ["POINT (1 2 3)", "POINT (4)"], ["LINESTRING (1 2 3, 4)"],
+                     ["POINT ()"], ["LINESTRING (1 2,, 3 4)"], ["POINT (1 north)"]):
+            with self.assertRaises(ValueError):
+                wkt.parse_coordinates(wkts)
+
+    def test_chunks_match_whole_file(self):
+        chunks = list(wkt.read_geometries(EDGES_1_CSV_FILE_PATH, chunk_size=7))
+        (names, coordinates, offsets), = wkt.read_geometries(EDGES_1_CSV_FILE_PATH, chunk_size=10 ** 6)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(names, [name for chunk in chunks for name in chunk[0]])
+        self.assertEqual(coordinates.tolist(), [pair for chunk in chunks for pair in chunk[1].tolist()])
+
+    def test_streamed_graph_matches_lists(self):
+        polygons = graph_utils.parse_polygons(POLYGONS_CSV_FILE_PATH)
+        nodes = graph_utils.parse_nodes(NODES_1_CSV_FILE_PATH, polygons, 0)
+        edges = graph_utils.parse_edges(EDGES_1_CSV_FILE_PATH, nodes)
+        graph = graph_utils.create_graph(nodes, edges, num_floors=1)
+
+        streamed = graph_utils.create_graph(
+            graph_utils.iter_nodes(NODES_1_CSV_FILE_PATH, polygons, 0),
+            graph_utils.iter_edges(EDGES_1_CSV_FILE_PATH, graph_utils.locations_to_node_ids(nodes)), num_floors=1)
+        self.assertEqual(graph.compute_fingerprint(), streamed.compute_fingerprint())
+
+    def test_unknown_edge_endpoint(self):
+        edges_csv_file_path = os.path.join(self.temp_dir.name, "edges.csv")
+        with open(edges_csv_file_path, "w", newline="") as f:
+            csv.writer(f).writerows([["WKT", "name", "description"], ["LINESTRING (1 2, 3 4)", "1", ""]])
+
+        with self.assertRaises(KeyError):
+            list(graph_utils.iter_edges(edges_csv_file_path, {(2.0, 1.0): "1.0.1.b"}))
+
+
 if __name__ == "__main__":
     res = unittest.main(verbosity=3, exit=False)
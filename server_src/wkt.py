@@ -0,0 +1,81 @@
+"""
+Streaming reader for the WKT CSV exports (polygons, nodes and edges).
+
+Rows are read lazily in chunks of CHUNK_SIZE, so a file is never held in memory as a whole, and the coordinates of a
+chunk are parsed in one pass into a NumPy array instead of one split / float per token. The geometry body is found
+from its parentheses, whatever the tag (POINT, LINESTRING, POLYGON) and spacing, rather than from fixed offsets.
+"""
+import csv
+import re
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+CHUNK_SIZE = 4096  # rows parsed together
+
+Chunk = Tuple[List[str], np.ndarray, np.ndarray]  # (names, (lon, lat) coordinates, offsets into coordinates)
+
+# comma separated "lon lat" pairs, the values themselves are checked by the float conversion
+_COORDINATE = r"\s*[^\s,]+\s+[^\s,]+\s*"
+_BODY = re.compile(f"{_COORDINATE}(?:,{_COORDINATE})*")
+
+
+def read_rows(csv_file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[List[str], List[str]]]:
+    """
+    Yields the (WKT strings, names) of the data rows, chunk_size rows at a time. The header row is skipped.
+    """
+    with open(csv_file_path, newline="") as f:
+        csv_reader = csv.reader(f, delimiter=",")
+        next(csv_reader, None)
+
+        wkts, names = [], []
+        for row in csv_reader:
+            if not row:
+                continue
+            wkts.append(row[0])
+            names.append(row[1])
+            if len(wkts) == chunk_size:
+                yield wkts, names
+                wkts, names = [], []
+        if wkts:
+            yield wkts, names
+
+
+def geometry_body(wkt: str) -> str:
+    """
+    "LINESTRING (-71.09 42.35, -71.08 42.36)" -> "-71.09 42.35, -71.08 42.36". Only geometries with a single ring or
+    line of 'lon lat' pairs are supported.
+    """
+    start = wkt.find("(")
+    if start == -1:
+        raise ValueError(f"Malformed WKT {wkt!r}")
+    body = wkt[start:].strip().strip("()")
+    if "(" in body or ")" in body:
+        raise ValueError(f"Unsupported WKT with several rings or parts {wkt!r}")
+    if _BODY.fullmatch(body) is None:
+        raise ValueError(f"Every WKT coordinate must be a 'lon lat' pair {wkt!r}")
+    return body
+
+
+def parse_coordinates(wkts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (lon, lat) pairs of every geometry in wkts as one (n, 2) array, and the offsets of each geometry's
+    first pair: the pairs of wkts[i] are coordinates[offsets[i]:offsets[i + 1]].
+    """
+    bodies = [geometry_body(wkt) for wkt in wkts]
+    counts = np.fromiter((body.count(",") + 1 for body in bodies), dtype=np.int64, count=len(bodies))
+    offsets = np.zeros(len(bodies) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # geometry_body checked that every body is made of pairs, so the values line up with offsets
+    values = np.array(",".join(bodies).replace(",", " ").split(), dtype=float)
+    return values.reshape(-1, 2), offsets
+
+
+def read_geometries(csv_file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Chunk]:
+    """
+    Yields (names, coordinates, offsets) chunk by chunk, see parse_coordinates
+    """
+    for wkts, names in read_rows(csv_file_path, chunk_size):
+        coordinates, offsets = parse_coordinates(wkts)
+        yield names, coordinates, offsets
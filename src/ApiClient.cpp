@@ -347,7 +347,8 @@ StaticJsonDocument<500> ApiClient::fetch_navigation_instructions(char* user_id,
     offset += sprintf(request + offset, "lat=%f&lon=%f&", lat, lon);
     offset += sprintf(request + offset, "current_floor=%d&", current_floor);
     offset += sprintf(request + offset, "destination=%s&", destination);
-    offset += sprintf(request + offset, "destination_floor=%d  HTTP/1.1\r\n", destination_floor);
+    offset += sprintf(request + offset, "destination_floor=%d&", destination_floor);
+    offset += sprintf(request + offset, "format=compact  HTTP/1.1\r\n");
     strcat(request, "Host: 608dev-2.net\r\n");
     strcat(request, "\r\n");
 
@@ -355,10 +356,47 @@ StaticJsonDocument<500> ApiClient::fetch_navigation_instructions(char* user_id,
 
     // Parsing response
     StaticJsonDocument<500> doc;
-    DeserializationError error = deserializeJson(doc, response);
-    if (error) {
-        Serial.print("fetch_client_navigation() - deserializeJson() failed: ");
-        Serial.println(error.c_str());
+    if (!parse_compact_response(response, doc)) {
+        Serial.print("fetch_client_navigation() - parse_compact_response() failed: ");
+        Serial.println(response);
     }
     return doc;
 }
+
+/*----------------------------------
+   parse_compact_response: splits a format=compact navigation response in place and fills doc with the same fields
+   as the JSON response:
+      curr_building;next_building;curr_node;next_node;dist_next_node;dir_next_node;has_arrived;eta;dest_node;dest_building
+   Arguments:
+    * `char* response`: null-terminated response body, its ';' are replaced by null terminators
+    * `StaticJsonDocument<500>& doc`: output, its strings point into response
+   Return value:
+      true if the response had every field
+*/
+bool ApiClient::parse_compact_response(char* response, StaticJsonDocument<500>& doc) {
+    char* fields[COMPACT_RESPONSE_FIELDS];
+    int num_fields = 0;
+    char* field = response;
+    while (num_fields < COMPACT_RESPONSE_FIELDS) {
+        fields[num_fields++] = field;
+        char* end = strpbrk(field, ";\r\n");
+        if (end == NULL) break;
+        bool last = *end != ';';
+        *end = '\0';
+        if (last) break;
+        field = end + 1;
+    }
+    if (num_fields != COMPACT_RESPONSE_FIELDS) return false;
+
+    doc["curr_building"] = (const char*) fields[0];
+    doc["next_building"] = (const char*) fields[1];
+    doc["curr_node"] = (const char*) fields[2];
+    doc["next_node"] = (const char*) fields[3];
+    doc["dist_next_node"] = atof(fields[4]);
+    doc["dir_next_node"] = atof(fields[5]);
+    doc["has_arrived"] = atoi(fields[6]) != 0;
+    doc["eta"] = atof(fields[7]);
+    doc["dest_node"] = (const char*) fields[8];
+    doc["dest_building"] = (const char*) fields[9];
+    return true;
+}
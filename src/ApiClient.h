@@ -11,6 +11,7 @@
 const uint16_t IN_BUFFER_SIZE = 5000;  // size of buffer to hold HTTP request
 const uint16_t OUT_BUFFER_SIZE = 5000; // size of buffer to hold HTTP response
 const uint16_t JSON_BODY_SIZE = 5000;
+const uint8_t COMPACT_RESPONSE_FIELDS = 10; // fields of a format=compact navigation response
 
 class ApiClient {
 
@@ -43,6 +44,7 @@ class ApiClient {
     static int len;
 
     uint8_t char_append(char *buff, char c, uint16_t buff_size);
+    bool parse_compact_response(char* response, StaticJsonDocument<500>& doc);
 public:
     ApiClient();
     void initialize_wifi_connection();